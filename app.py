@@ -4,19 +4,46 @@
 集成 XHS-Downloader API + Coze 工作流 API
 """
 
-from fastapi import FastAPI, HTTPException, Body, UploadFile, File
+from fastapi import FastAPI, HTTPException, Body, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from dotenv import load_dotenv
+try:
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.exceptions import MultipartParseError
+    from multipart.multipart import MultipartParser, parse_options_header
 import os
 import tempfile
 import json
+import hashlib
 import re
+import shutil
 import time
-import requests
+import asyncio
+import contextvars
+import sqlite3
+import threading
+import socket
+import ipaddress
+import importlib.util
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import urljoin, urlsplit, urlunsplit
+import httpx
+import httpcore
 import random
+import uuid
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 from datetime import datetime
 
+import asr_worker
+
 load_dotenv()
 
 # ============================================================
@@ -27,9 +54,169 @@ load_dotenv()
 XHS_DOWNLOADER_API = os.getenv("XHS_DOWNLOADER_API", "http://127.0.0.1:5556")
 
 # Coze Workflow API
-COZE_API_URL = "https://api.coze.cn/v1/workflow/stream_run"
+COZE_API_URL = os.getenv("COZE_API_URL", "https://api.coze.cn/v1/workflow/stream_run")
 COZE_API_TOKEN = os.getenv("COZE_API_TOKEN", "")
 COZE_WORKFLOW_ID = os.getenv("COZE_WORKFLOW_ID", "7604404057922469922")
+COZE_TIMEOUT = float(os.getenv("COZE_TIMEOUT", "120"))
+# Size of the shared keep-alive pool used for concurrent Coze streams
+COZE_MAX_CONNECTIONS = int(os.getenv("COZE_MAX_CONNECTIONS", "64"))
+# Log every decoded SSE event (off by default: per-event logging is costly)
+COZE_DEBUG = os.getenv("COZE_DEBUG", "").lower() in ("1", "true", "yes")
+
+# Coze admission control: token bucket (requests/s + burst), AIMD concurrency
+# limit, bounded wait queue, and the time-to-first-byte considered "slow"
+COZE_RATE_PER_SEC = float(os.getenv("COZE_RATE_PER_SEC", "5"))
+COZE_RATE_BURST = int(os.getenv("COZE_RATE_BURST", "10"))
+COZE_CONCURRENCY_INITIAL = int(os.getenv("COZE_CONCURRENCY_INITIAL", "8"))
+COZE_CONCURRENCY_MAX = int(os.getenv("COZE_CONCURRENCY_MAX", str(COZE_MAX_CONNECTIONS)))
+COZE_QUEUE_MAX = int(os.getenv("COZE_QUEUE_MAX", "200"))
+COZE_LATENCY_TARGET = float(os.getenv("COZE_LATENCY_TARGET", "15"))
+
+# Coze retries (transient errors only) and circuit breaker
+COZE_MAX_RETRIES = int(os.getenv("COZE_MAX_RETRIES", "3"))
+COZE_BACKOFF_BASE = float(os.getenv("COZE_BACKOFF_BASE", "1"))
+COZE_BACKOFF_MAX = float(os.getenv("COZE_BACKOFF_MAX", "20"))
+COZE_BREAKER_FAILURES = int(os.getenv("COZE_BREAKER_FAILURES", "5"))
+COZE_BREAKER_COOLDOWN = float(os.getenv("COZE_BREAKER_COOLDOWN", "30"))
+
+# Hedged Coze requests: if no SSE event arrives within the given percentile
+# of observed first-event latency (COZE_HEDGE_DELAY until enough samples),
+# a second request is raced against the first
+COZE_HEDGE_ENABLED = os.getenv("COZE_HEDGE_ENABLED", "").lower() in ("1", "true", "yes")
+COZE_HEDGE_PERCENTILE = float(os.getenv("COZE_HEDGE_PERCENTILE", "95"))
+COZE_HEDGE_DELAY = float(os.getenv("COZE_HEDGE_DELAY", "20"))
+COZE_HEDGE_DELAY_MIN = float(os.getenv("COZE_HEDGE_DELAY_MIN", "3"))
+
+# Batch extraction: max links per batch
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+
+# Durable job queue (SQLite under XHS_CACHE_DIR): worker count, lease length
+# (renewed every third of it while a job runs), attempts per job, retry
+# backoff base, idle poll interval and how long finished jobs are kept
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "5"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+# XHS-Downloader note info: its own timeout, and how long a finished
+# transcript may still wait for it before being returned without it
+XHS_NOTE_INFO_TIMEOUT = float(os.getenv("XHS_NOTE_INFO_TIMEOUT", "8"))
+XHS_NOTE_INFO_GRACE = float(os.getenv("XHS_NOTE_INFO_GRACE", "0.5"))
+
+# Background health probes for XHS-Downloader and Coze: interval between
+# rounds, per-probe timeout, number of results kept for availability stats,
+# and how many consecutive failed real calls mark a dependency down before
+# the next probe does
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "15"))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "5"))
+HEALTH_PROBE_WINDOW = int(os.getenv("HEALTH_PROBE_WINDOW", "40"))
+HEALTH_FAILURE_THRESHOLD = int(os.getenv("HEALTH_FAILURE_THRESHOLD", "3"))
+
+# Event loop lag monitor: sampling interval and number of samples kept
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
+LOOP_LAG_WINDOW = int(os.getenv("LOOP_LAG_WINDOW", "3000"))
+
+# Scratch space for temporary files: directory (each process writes under
+# <dir>/<pid>), byte quota (least recently used unpinned files are evicted
+# beyond it), opt-in debug page capture and how many captures are kept
+SCRATCH_DIR = os.getenv("XHS_SCRATCH_DIR") or os.path.join(tempfile.gettempdir(), "xhs-scratch")
+SCRATCH_QUOTA_MB = int(os.getenv("SCRATCH_QUOTA_MB", "2048"))
+SCRATCH_DEBUG_CAPTURE = os.getenv("SCRATCH_DEBUG_CAPTURE", "").lower() in ("1", "true", "yes")
+SCRATCH_DEBUG_ITEMS = int(os.getenv("SCRATCH_DEBUG_ITEMS", "20"))
+
+# Video downloads: parallel range connections, range size, read buffer,
+# and the file size below which a single connection is used
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", "4"))
+DOWNLOAD_PART_MB = int(os.getenv("DOWNLOAD_PART_MB", "4"))
+DOWNLOAD_BUFFER_KB = int(os.getenv("DOWNLOAD_BUFFER_KB", "256"))
+DOWNLOAD_PARALLEL_MIN_MB = int(os.getenv("DOWNLOAD_PARALLEL_MIN_MB", "8"))
+
+# Video CDN mirrors: hosts a video may be fetched from, EWMA weight for
+# first-byte and throughput samples, how long the best mirror may take to
+# answer before a second one is raced, and the failure count / cooldown
+# after which a mirror is skipped
+CDN_MIRRORS = os.getenv(
+    "XHS_CDN_MIRRORS",
+    "sns-video-qc.xhscdn.com,sns-video-hw.xhscdn.com,sns-video-bd.xhscdn.com,sns-video-al.xhscdn.com",
+)
+CDN_EWMA_ALPHA = float(os.getenv("CDN_EWMA_ALPHA", "0.3"))
+CDN_RACE_DELAY = float(os.getenv("CDN_RACE_DELAY", "1.0"))
+CDN_MIRROR_FAILURES = int(os.getenv("CDN_MIRROR_FAILURES", "3"))
+CDN_MIRROR_COOLDOWN = float(os.getenv("CDN_MIRROR_COOLDOWN", "60"))
+
+# Outbound HTTP layer (everything except Coze): concurrent requests per
+# host, DNS cache TTL, and HTTP/2 (needs the h2 package, which start.sh
+# does not install; ignored with a warning when it is missing)
+OUTBOUND_MAX_PER_HOST = int(os.getenv("OUTBOUND_MAX_PER_HOST", "8"))
+OUTBOUND_DNS_TTL = float(os.getenv("OUTBOUND_DNS_TTL", "300"))
+OUTBOUND_HTTP2 = os.getenv("OUTBOUND_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# Whisper ASR: model used for transcription, and comma separated models
+# to load and warm up at startup (empty: load on first use)
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+WHISPER_PRELOAD_MODELS = [name.strip() for name in os.getenv("WHISPER_PRELOAD_MODELS", "").split(",")
+                          if name.strip()]
+
+# ASR process pool: worker processes (default: one per 4 CPUs, at most 4,
+# so VAD segments of one upload run in parallel), numeric threads per
+# worker, and how many jobs may wait beyond the running ones before uploads
+# get HTTP 503. Each worker loads its own copy of every Whisper model it
+# uses, so memory grows linearly with workers: roughly 0.4GB resident per
+# worker for base, 1.2GB for small, 3.5GB for medium and 7GB for large
+# (fp32 weights plus PyTorch overhead). /api/check-services reports each
+# worker's measured rss_delta_mb; set ASR_WORKERS explicitly to go past 4.
+ASR_WORKERS = int(os.getenv("ASR_WORKERS") or min(4, max(1, (os.cpu_count() or 1) // 4)))
+ASR_THREADS_PER_WORKER = int(os.getenv("ASR_THREADS_PER_WORKER") or max(1, (os.cpu_count() or 2) // ASR_WORKERS))
+ASR_QUEUE_SIZE = int(os.getenv("ASR_QUEUE_SIZE", "4"))
+
+# Segmented ASR: audio is split at silences into segments of at most this
+# many seconds, transcribed in parallel across the ASR workers (0: send the
+# whole clip to one worker), and pauses shorter than ASR_VAD_MIN_SILENCE
+# seconds do not split speech
+ASR_SEGMENT_SECONDS = float(os.getenv("ASR_SEGMENT_SECONDS", "30"))
+ASR_VAD_MIN_SILENCE = float(os.getenv("ASR_VAD_MIN_SILENCE", "0.3"))
+
+# Link extraction falls back to downloading the video and transcribing it
+# with the local Whisper pool when Coze is unavailable (off by default:
+# it needs ffmpeg and Whisper installed)
+ASR_URL_FALLBACK = os.getenv("ASR_URL_FALLBACK", "false").lower() in ("1", "true", "yes")
+
+# Video uploads: size limit (checked while the body is written) and the
+# chunk size used to copy it to disk
+UPLOAD_MAX_MB = int(os.getenv("UPLOAD_MAX_MB", "500"))
+UPLOAD_MAX_BYTES = UPLOAD_MAX_MB * 1024 * 1024
+UPLOAD_CHUNK_KB = int(os.getenv("UPLOAD_CHUNK_KB", "1024"))
+
+# ffmpeg/ffprobe executables used for audio decoding, the longest audio
+# accepted, and the duration from which decoding goes to a memory-mapped
+# buffer under the scratch directory instead of RAM
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+FFPROBE_BIN = os.getenv("FFPROBE_BIN", "ffprobe")
+ASR_MAX_SECONDS = float(os.getenv("ASR_MAX_SECONDS", "900"))
+ASR_MEMMAP_SECONDS = float(os.getenv("ASR_MEMMAP_SECONDS", "600"))
+
+# Local cache storage (SQLite files live here)
+CACHE_DIR = os.getenv("XHS_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+# xhslink.com short-link resolution: cache TTL, cache size, request timeout
+XHS_LINK_CACHE_TTL = int(os.getenv("XHS_LINK_CACHE_TTL", str(12 * 3600)))
+XHS_LINK_CACHE_ITEMS = int(os.getenv("XHS_LINK_CACHE_ITEMS", "10000"))
+XHS_LINK_TIMEOUT = float(os.getenv("XHS_LINK_TIMEOUT", "10"))
+
+# Transcript cache: TTL in seconds, in-memory LRU size, on-disk row limit
+TRANSCRIPT_CACHE_TTL = int(os.getenv("TRANSCRIPT_CACHE_TTL", str(7 * 24 * 3600)))
+TRANSCRIPT_CACHE_MEMORY_ITEMS = int(os.getenv("TRANSCRIPT_CACHE_MEMORY_ITEMS", "512"))
+TRANSCRIPT_CACHE_DISK_ITEMS = int(os.getenv("TRANSCRIPT_CACHE_DISK_ITEMS", "20000"))
+
+# XHS-Downloader note info cache (keyed by note ID, compressed on disk):
+# TTL in seconds, in-memory LRU size, on-disk row limit, and how many
+# notes a prefetch fetches at once
+NOTE_INFO_CACHE_TTL = int(os.getenv("NOTE_INFO_CACHE_TTL", str(24 * 3600)))
+NOTE_INFO_CACHE_MEMORY_ITEMS = int(os.getenv("NOTE_INFO_CACHE_MEMORY_ITEMS", "1024"))
+NOTE_INFO_CACHE_DISK_ITEMS = int(os.getenv("NOTE_INFO_CACHE_DISK_ITEMS", "50000"))
+NOTE_INFO_PREFETCH_CONCURRENCY = int(os.getenv("NOTE_INFO_PREFETCH_CONCURRENCY", "4"))
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -51,355 +238,1827 @@ app.add_middleware(
 # Coze API Integration
 # ============================================================
 
-def call_coze_api(video_url):
+_coze_client = None
+
+
+def get_coze_client() -> httpx.AsyncClient:
+    """Return the shared keep-alive client used for every Coze call."""
+    global _coze_client
+    if _coze_client is None or _coze_client.is_closed:
+        _coze_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(COZE_TIMEOUT, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=COZE_MAX_CONNECTIONS,
+                max_keepalive_connections=COZE_MAX_CONNECTIONS,
+                keepalive_expiry=60.0,
+            ),
+        )
+    return _coze_client
+
+
+@app.on_event("shutdown")
+async def close_coze_client():
+    """Release pooled Coze connections when the server stops."""
+    if _coze_client is not None and not _coze_client.is_closed:
+        await _coze_client.aclose()
+
+
+class UpstreamUnavailableError(Exception):
+    """An upstream cannot take the call right now; maps to HTTP 503."""
+
+
+class UpstreamRejectedError(Exception):
+    """An upstream refused the request itself (auth, bad input); a retry will not help."""
+
+
+def _coze_status_error(status: int, message: str) -> Exception:
+    """Error for a failed Coze HTTP status: 4xx other than 408/429 is not retryable."""
+    if 400 <= status < 500 and status not in (408, 429):
+        return UpstreamRejectedError(message)
+    return Exception(message)
+
+
+class CozeOverloadedError(UpstreamUnavailableError):
+    """Raised when the Coze wait queue is full."""
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+
+class AdaptiveRateGovernor:
     """
-    调用Coze API提取小红书视频文案
+    Process-wide admission control for an upstream API.
+
+    A token bucket paces how fast calls start and an AIMD limit caps how
+    many run at once. Both are cut multiplicatively on HTTP 429 (the limit
+    alone on slow first bytes) and grow additively while calls succeed, so
+    they settle near the rate the upstream actually sustains. Callers over
+    the limit wait in a FIFO queue; once `max_queue` are waiting, new
+    callers are rejected with CozeOverloadedError.
     """
-    try:
-        print(f"开始调用Coze API，视频URL：{video_url}")
 
-        # 构建请求数据
-        payload = {
-            "workflow_id": COZE_WORKFLOW_ID,
-            "parameters": {
-                "input": video_url
-            }
+    def __init__(self, rate: float, burst: int, initial_limit: int, max_limit: int,
+                 max_queue: int, latency_target: float,
+                 min_rate: float = 0.2, min_limit: int = 1):
+        self.rate = rate
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.limit = float(min(initial_limit, max_limit))
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.max_queue = max_queue
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self._last_refill = time.monotonic()
+        self._waiters = deque()
+        self.stats = {"admitted": 0, "rejected": 0, "throttled": 0, "slow": 0}
+
+    async def acquire(self):
+        """Wait for a concurrency slot and a rate token."""
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+        else:
+            if len(self._waiters) >= self.max_queue:
+                self.stats["rejected"] += 1
+                raise CozeOverloadedError("Coze请求排队已满，请稍后重试")
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter  # the slot is handed over by _wake()
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release_slot()
+                elif waiter in self._waiters:
+                    # _wake() may already have popped (and skipped) it
+                    self._waiters.remove(waiter)
+                raise
+        try:
+            await self._take_token()
+        except BaseException:
+            self._release_slot()
+            raise
+        self.stats["admitted"] += 1
+
+    def release(self, latency=None, throttled: bool = False):
+        """
+        Return a slot and feed back the outcome: `latency` is the time to
+        the response headers (None if the call never got a response).
+        """
+        if throttled:
+            self.stats["throttled"] += 1
+            self.limit = max(self.min_limit, self.limit / 2)
+            self.rate = max(self.min_rate, self.rate / 2)
+        elif latency is not None and latency > self.latency_target:
+            self.stats["slow"] += 1
+            self.limit = max(self.min_limit, self.limit * 0.9)
+        elif latency is not None:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+        self._release_slot()
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    async def _take_token(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def snapshot(self) -> dict:
+        return {
+            "concurrency_limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "rate_per_sec": round(self.rate, 3),
+            **self.stats,
         }
 
-        # 设置请求头
-        headers = {
-            "Authorization": f"Bearer {COZE_API_TOKEN}",
-            "Content-Type": "application/json"
-        }
 
-        # 发送POST请求
-        response = requests.post(
+coze_governor = AdaptiveRateGovernor(
+    rate=COZE_RATE_PER_SEC,
+    burst=COZE_RATE_BURST,
+    initial_limit=COZE_CONCURRENCY_INITIAL,
+    max_limit=COZE_CONCURRENCY_MAX,
+    max_queue=COZE_QUEUE_MAX,
+    latency_target=COZE_LATENCY_TARGET,
+)
+
+
+@asynccontextmanager
+async def _coze_stream_request(parameters: dict):
+    """
+    Open a streaming `stream_run` call; use as `async with`. Every Coze
+    call is admitted through coze_governor and reports its outcome to it.
+    """
+    await coze_governor.acquire()
+    start = time.monotonic()
+    latency = None
+    throttled = False
+    try:
+        async with get_coze_client().stream(
+            "POST",
             COZE_API_URL,
-            json=payload,
-            headers=headers,
-            timeout=120,
-            stream=True
-        )
+            headers={
+                "Authorization": f"Bearer {COZE_API_TOKEN}",
+                "Content-Type": "application/json",
+            },
+            json={
+                "workflow_id": COZE_WORKFLOW_ID,
+                "parameters": parameters,
+            },
+        ) as response:
+            latency = time.monotonic() - start
+            throttled = response.status_code == 429
+            yield response
+    finally:
+        coze_governor.release(latency, throttled)
 
-        print(f"Coze API响应状态码：{response.status_code}")
-        print(f"响应头：{dict(response.headers)}")
 
-        # 检查响应状态
-        if response.status_code != 200:
-            error_msg = f"Coze API调用失败，状态码：{response.status_code}"
-            try:
-                error_data = response.json()
-                error_msg += f"，错误信息：{error_data.get('msg', '未知错误')}"
-            except:
-                pass
-            raise Exception(error_msg)
+class SSEEvent:
+    """One decoded server-sent event."""
 
-        # 处理流式响应（SSE格式）
-        script = ""
-        current_event = None
-        current_data = ""
+    __slots__ = ("event", "data", "id")
 
-        for line in response.iter_lines():
-            if line:
-                line_str = line.decode('utf-8').strip()
-                print(f"收到响应行：{line_str[:200]}")
+    def __init__(self, event: str, data: str, id=None):
+        self.event = event
+        self.data = data
+        self.id = id
 
-                # 跳过空行
-                if not line_str:
-                    continue
+    def __repr__(self):
+        return f"SSEEvent(event={self.event!r}, data={self.data[:80]!r}, id={self.id!r})"
 
-                # 解析SSE格式的行
-                if line_str.startswith('id:'):
-                    continue
-                elif line_str.startswith('event:'):
-                    current_event = line_str[6:].strip()
-                    print(f"当前事件：{current_event}")
-                elif line_str.startswith('data:'):
-                    current_data = line_str[5:].strip()
-                    print(f"当前数据：{current_data[:200]}")
-
-                    # 尝试解析JSON数据
-                    try:
-                        data = json.loads(current_data)
-                        print(f"解析后的数据：{json.dumps(data, ensure_ascii=False)[:200]}")
-
-                        # 如果是Message事件，尝试提取文案
-                        if current_event == "Message":
-                            # 从data中提取content字段
-                            content_str = data.get("content", "")
-                            if content_str:
-                                try:
-                                    # content字段可能是一个JSON字符串
-                                    content_data = json.loads(content_str)
-                                    if isinstance(content_data, dict):
-                                        # 提取output字段中的文案
-                                        script = content_data.get("output", "")
-                                        if script:
-                                            print(f"成功提取文案：{script[:100]}...")
-                                            break
-                                except json.JSONDecodeError:
-                                    # 如果不是JSON，直接使用content
-                                    script = content_str
-                                    if script:
-                                        print(f"成功提取文案：{script[:100]}...")
-                                        break
-
-                        # 如果是Done事件，工作流执行完成
-                        elif current_event == "Done":
-                            print("工作流执行完成")
-                            break
-
-                    except json.JSONDecodeError as e:
-                        print(f"JSON解析失败：{e}")
-                        continue
-
-        # 如果没有从流式响应中提取到文案，尝试将整个响应作为文案
-        if not script or not script.strip():
-            print("尝试将整个响应作为文案")
-            response_text = response.text
-            print(f"完整响应内容：{response_text[:500]}")
 
-            try:
-                response_data = response.json()
-                if isinstance(response_data, dict):
-                    if "data" in response_data:
-                        data = response_data["data"]
-                        if isinstance(data, dict):
-                            script = data.get("content", data.get("script", data.get("text", "")))
-                        elif isinstance(data, str):
-                            script = data
-                    elif "content" in response_data:
-                        script = response_data["content"]
-                    elif "script" in response_data:
-                        script = response_data["script"]
-                    elif "text" in response_data:
-                        script = response_data["text"]
-                    elif "result" in response_data:
-                        script = response_data["result"]
-                    elif "output" in response_data:
-                        script = response_data["output"]
-                    else:
-                        script = str(response_data)
+class SSEDecoder:
+    """
+    Incremental bytes-level decoder for text/event-stream bodies.
+    Feed it raw chunks as they arrive; it returns complete events only,
+    joins multi-line `data:` fields with newlines and tolerates CRLF and
+    chunks that split lines (or UTF-8 characters) anywhere.
+    """
+
+    def __init__(self):
+        self._tail = b""
+        self._event = ""
+        self._data = []
+        self._id = None
+
+    def feed(self, chunk: bytes) -> list:
+        lines = (self._tail + chunk if self._tail else chunk).split(b"\n")
+        self._tail = lines.pop()
+        events = []
+        for line in lines:
+            if line[-1:] == b"\r":
+                line = line[:-1]
+            if not line:
+                if self._data:
+                    events.append(self._dispatch())
                 else:
-                    script = str(response_data)
-            except:
-                script = response_text
+                    self._event = ""
+            elif line[:5] == b"data:":
+                value = line[6:] if line[5:6] == b" " else line[5:]
+                self._data.append(value.decode("utf-8", "replace"))
+            else:
+                self._field(line)
+        return events
+
+    def flush(self) -> list:
+        """Return any event left unterminated when the stream ends."""
+        if self._tail:
+            line = self._tail.rstrip(b"\r")
+            self._tail = b""
+            self._field(line)
+        return [self._dispatch()] if self._data else []
+
+    def _field(self, line: bytes):
+        if line[:1] == b":":
+            return  # comment / keep-alive
+        name, sep, value = line.partition(b":")
+        if sep and value[:1] == b" ":
+            value = value[1:]
+        if name == b"data":
+            self._data.append(value.decode("utf-8", "replace"))
+        elif name == b"event":
+            self._event = value.decode("utf-8", "replace")
+        elif name == b"id":
+            self._id = value.decode("utf-8", "replace")
+
+    def _dispatch(self) -> SSEEvent:
+        data = self._data[0] if len(self._data) == 1 else "\n".join(self._data)
+        event = SSEEvent(self._event or "message", data, self._id)
+        self._event = ""
+        self._data = []
+        return event
+
+
+async def iter_coze_events(response, on_event=None):
+    """
+    Yield (event, payload) for each JSON event of a Coze SSE response,
+    with the event name lower-cased ("message", "done", ...). Error
+    events raise; logging only happens when COZE_DEBUG is on.
+    `on_event`, if given, is called once for every decoded SSE event.
+    """
+    decoder = SSEDecoder()
+    chunks = response.aiter_bytes()
+    done = False
+    while not done:
+        try:
+            events = decoder.feed(await chunks.__anext__())
+        except StopAsyncIteration:
+            events = decoder.flush()
+            done = True
+        for ev in events:
+            if on_event is not None:
+                on_event()
+            if COZE_DEBUG:
+                print(f"[Coze] SSE {ev.event}: {ev.data[:200]}")
+            if not ev.data or ev.data[0] not in "{[":
+                continue
+            try:
+                payload = json.loads(ev.data)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(payload, dict):
+                continue
+            event = ev.event.lower()
+            if event == "error" or "error_message" in payload:
+                message = payload.get("error_message") or payload.get("msg") or ev.data
+                raise Exception(f"Coze workflow error: {message}")
+            yield event, payload
+
+
+def coze_message_text(payload: dict):
+    """
+    Return (text, is_final) for a Coze event payload. Message content is
+    either a JSON string holding the workflow `output` (final) or a plain
+    text delta.
+    """
+    if "output" in payload:
+        return payload["output"] or "", True
+    content = payload.get("content")
+    if not content:
+        return "", False
+    if content[:1] == "{":
+        try:
+            parsed = json.loads(content)
+        except json.JSONDecodeError:
+            return content, False
+        if isinstance(parsed, dict) and "output" in parsed:
+            return parsed["output"] or "", True
+    return content, False
+
+
+async def iter_coze_text(response, on_event=None):
+    """
+    Yield ("delta", text) for each Message content delta as it arrives,
+    then one ("final", text) with the complete workflow output.
+    """
+    deltas = []
+    async for event, payload in iter_coze_events(response, on_event):
+        text, is_final = coze_message_text(payload)
+        if is_final:
+            yield "final", text
+            return
+        if event == "done":
+            break
+        if text:
+            deltas.append(text)
+            yield "delta", text
+    yield "final", "".join(deltas)
+
+
+async def collect_coze_output(response, on_event=None) -> str:
+    """Read a Coze SSE response to the end and return the workflow output."""
+    async for kind, text in iter_coze_text(response, on_event):
+        if kind == "final":
+            return text
+    return ""
+
+
+async def _raise_for_coze_status(response):
+    """Raise with Coze's error message when the HTTP status is not 200."""
+    if response.status_code == 200:
+        return
+    error_msg = f"Coze API调用失败，状态码：{response.status_code}"
+    try:
+        await response.aread()
+        error_msg += f"，错误信息：{response.json().get('msg', '未知错误')}"
+    except Exception:
+        pass
+    raise _coze_status_error(response.status_code, error_msg)
+
+
+async def call_coze_api(video_url):
+    """
+    调用Coze API提取小红书视频文案
+    """
+    try:
+        print(f"开始调用Coze API，视频URL：{video_url}")
+
+        async with _coze_stream_request({"input": video_url}) as response:
+            await _raise_for_coze_status(response)
+            script = await collect_coze_output(response)
 
         if not script or not script.strip():
             raise Exception("Coze API返回的文案内容为空")
 
         print(f"Coze API调用成功，文案长度：{len(script)}字符")
-        print(f"提取的文案：{script[:200]}...")
-
         return script
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         print("Coze API调用超时")
         raise Exception("Coze API调用超时，请稍后重试")
-    except requests.exceptions.RequestException as e:
+    except httpx.RequestError as e:
         print(f"Coze API请求失败：{str(e)}")
         raise Exception(f"Coze API请求失败：{str(e)}")
+    except (UpstreamUnavailableError, UpstreamRejectedError):
+        raise
     except Exception as e:
         print(f"Coze API调用异常：{str(e)}")
         raise Exception(f"Coze API调用失败：{str(e)}")
 
-def call_coze_api_rewrite(script, video_url=None):
+async def call_coze_api_rewrite(script, video_url=None):
     """
     调用Coze API进行文案改写
     """
     try:
-        print(f"开始调用Coze API进行文案改写")
-        print(f"原始文案：{script[:100]}...")
+        print(f"开始调用Coze API进行文案改写")
+
+        parameters = {"input": script}
+        if video_url:
+            parameters["video_url"] = video_url
+
+        async with _coze_stream_request(parameters) as response:
+            await _raise_for_coze_status(response)
+            rewritten_script = await collect_coze_output(response)
+
+        if not rewritten_script or not rewritten_script.strip():
+            print("Coze API未返回有效的改写文案，使用默认改写结果")
+            rewritten_script = f"宝子们！今天给大家分享一个超实用的小红书文案～\n\n{script}\n\n是不是瞬间有内味了？喜欢的话记得点赞收藏哦！ #小红书文案 #文案改写 #创作技巧"
+
+        print(f"Coze API调用成功，改写文案长度：{len(rewritten_script)}字符")
+        return rewritten_script
+
+    except httpx.TimeoutException:
+        raise Exception("Coze API调用超时，请稍后重试")
+    except httpx.RequestError as e:
+        raise Exception(f"Coze API请求失败：{str(e)}")
+    except (UpstreamUnavailableError, UpstreamRejectedError):
+        raise
+    except Exception as e:
+        raise Exception(f"Coze API调用失败：{str(e)}")
+
+class CircuitBreaker:
+    """
+    Per-upstream circuit breaker. `failure_threshold` consecutive transient
+    failures open the circuit; calls then fail fast with CircuitOpenError
+    until `cooldown` seconds pass, after which one half-open probe is let
+    through. A successful probe closes the circuit, a failed one reopens it.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, cooldown: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.stats = {"opened": 0, "short_circuited": 0}
+
+    def before_call(self):
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.cooldown:
+                self.stats["short_circuited"] += 1
+                raise CircuitOpenError(f"{self.name} 服务暂时不可用，请稍后重试")
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._probe_in_flight:
+                self.stats["short_circuited"] += 1
+                raise CircuitOpenError(f"{self.name} 服务恢复检测中，请稍后重试")
+            self._probe_in_flight = True
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def release_probe(self):
+        """Give up a half-open probe slot without recording an outcome."""
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.stats["opened"] += 1
+                print(f"[CircuitBreaker] {self.name} opened after {self.failures} failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures, **self.stats}
+
+
+circuit_breakers = {
+    "coze": CircuitBreaker("Coze", COZE_BREAKER_FAILURES, COZE_BREAKER_COOLDOWN),
+}
+
+
+class LatencyTracker:
+    """Rolling window of latency samples with percentile lookup."""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, pct: float):
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+coze_first_event_latency = LatencyTracker()
+coze_hedge_stats = {"hedged": 0, "hedge_won": 0}
+
+
+def coze_hedge_delay():
+    """
+    Seconds to wait for the first SSE event before hedging, or None when
+    hedging is disabled. Uses the configured percentile of observed
+    first-event latency once enough samples exist.
+    """
+    if not COZE_HEDGE_ENABLED:
+        return None
+    if len(coze_first_event_latency) < 20:
+        return COZE_HEDGE_DELAY
+    return max(COZE_HEDGE_DELAY_MIN, coze_first_event_latency.percentile(COZE_HEDGE_PERCENTILE))
+
+
+def _is_transient_error(exc: Exception) -> bool:
+    """Timeouts, connection errors, 408/429 and 5xx are worth retrying."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status in (408, 429) or status >= 500
+    return isinstance(exc, (httpx.TimeoutException, httpx.TransportError))
+
+
+def _retry_delay(attempt: int, exc: Exception) -> float:
+    """Full-jitter exponential backoff; honours Retry-After on 429."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        retry_after = exc.response.headers.get("retry-after", "")
+        if retry_after.isdigit():
+            return min(COZE_BACKOFF_MAX, float(retry_after))
+    return random.uniform(0, min(COZE_BACKOFF_MAX, COZE_BACKOFF_BASE * (2 ** attempt)))
+
+
+async def _coze_transcript_attempt(xhs_url: str, first_event: asyncio.Event) -> str:
+    """One Coze request; sets `first_event` when the first SSE event arrives."""
+    start = time.monotonic()
+
+    def on_event():
+        if not first_event.is_set():
+            first_event.set()
+            coze_first_event_latency.add(time.monotonic() - start)
+
+    async with _coze_stream_request({"input": xhs_url}) as resp:
+        if resp.status_code >= 400:
+            await resp.aread()
+        resp.raise_for_status()
+        transcript = (await collect_coze_output(resp, on_event)).strip()
+    if not transcript:
+        raise Exception("Coze returned empty transcript")
+    print(f"[Coze] Transcript received, length: {len(transcript)} chars")
+    return transcript
+
+
+async def _coze_hedged_transcript(xhs_url: str) -> str:
+    """
+    Run one Coze attempt; if it has produced no SSE event after
+    coze_hedge_delay(), start a second one and return whichever succeeds
+    first, cancelling the other.
+    """
+    primary_started = asyncio.Event()
+    primary = asyncio.ensure_future(_coze_transcript_attempt(xhs_url, primary_started))
+    delay = coze_hedge_delay()
+    if delay is None:
+        return await primary
+
+    pending = {primary}
+    try:
+        started = asyncio.ensure_future(primary_started.wait())
+        done, _ = await asyncio.wait({primary, started}, timeout=delay,
+                                     return_when=asyncio.FIRST_COMPLETED)
+        started.cancel()
+        if done:
+            return await primary
+
+        print(f"[Coze] No event after {delay:.1f}s, sending hedged request")
+        coze_hedge_stats["hedged"] += 1
+        hedge = asyncio.ensure_future(_coze_transcript_attempt(xhs_url, asyncio.Event()))
+        pending.add(hedge)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        coze_hedge_stats["hedge_won"] += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def extract_transcript_via_coze(xhs_url: str, max_retries: int = COZE_MAX_RETRIES) -> str:
+    """
+    Call Coze workflow API to extract transcript from XHS video link (SSE stream).
+    Only transient errors are retried (jittered exponential backoff), and
+    the Coze circuit breaker fails calls fast while the upstream is down.
+    """
+    if not COZE_API_TOKEN:
+        raise UpstreamRejectedError("Coze API Token is not configured")
+
+    breaker = circuit_breakers["coze"]
+    for attempt in range(max_retries):
+        breaker.before_call()
+        try:
+            print(f"[Coze] Sending request (attempt {attempt + 1}): {xhs_url}")
+            transcript = await _coze_hedged_transcript(xhs_url)
+            breaker.record_success()
+            return transcript
+        except (UpstreamUnavailableError, asyncio.CancelledError):
+            # Never reached Coze (or caller went away): no health signal
+            breaker.release_probe()
+            raise
+        except Exception as e:
+            transient = _is_transient_error(e)
+            if transient:
+                breaker.record_failure()
+            else:
+                breaker.record_success()  # Coze answered; the request itself was bad
+            status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+            print(f"[Coze] {'HTTP ' + str(status) if status else 'Error'} on attempt "
+                  f"{attempt + 1}: {str(e)}")
+            if not transient or attempt == max_retries - 1:
+                if status:
+                    raise _coze_status_error(status, f"Coze API error (HTTP {status}): {str(e)}")
+                raise
+            await asyncio.sleep(_retry_delay(attempt, e))
+    raise Exception("Coze API call failed after max retries")
+
+
+# ============================================================
+# Transcript Cache
+# ============================================================
+
+class LazySqlite:
+    """
+    Mixin for classes backed by one SQLite connection: `self._conn` is
+    opened by `_open_db()` on first use, so importing this module (as a
+    forkserver-started ASR worker does) creates no files or connections.
+    """
+
+    _db = None
+    _db_lock = threading.Lock()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            with self._db_lock:
+                if self._db is None:
+                    self._db = self._open_db()
+        return self._db
+
+    def _open_db(self) -> sqlite3.Connection:
+        raise NotImplementedError
+
+
+class PersistentLRUCache(LazySqlite):
+    """
+    Two-tier key/value cache: an in-memory LRU in front of a SQLite table.
+    Entries expire after `ttl` seconds; both tiers are size bounded and
+    evict the least recently used entries first. With `compress`, values
+    are stored zlib-compressed on disk.
+    """
+
+    def __init__(self, db_path: str, table: str, ttl: int,
+                 memory_items: int, disk_items: int, compress: bool = False):
+        self.ttl = ttl
+        self.compress = compress
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self._table = table
+        self._memory = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "writes": 0,
+            "evictions": 0,
+        }
+
+        self._db_path = db_path
+
+    def _open_db(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self._db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self._db_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {self._table}_accessed ON {self._table} (accessed_at)"
+        )
+        return conn
+
+    def get(self, key: str):
+        """Return the cached value or None (missing or expired)."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return entry[1]
+                del self._memory[key]
+
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self._table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                if row is not None:
+                    self._conn.execute(f"DELETE FROM {self._table} WHERE key = ?", (key,))
+                self.stats["misses"] += 1
+                return None
+
+            self._conn.execute(
+                f"UPDATE {self._table} SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            value = row[0]
+            if isinstance(value, bytes):
+                value = zlib.decompress(value).decode("utf-8")
+            self._remember(key, row[1], value)
+            self.stats["disk_hits"] += 1
+            return value
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, value)
+            stored = zlib.compress(value.encode("utf-8")) if self.compress else value
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self._table} (key, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, stored, expires_at, now),
+            )
+            self.stats["writes"] += 1
+            self._evict_disk(now)
+
+    def record_bypass(self):
+        with self._lock:
+            self.stats["bypassed"] += 1
+
+    def _remember(self, key, expires_at, value):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now: float):
+        cur = self._conn.execute(f"DELETE FROM {self._table} WHERE expires_at <= ?", (now,))
+        evicted = cur.rowcount
+        cur = self._conn.execute(
+            f"DELETE FROM {self._table} WHERE key IN ("
+            f"SELECT key FROM {self._table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_items,),
+        )
+        evicted += cur.rowcount
+        self.stats["evictions"] += max(evicted, 0)
+
+    def snapshot(self) -> dict:
+        """Hit/miss counters and tier sizes for /api/check-services."""
+        with self._lock:
+            disk_entries = self._conn.execute(
+                f"SELECT COUNT(*) FROM {self._table}"
+            ).fetchone()[0]
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["disk_entries"] = disk_entries
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        stats["ttl_seconds"] = self.ttl
+        return stats
+
+
+_NOTE_ID_PATTERN = re.compile(r'xiaohongshu\.com/(?:explore|discovery/item|item)/([0-9a-zA-Z]+)')
+_SHORT_LINK_PATTERN = re.compile(r'xhslink\.com/(?:[a-zA-Z]/)?([0-9a-zA-Z]+)')
+
+
+def note_cache_key(xhs_url: str):
+    """
+    Build a cache key from the note ID in a long link, or from the short
+    code of an xhslink.com link. Returns None if neither is present.
+    """
+    match = _NOTE_ID_PATTERN.search(xhs_url)
+    if match:
+        return f"note:{match.group(1)}"
+    match = _SHORT_LINK_PATTERN.search(xhs_url)
+    if match:
+        return f"xhslink:{match.group(1)}"
+    return None
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls that share a key onto one in-flight task.
+    Every caller awaits the same task and receives its result or error;
+    the task is shielded so one caller going away does not cancel it for
+    the others.
+    """
+
+    def __init__(self):
+        self._inflight = {}  # key -> asyncio.Task
+        self.stats = {"calls": 0, "shared": 0}
+
+    async def do(self, key: str, fn):
+        self.stats["calls"] += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        else:
+            self.stats["shared"] += 1
+            print(f"[SingleFlight] Joining in-flight call for {key}")
+        return await asyncio.shield(task)
+
+    def snapshot(self) -> dict:
+        return {"in_flight": len(self._inflight), **self.stats}
+
+
+transcript_cache = PersistentLRUCache(
+    db_path=os.path.join(CACHE_DIR, "transcripts.sqlite3"),
+    table="transcripts",
+    ttl=TRANSCRIPT_CACHE_TTL,
+    memory_items=TRANSCRIPT_CACHE_MEMORY_ITEMS,
+    disk_items=TRANSCRIPT_CACHE_DISK_ITEMS,
+)
+transcript_flights = SingleFlight()
+
+
+async def get_transcript(xhs_url: str, use_cache: bool = True):
+    """
+    Return (transcript, from_cache) for an XHS link, consulting the
+    transcript cache before calling Coze. With use_cache=False the cache
+    is not read but the fresh transcript still replaces the cached one.
+    Concurrent misses for the same note share a single Coze call.
+    """
+    key = note_cache_key(xhs_url)
+    if key:
+        if use_cache:
+            cached = transcript_cache.get(key)
+            if cached is not None:
+                print(f"[Cache] Transcript hit for {key}")
+                return cached, True
+        else:
+            transcript_cache.record_bypass()
+
+    async def fetch():
+        transcript = await extract_transcript_via_coze(xhs_url)
+        if key:
+            transcript_cache.set(key, transcript)
+        return transcript
+
+    transcript = await transcript_flights.do(key or xhs_url, fetch)
+    return transcript, False
+
+
+async def _coze_streamed_attempt(xhs_url: str, on_delta) -> str:
+    """
+    One streaming Coze call: `on_delta(text)` for each Message delta, then
+    the final transcript is returned. httpx errors are raised as they are
+    so the caller can tell transient failures apart.
+    """
+    print(f"[Coze] Streaming request: {xhs_url}")
+    breaker = circuit_breakers["coze"]
+    breaker.before_call()
+    try:
+        async with _coze_stream_request({"input": xhs_url}) as resp:
+            if resp.status_code >= 400:
+                await resp.aread()
+            resp.raise_for_status()
+            async for kind, text in iter_coze_text(resp):
+                if kind == "delta":
+                    on_delta(text)
+                    continue
+                transcript = text.strip()
+                if not transcript:
+                    raise Exception("Coze returned empty transcript")
+    except UpstreamUnavailableError:
+        breaker.release_probe()
+        raise
+    except Exception as e:
+        if _is_transient_error(e):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    except BaseException:
+        breaker.release_probe()
+        raise
+    breaker.record_success()
+    return transcript
+
+
+async def stream_transcript(xhs_url: str, use_cache: bool = True):
+    """
+    Streaming variant of get_transcript: yield ("delta", text) while Coze
+    runs and finally ("final", transcript). A cache hit yields a single
+    ("cached", transcript) instead; a fresh transcript is written to the cache.
+    The Coze call is the same transcript_flights flight get_transcript uses:
+    requests for a note already in flight join it (and only get "final"),
+    and a transient failure before any delta falls back to the retrying,
+    hedged extract_transcript_via_coze.
+    """
+    if not COZE_API_TOKEN:
+        raise UpstreamRejectedError("Coze API Token is not configured")
+
+    key = note_cache_key(xhs_url)
+    if key:
+        if use_cache:
+            cached = transcript_cache.get(key)
+            if cached is not None:
+                print(f"[Cache] Transcript hit for {key}")
+                yield "cached", cached
+                return
+        else:
+            transcript_cache.record_bypass()
+
+    deltas = asyncio.Queue()
+
+    async def fetch():
+        emitted = []
+
+        def on_delta(text):
+            emitted.append(text)
+            deltas.put_nowait(text)
+
+        try:
+            transcript = await _coze_streamed_attempt(xhs_url, on_delta)
+        except Exception as e:
+            if emitted or not _is_transient_error(e):
+                if isinstance(e, httpx.HTTPStatusError):
+                    status = e.response.status_code
+                    raise _coze_status_error(status, f"Coze API error (HTTP {status})") from e
+                raise
+            print(f"[Coze] Streaming attempt failed before any output ({e}), retrying")
+            transcript = await extract_transcript_via_coze(xhs_url)
+        if key:
+            transcript_cache.set(key, transcript)
+        return transcript
+
+    flight = asyncio.ensure_future(transcript_flights.do(key or xhs_url, fetch))
+    getter = None
+    try:
+        while True:
+            getter = asyncio.ensure_future(deltas.get())
+            done, _ = await asyncio.wait({getter, flight}, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()  # before draining, so it cannot take a delta
+                break
+            yield "delta", getter.result()
+        while not deltas.empty():
+            yield "delta", deltas.get_nowait()
+        yield "final", await flight
+    finally:
+        # The shared flight itself is shielded and still fills the cache
+        if getter is not None:
+            getter.cancel()
+        flight.cancel()
+
+
+# ============================================================
+# Outbound HTTP
+# ============================================================
+
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class DnsCache:
+    """Host lookups kept for a fixed TTL, shared by every outbound client."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries = {}  # (host, port) -> (expires_at, [addresses])
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def is_literal(host: str) -> bool:
+        try:
+            ipaddress.ip_address(host)
+            return True
+        except ValueError:
+            return False
+
+    def get(self, host: str, port: int):
+        with self._lock:
+            entry = self._entries.get((host, port))
+            if entry is not None and entry[0] > time.monotonic():
+                self.stats["hits"] += 1
+                return entry[1]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, host: str, port: int, infos) -> list:
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        with self._lock:
+            self._entries[(host, port)] = (time.monotonic() + self.ttl, addresses)
+        return addresses
+
+    def invalidate(self, host: str, port: int):
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+    def resolve(self, host: str, port: int) -> list:
+        if self.is_literal(host):
+            return [host]
+        return self.get(host, port) or self.put(
+            host, port, socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        )
+
+    async def aresolve(self, host: str, port: int) -> list:
+        if self.is_literal(host):
+            return [host]
+        cached = self.get(host, port)
+        if cached:
+            return cached
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        return self.put(host, port, infos)
+
+
+class HostStats:
+    """Per-host request, connection and latency counters."""
+
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.http_versions = {}
+        self.latency = LatencyTracker()
+
+    def snapshot(self) -> dict:
+        reused = max(self.requests - self.connections, 0)
+        p50, p95 = self.latency.percentile(50), self.latency.percentile(95)
+        return {
+            "requests": self.requests,
+            "connections": self.connections,
+            "reuse_ratio": round(reused / self.requests, 3) if self.requests else None,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "http_versions": dict(self.http_versions),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+class _CachingBackend(httpcore.NetworkBackend):
+    """Sync network backend: DNS through the cache, every new connection counted."""
+
+    def __init__(self, layer, inner):
+        self._layer = layer
+        self._inner = inner
+
+    def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        self._layer.host_stats(host).connections += 1
+        error = None
+        for address in self._layer.dns.resolve(host, port):
+            try:
+                return self._inner.connect_tcp(address, port, timeout, local_address, socket_options)
+            except httpcore.ConnectError as e:
+                error = e
+        self._layer.dns.invalidate(host, port)
+        raise error or httpcore.ConnectError(f"no address for {host}")
+
+    def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return self._inner.connect_unix_socket(path, timeout, socket_options)
+
+    def sleep(self, seconds):
+        self._inner.sleep(seconds)
+
+
+class _AsyncCachingBackend(httpcore.AsyncNetworkBackend):
+    """Async counterpart of _CachingBackend."""
+
+    def __init__(self, layer, inner):
+        self._layer = layer
+        self._inner = inner
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        self._layer.host_stats(host).connections += 1
+        error = None
+        for address in await self._layer.dns.aresolve(host, port):
+            try:
+                return await self._inner.connect_tcp(address, port, timeout, local_address, socket_options)
+            except httpcore.ConnectError as e:
+                error = e
+        self._layer.dns.invalidate(host, port)
+        raise error or httpcore.ConnectError(f"no address for {host}")
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._inner.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds):
+        await self._inner.sleep(seconds)
+
+
+def _http_transport(pool_options: dict, backend) -> httpx.HTTPTransport:
+    """
+    httpx's own transport (request conversion, streaming and httpcore error
+    mapping stay httpx's) over a connection pool that connects through
+    `backend`. httpx has no network_backend option, so the pool it built is
+    swapped for an equivalent one constructed with the backend.
+    """
+    transport = httpx.HTTPTransport()
+    transport._pool = httpcore.ConnectionPool(network_backend=backend, **pool_options)
+    return transport
+
+
+def _async_http_transport(pool_options: dict, backend) -> httpx.AsyncHTTPTransport:
+    """Async counterpart of _http_transport."""
+    transport = httpx.AsyncHTTPTransport()
+    transport._pool = httpcore.AsyncConnectionPool(network_backend=backend, **pool_options)
+    return transport
+
+
+def _pool_timeout(request: httpx.Request):
+    return request.extensions.get("timeout", {}).get("pool")
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """Response body that frees its per-host slot once closed."""
+
+    def __init__(self, inner, release):
+        self._inner = inner
+        self._release = release
+
+    def __iter__(self):
+        yield from self._inner
+
+    def close(self):
+        try:
+            self._inner.close()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, inner, release):
+        self._inner = inner
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._inner:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._inner.aclose()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+
+class _HostLimitedTransport(httpx.BaseTransport):
+    """
+    Wraps an httpx transport: holds a per-host slot from request until the
+    body is closed, and times the call. Waiting for a slot is bounded by
+    the request's pool timeout and ends in httpx.PoolTimeout.
+    """
+
+    def __init__(self, layer, inner: httpx.BaseTransport, capped: bool):
+        self._layer = layer
+        self._inner = inner
+        self._capped = capped
+
+    def handle_request(self, request):
+        host = request.url.host
+        slot = self._layer.slot(host) if self._capped else None
+        if slot is not None and not slot.acquire(timeout=_pool_timeout(request)):
+            raise httpx.PoolTimeout(f"no free request slot for {host}", request=request)
+        release = slot.release if slot is not None else None
+        stats = self._layer.host_stats(host)
+        stats.requests += 1
+        stats.in_flight += 1
+        start = time.monotonic()
+        try:
+            response = self._inner.handle_request(request)
+        except BaseException as e:
+            # Cancellation too: otherwise the slot is never given back
+            if isinstance(e, Exception):
+                stats.errors += 1
+            stats.in_flight -= 1
+            if release is not None:
+                release()
+            raise
+        self._layer.record(stats, response, time.monotonic() - start)
+        response.stream = _ReleasingStream(response.stream, self._layer.finisher(stats, release))
+        return response
+
+    def close(self):
+        self._inner.close()
+
+
+class _AsyncHostLimitedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, layer, inner: httpx.AsyncBaseTransport, capped: bool):
+        self._layer = layer
+        self._inner = inner
+        self._capped = capped
+
+    async def handle_async_request(self, request):
+        host = request.url.host
+        slot = self._layer.async_slot(host) if self._capped else None
+        if slot is not None:
+            try:
+                await asyncio.wait_for(slot.acquire(), _pool_timeout(request))
+            except asyncio.TimeoutError:
+                raise httpx.PoolTimeout(f"no free request slot for {host}", request=request) from None
+        release = slot.release if slot is not None else None
+        stats = self._layer.host_stats(host)
+        stats.requests += 1
+        stats.in_flight += 1
+        start = time.monotonic()
+        try:
+            response = await self._inner.handle_async_request(request)
+        except BaseException as e:
+            # Cancellation too: otherwise the slot is never given back
+            if isinstance(e, Exception):
+                stats.errors += 1
+            stats.in_flight -= 1
+            if release is not None:
+                release()
+            raise
+        self._layer.record(stats, response, time.monotonic() - start)
+        response.stream = _AsyncReleasingStream(response.stream, self._layer.finisher(stats, release))
+        return response
+
+    async def aclose(self):
+        await self._inner.aclose()
+
+
+class OutboundHttp:
+    """
+    One layer for every outbound call except Coze (which has its own tuned
+    client): named keep-alive clients over per-host pools, HTTP/2 when the
+    h2 package is installed, a shared DNS cache, a cap on concurrent
+    requests per host, and per-host timing and connection reuse counters.
+    """
+
+    def __init__(self, max_per_host: int, dns_ttl: float, http2: bool):
+        self.max_per_host = max_per_host
+        self.http2 = http2 and _HTTP2_AVAILABLE
+        if http2 and not _HTTP2_AVAILABLE:
+            print("[Outbound] HTTP/2 requested but the h2 package is not installed; using HTTP/1.1")
+        self.dns = DnsCache(dns_ttl)
+        self._hosts = {}
+        self._slots = {}
+        self._async_slots = {}
+        self._clients = {}
+        self._async_clients = {}
+        self._lock = threading.Lock()
+
+    def host_stats(self, host: str) -> HostStats:
+        stats = self._hosts.get(host)
+        if stats is None:
+            with self._lock:
+                stats = self._hosts.setdefault(host, HostStats())
+        return stats
+
+    def slot(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if host not in self._slots:
+                self._slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._slots[host]
+
+    def async_slot(self, host: str) -> asyncio.Semaphore:
+        if host not in self._async_slots:
+            self._async_slots[host] = asyncio.Semaphore(self.max_per_host)
+        return self._async_slots[host]
+
+    @staticmethod
+    def record(stats: HostStats, response, elapsed: float):
+        version = response.extensions.get("http_version", b"HTTP/1.1").decode("ascii", "replace")
+        stats.http_versions[version] = stats.http_versions.get(version, 0) + 1
+        stats.latency.add(elapsed)
+
+    @staticmethod
+    def finisher(stats: HostStats, release):
+        def finish():
+            stats.in_flight -= 1
+            if release is not None:
+                release()
+        return finish
+
+    def _pool_options(self, max_connections, http2):
+        connections = max_connections or self.max_per_host * 4
+        return {
+            "ssl_context": httpx.create_ssl_context(),
+            "max_connections": connections,
+            "max_keepalive_connections": connections,
+            "keepalive_expiry": 60.0,
+            "http2": self.http2 if http2 is None else http2 and _HTTP2_AVAILABLE,
+        }
+
+    def client(self, name: str, max_connections: int = None, http2: bool = None,
+               capped: bool = True, **kwargs) -> httpx.Client:
+        """Shared sync client for `name`; extra kwargs go to httpx.Client."""
+        with self._lock:
+            client = self._clients.get(name)
+            if client is None or client.is_closed:
+                transport = _http_transport(
+                    self._pool_options(max_connections, http2), _CachingBackend(self, httpcore.SyncBackend())
+                )
+                client = httpx.Client(transport=_HostLimitedTransport(self, transport, capped), **kwargs)
+                self._clients[name] = client
+            return client
+
+    def async_client(self, name: str, max_connections: int = None, http2: bool = None,
+                     capped: bool = True, **kwargs) -> httpx.AsyncClient:
+        """Shared async client for `name`; extra kwargs go to httpx.AsyncClient."""
+        client = self._async_clients.get(name)
+        if client is None or client.is_closed:
+            transport = _async_http_transport(
+                self._pool_options(max_connections, http2), _AsyncCachingBackend(self, httpcore.AnyIOBackend())
+            )
+            client = httpx.AsyncClient(transport=_AsyncHostLimitedTransport(self, transport, capped), **kwargs)
+            self._async_clients[name] = client
+        return client
+
+    async def aclose(self):
+        """Close async clients; their pools and slots belong to the current loop."""
+        for client in self._async_clients.values():
+            if not client.is_closed:
+                await client.aclose()
+        self._async_clients.clear()
+        self._async_slots.clear()
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+    def snapshot(self) -> dict:
+        hosts = {host: stats.snapshot() for host, stats in list(self._hosts.items())}
+        requests_total = sum(s.requests for s in self._hosts.values())
+        connections_total = sum(s.connections for s in self._hosts.values())
+        return {
+            "http2": self.http2,
+            "max_per_host": self.max_per_host,
+            "requests": requests_total,
+            "connections": connections_total,
+            "reuse_ratio": (round(max(requests_total - connections_total, 0) / requests_total, 3)
+                            if requests_total else None),
+            "dns": {"ttl": self.dns.ttl, **self.dns.stats},
+            "hosts": hosts,
+        }
+
+
+outbound_http = OutboundHttp(
+    max_per_host=OUTBOUND_MAX_PER_HOST,
+    dns_ttl=OUTBOUND_DNS_TTL,
+    http2=OUTBOUND_HTTP2,
+)
+
+
+@app.on_event("shutdown")
+async def close_outbound_http():
+    """Release pooled outbound connections when the server stops."""
+    await outbound_http.aclose()
+    outbound_http.close()
+
+
+# ============================================================
+# XHS Link Resolver
+# ============================================================
+
+_XSEC_TOKEN_PATTERN = re.compile(r'[?&]xsec_token=([^&#\s]+)')
+_XHS_REDIRECT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "zh-CN,zh;q=0.9",
+}
+_XHS_MAX_REDIRECTS = 5
+
+
+class ResolvedLink:
+    """A pasted XHS link reduced to its note ID and xsec token."""
+
+    __slots__ = ("source_url", "note_id", "xsec_token")
+
+    def __init__(self, source_url: str, note_id=None, xsec_token=None):
+        self.source_url = source_url
+        self.note_id = note_id
+        self.xsec_token = xsec_token
+
+    @property
+    def canonical_url(self) -> str:
+        """One URL per note; falls back to the source link when unresolved."""
+        if not self.note_id:
+            return self.source_url
+        url = f"https://www.xiaohongshu.com/explore/{self.note_id}"
+        if self.xsec_token:
+            url += f"?xsec_token={self.xsec_token}&xsec_source=pc_share"
+        return url
+
+
+def parse_note_link(url: str):
+    """ResolvedLink for a long xiaohongshu.com link, or None if it has no note ID."""
+    match = _NOTE_ID_PATTERN.search(url)
+    if not match:
+        return None
+    token = _XSEC_TOKEN_PATTERN.search(url)
+    return ResolvedLink(url, match.group(1), token.group(1) if token else None)
+
+
+class XhsLinkResolver:
+    """
+    Follow xhslink.com short links to the note they point at, using HEAD
+    requests and the Location header only (no page bodies). Results are
+    kept in a bounded LRU with TTL keyed by short code; concurrent lookups
+    of the same code share one resolution.
+    """
+
+    def __init__(self, ttl: int, max_items: int, timeout: float):
+        self.ttl = ttl
+        self.max_items = max_items
+        self.timeout = timeout
+        self._cache = OrderedDict()  # short code -> (expires_at, ResolvedLink)
+        self._flights = SingleFlight()
+        self._client = None
+        self.stats = {"hits": 0, "misses": 0, "resolved": 0, "failed": 0}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = outbound_http.async_client(
+                "xhs-resolver",
+                timeout=self.timeout,
+                headers=_XHS_REDIRECT_HEADERS,
+                follow_redirects=False,
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+
+    async def resolve(self, url: str) -> ResolvedLink:
+        """
+        Resolve a long or short XHS link. Never raises for network trouble:
+        an unresolvable short link comes back without a note ID and callers
+        keep using the link as pasted.
+        """
+        resolved = parse_note_link(url)
+        if resolved is not None:
+            return resolved
+        match = _SHORT_LINK_PATTERN.search(url)
+        if not match:
+            return ResolvedLink(url)
+
+        code = match.group(1)
+        entry = self._cache.get(code)
+        if entry is not None and entry[0] > time.time():
+            self._cache.move_to_end(code)
+            self.stats["hits"] += 1
+            return entry[1]
+
+        self.stats["misses"] += 1
+        return await self._flights.do(code, lambda: self._resolve_short(code, url))
+
+    async def _resolve_short(self, code: str, url: str) -> ResolvedLink:
+        client = self._get_client()
+        location = url
+        try:
+            for _ in range(_XHS_MAX_REDIRECTS):
+                resp = await client.head(location)
+                if resp.status_code == 405:
+                    # Some edges refuse HEAD; a streamed GET still stops at the headers
+                    async with client.stream("GET", location) as resp:
+                        pass
+                if not resp.is_redirect:
+                    break
+                location = urljoin(location, resp.headers["location"])
+                resolved = parse_note_link(location)
+                if resolved is not None:
+                    resolved.source_url = url
+                    self._remember(code, resolved)
+                    self.stats["resolved"] += 1
+                    return resolved
+        except httpx.HTTPError as e:
+            print(f"[Resolver] Failed to resolve {url}: {e}")
+        self.stats["failed"] += 1
+        return ResolvedLink(url)
+
+    def _remember(self, code: str, resolved: ResolvedLink):
+        self._cache[code] = (time.time() + self.ttl, resolved)
+        self._cache.move_to_end(code)
+        while len(self._cache) > self.max_items:
+            self._cache.popitem(last=False)
+
+    def snapshot(self) -> dict:
+        return {"entries": len(self._cache), "ttl_seconds": self.ttl, **self.stats}
+
+
+xhs_link_resolver = XhsLinkResolver(
+    ttl=XHS_LINK_CACHE_TTL,
+    max_items=XHS_LINK_CACHE_ITEMS,
+    timeout=XHS_LINK_TIMEOUT,
+)
+
+
+async def normalize_xhs_url(share_text: str) -> ResolvedLink:
+    """
+    The single normalization step for pasted XHS links: pull the link out
+    of share text, validate it and resolve it to its canonical note URL.
+    """
+    return await xhs_link_resolver.resolve(extract_xhs_url(share_text))
+
+
+# ============================================================
+# XHS-Downloader Integration
+# ============================================================
+
+def get_xhs_downloader_client() -> httpx.AsyncClient:
+    """Return the shared keep-alive client used for XHS-Downloader calls."""
+    return outbound_http.async_client("xhs-downloader", timeout=httpx.Timeout(120.0, connect=5.0))
+
+
+async def download_via_xhs_downloader(xhs_url: str, download_file: bool = False) -> dict:
+    """
+    Call XHS-Downloader API to get note info and optionally download video.
+    """
+    try:
+        resp = await get_xhs_downloader_client().post(
+            XHS_DOWNLOADER_API,
+            json={"url": xhs_url, "download": download_file},
+        )
+        resp.raise_for_status()
+        return resp.json()
+    except httpx.ConnectError:
+        raise Exception(
+            "XHS-Downloader API is not running. "
+            "Start it with: cd XHS-Downloader && python main.py api"
+        )
+    except Exception as e:
+        raise Exception(f"XHS-Downloader call failed: {str(e)}")
+
+
+note_info_cache = PersistentLRUCache(
+    db_path=os.path.join(CACHE_DIR, "note_info.sqlite3"),
+    table="note_info",
+    ttl=NOTE_INFO_CACHE_TTL,
+    memory_items=NOTE_INFO_CACHE_MEMORY_ITEMS,
+    disk_items=NOTE_INFO_CACHE_DISK_ITEMS,
+    compress=True,
+)
+note_info_flights = SingleFlight()
+note_info_prefetch_stats = {"runs": 0, "requested": 0, "cached": 0, "fetched": 0, "failed": 0, "invalid": 0}
+
+_BARE_NOTE_ID = re.compile(r'^[0-9a-zA-Z]{24}$')
+
+
+async def fetch_note_info(xhs_url: str, use_cache: bool = True) -> dict:
+    """
+    Best-effort note metadata, served from note_info_cache when the link
+    has a note ID. Concurrent misses for one note share a single
+    downloader call, which keeps running (and fills the cache) even if
+    the caller stops waiting. Returns {} when the downloader is down,
+    slow or fails; failures are not cached.
+    """
+    resolved = parse_note_link(xhs_url)
+    key = resolved.note_id if resolved else None
+    if key is None:
+        return await _fetch_note_info_uncached(xhs_url)
+    if use_cache:
+        cached = note_info_cache.get(key)
+        if cached is not None:
+            return json.loads(cached)
+    else:
+        note_info_cache.record_bypass()
+
+    async def fetch():
+        info = await _fetch_note_info_uncached(xhs_url)
+        if info:
+            note_info_cache.set(key, json.dumps(info, ensure_ascii=False, separators=(",", ":")))
+        return info
+
+    return await note_info_flights.do(key, fetch)
+
+
+async def _fetch_note_info_uncached(xhs_url: str) -> dict:
+    """One XHS-Downloader info call, bounded by XHS_NOTE_INFO_TIMEOUT."""
+    if not health_prober.is_available("xhs_downloader"):
+        return {}
+    try:
+        info = await asyncio.wait_for(
+            download_via_xhs_downloader(xhs_url, download_file=False),
+            timeout=XHS_NOTE_INFO_TIMEOUT,
+        )
+        health_prober.report_success("xhs_downloader")
+        return info
+    except asyncio.TimeoutError:
+        print(f"[XHS-Downloader] Info fetch timed out after {XHS_NOTE_INFO_TIMEOUT}s (non-critical)")
+    except Exception as e:
+        print(f"[XHS-Downloader] Info fetch failed (non-critical): {e}")
+        health_prober.report_failure("xhs_downloader", str(e))
+    return {}
+
+
+async def prefetch_note_info(notes: list) -> dict:
+    """
+    Warm note_info_cache for a list of share links or bare note IDs before
+    a large extraction job, NOTE_INFO_PREFETCH_CONCURRENCY at a time.
+    Notes already cached are skipped. Bare IDs carry no xsec token, so
+    the downloader may refuse some of them; prefer full links.
+    Returns per-outcome counts.
+    """
+    counts = {"requested": len(notes), "cached": 0, "fetched": 0, "failed": 0, "invalid": 0}
+    semaphore = asyncio.Semaphore(NOTE_INFO_PREFETCH_CONCURRENCY)
+
+    async def warm(note):
+        note = str(note).strip()
+        try:
+            if _BARE_NOTE_ID.match(note):
+                resolved = ResolvedLink(note, note_id=note)
+            else:
+                resolved = await normalize_xhs_url(note)
+        except HTTPException:
+            counts["invalid"] += 1
+            return
+        if not resolved.note_id:
+            counts["invalid"] += 1
+            return
+        if note_info_cache.get(resolved.note_id) is not None:
+            counts["cached"] += 1
+            return
+        async with semaphore:
+            info = await fetch_note_info(resolved.canonical_url)
+        counts["fetched" if info else "failed"] += 1
+
+    await asyncio.gather(*(warm(note) for note in notes))
+    note_info_prefetch_stats["runs"] += 1
+    for name, value in counts.items():
+        note_info_prefetch_stats[name] += value
+    print(f"[NoteInfo] Prefetch finished: {counts}")
+    return counts
+
+
+def start_note_info(xhs_url: str, enabled: bool = True):
+    """Start the note-info fetch alongside the transcript; None when disabled."""
+    return asyncio.ensure_future(fetch_note_info(xhs_url)) if enabled else None
+
+
+async def collect_note_info(task) -> dict:
+    """
+    Note info from start_note_info once the transcript is ready. Waits at
+    most XHS_NOTE_INFO_GRACE more seconds, so a slow downloader never
+    holds the transcript back; a late fetch is cancelled.
+    """
+    if task is None:
+        return {}
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), timeout=XHS_NOTE_INFO_GRACE)
+    except asyncio.TimeoutError:
+        task.cancel()
+        print("[XHS-Downloader] Note info missed its deadline, returning transcript without it")
+        return {}
 
-        payload = {
-            "workflow_id": COZE_WORKFLOW_ID,
-            "parameters": {
-                "input": script
-            }
-        }
 
-        if video_url:
-            payload["parameters"]["video_url"] = video_url
+class DependencyHealth:
+    """
+    Rolling availability and latency of one external dependency, fed by
+    the background prober and by failures seen on request paths.
+    """
 
-        headers = {
-            "Authorization": f"Bearer {COZE_API_TOKEN}",
-            "Content-Type": "application/json"
+    def __init__(self, name: str, probe, window: int):
+        self.name = name
+        self.probe = probe  # async () -> None, raises when unavailable
+        self.available = None  # unknown until the first probe finishes
+        self.last_checked = None
+        self.last_error = None
+        self.consecutive_failures = 0
+        self.request_failures = 0  # consecutive failed real calls
+        self._results = deque(maxlen=window)
+        self.latency = LatencyTracker(window=window)
+
+    def record(self, ok: bool, latency=None, error=None):
+        self.available = ok
+        self.last_checked = time.time()
+        self._results.append(ok)
+        if ok:
+            self.consecutive_failures = 0
+            self.request_failures = 0
+            self.last_error = None
+            if latency is not None:
+                self.latency.add(latency)
+        else:
+            self.consecutive_failures += 1
+            self.last_error = error
+
+    def snapshot(self) -> dict:
+        return {
+            "available": bool(self.available),
+            "last_checked": self.last_checked,
+            "last_error": self.last_error,
+            "consecutive_failures": self.consecutive_failures,
+            "availability": round(sum(self._results) / len(self._results), 4) if self._results else None,
+            "latency_p50": self.latency.percentile(50),
+            "latency_p95": self.latency.percentile(95),
         }
 
-        response = requests.post(
-            COZE_API_URL,
-            json=payload,
-            headers=headers,
-            timeout=120,
-            stream=True
-        )
 
-        print(f"Coze API响应状态码：{response.status_code}")
+class HealthProber:
+    """
+    Probe every registered dependency on a fixed interval from one
+    background task, so request paths and /api/check-services read the
+    last known state instead of making their own blocking checks. A
+    dependency counts as available until a probe fails or
+    `failure_threshold` real calls in a row have failed.
+    """
 
-        if response.status_code != 200:
-            error_msg = f"Coze API调用失败，状态码：{response.status_code}"
+    def __init__(self, interval: float, timeout: float, window: int, failure_threshold: int = 3):
+        self.interval = interval
+        self.timeout = timeout
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.dependencies = {}
+
+    def register(self, name: str, probe):
+        self.dependencies[name] = DependencyHealth(name, probe, self.window)
+
+    def is_available(self, name: str) -> bool:
+        """False only once the dependency is known to be down; unknown counts as up."""
+        return self.dependencies[name].available is not False
+
+    def report_failure(self, name: str, error: str):
+        """
+        Count a failed real call. After `failure_threshold` in a row the
+        dependency is marked down until the next good probe.
+        """
+        dep = self.dependencies[name]
+        dep.request_failures += 1
+        dep.last_error = error
+        if dep.request_failures >= self.failure_threshold:
+            dep.record(False, error=error)
+
+    def report_success(self, name: str):
+        """A real call worked: its earlier failures no longer count toward the threshold."""
+        self.dependencies[name].request_failures = 0
+
+    async def probe_once(self):
+        async def run(dep: DependencyHealth):
+            start = time.monotonic()
             try:
-                error_data = response.json()
-                error_msg += f"，错误信息：{error_data.get('msg', '未知错误')}"
-            except:
-                pass
-            raise Exception(error_msg)
+                await asyncio.wait_for(dep.probe(), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                dep.record(False, error=f"probe timed out after {self.timeout}s")
+            except Exception as e:
+                dep.record(False, error=str(e) or type(e).__name__)
+            else:
+                dep.record(True, latency=time.monotonic() - start)
 
-        rewritten_script = ""
-        current_event = None
-        current_data = ""
+        await asyncio.gather(*(run(dep) for dep in self.dependencies.values()))
 
-        for line in response.iter_lines():
-            if line:
-                line_str = line.decode('utf-8').strip()
-                print(f"收到响应行：{line_str[:200]}")
+    async def run(self):
+        while True:
+            await self.probe_once()
+            await asyncio.sleep(self.interval)
 
-                if not line_str:
-                    continue
+    def snapshot(self, name: str) -> dict:
+        return self.dependencies[name].snapshot()
 
-                if line_str.startswith('id:'):
-                    continue
-                elif line_str.startswith('event:'):
-                    current_event = line_str[6:].strip()
-                elif line_str.startswith('data:'):
-                    current_data = line_str[5:].strip()
-
-                    try:
-                        data = json.loads(current_data)
-
-                        if current_event == "Message":
-                            content_str = data.get("content", "")
-                            if content_str:
-                                try:
-                                    content_data = json.loads(content_str)
-                                    if isinstance(content_data, dict):
-                                        output_text = content_data.get("output", "")
-                                        if output_text:
-                                            rewritten_script = output_text
-                                except json.JSONDecodeError:
-                                    if content_str:
-                                        rewritten_script = content_str
-
-                    except json.JSONDecodeError as e:
-                        print(f"JSON解析失败：{e}")
-                        continue
 
-        if not rewritten_script or not rewritten_script.strip():
-            print("Coze API未返回有效的改写文案，使用默认改写结果")
-            rewritten_script = f"宝子们！今天给大家分享一个超实用的小红书文案～\n\n{script}\n\n是不是瞬间有内味了？喜欢的话记得点赞收藏哦！ #小红书文案 #文案改写 #创作技巧"
+def get_probe_client() -> httpx.AsyncClient:
+    """
+    Small dedicated client, exempt from the per-host cap, so probes never
+    queue behind real traffic.
+    """
+    return outbound_http.async_client(
+        "health-probe", max_connections=4, capped=False, timeout=HEALTH_PROBE_TIMEOUT
+    )
 
-        print(f"Coze API调用成功，改写文案长度：{len(rewritten_script)}字符")
-        return rewritten_script
 
-    except requests.exceptions.Timeout:
-        raise Exception("Coze API调用超时，请稍后重试")
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Coze API请求失败：{str(e)}")
-    except Exception as e:
-        raise Exception(f"Coze API调用失败：{str(e)}")
+async def probe_xhs_downloader():
+    """XHS-Downloader is up when its API docs page answers 200."""
+    resp = await get_probe_client().get(f"{XHS_DOWNLOADER_API}/docs")
+    if resp.status_code != 200:
+        raise Exception(f"HTTP {resp.status_code}")
+
 
-def extract_transcript_via_coze(xhs_url: str, max_retries: int = 3) -> str:
+async def probe_coze():
     """
-    Call Coze workflow API to extract transcript from XHS video link (SSE stream).
+    Reachability of the Coze API host. Running the workflow would cost a
+    real call, so any HTTP answer (even 4xx) counts as reachable; 5xx,
+    connection errors and timeouts do not.
     """
     if not COZE_API_TOKEN:
         raise Exception("Coze API Token is not configured")
-
-    for attempt in range(max_retries):
-        try:
-            print(f"[Coze] Sending request (attempt {attempt + 1}): {xhs_url}")
-            resp = requests.post(
-                COZE_API_URL,
-                headers={
-                    "Authorization": f"Bearer {COZE_API_TOKEN}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "workflow_id": COZE_WORKFLOW_ID,
-                    "parameters": {"input": xhs_url},
-                },
-                stream=True,
-                timeout=120,
-            )
-            resp.raise_for_status()
-            return _parse_coze_stream(resp)
-        except requests.exceptions.HTTPError as e:
-            status = e.response.status_code if e.response is not None else 0
-            print(f"[Coze] HTTP {status} on attempt {attempt + 1}")
-            if status == 429 and attempt < max_retries - 1:
-                time.sleep(2 ** attempt)
-                continue
-            raise Exception(f"Coze API error (HTTP {status}): {str(e)}")
-        except Exception as e:
-            print(f"[Coze] Error on attempt {attempt + 1}: {str(e)}")
-            if attempt < max_retries - 1:
-                time.sleep(1)
-                continue
-            raise
-    raise Exception("Coze API call failed after max retries")
-
-
-def _parse_coze_stream(response) -> str:
-    """Parse Coze SSE stream and extract final transcript."""
-    result = ""
-    for line in response.iter_lines(decode_unicode=True):
-        if not line:
-            continue
-        if line.startswith("data:"):
-            raw = line[5:].strip()
-            if not raw:
-                continue
-            try:
-                data = json.loads(raw)
-            except json.JSONDecodeError:
-                continue
-            if isinstance(data, dict):
-                if "output" in data:
-                    result = data["output"]
-                    break
-                if "content" in data:
-                    result += data["content"]
-                if "error_message" in data:
-                    raise Exception(f"Coze workflow error: {data['error_message']}")
-    transcript = result.strip()
-    if not transcript:
-        raise Exception("Coze returned empty transcript")
-    print(f"[Coze] Transcript received, length: {len(transcript)} chars")
-    return transcript
+    resp = await get_probe_client().get(COZE_API_URL)
+    if resp.status_code >= 500:
+        raise Exception(f"HTTP {resp.status_code}")
 
 
-# ============================================================
-# XHS-Downloader Integration
-# ============================================================
-
-def check_xhs_downloader_status() -> bool:
-    """Check if XHS-Downloader API is available."""
-    try:
-        resp = requests.get(f"{XHS_DOWNLOADER_API}/docs", timeout=5)
-        return resp.status_code == 200
-    except Exception:
-        return False
+health_prober = HealthProber(
+    interval=HEALTH_PROBE_INTERVAL,
+    timeout=HEALTH_PROBE_TIMEOUT,
+    window=HEALTH_PROBE_WINDOW,
+    failure_threshold=HEALTH_FAILURE_THRESHOLD,
+)
+health_prober.register("xhs_downloader", probe_xhs_downloader)
+health_prober.register("coze", probe_coze)
 
 
-def download_via_xhs_downloader(xhs_url: str, download_file: bool = False) -> dict:
-    """
-    Call XHS-Downloader API to get note info and optionally download video.
-    """
-    try:
-        resp = requests.post(
-            XHS_DOWNLOADER_API,
-            json={"url": xhs_url, "download": download_file},
-            timeout=120,
-        )
-        resp.raise_for_status()
-        return resp.json()
-    except requests.exceptions.ConnectionError:
-        raise Exception(
-            "XHS-Downloader API is not running. "
-            "Start it with: cd XHS-Downloader && python main.py api"
-        )
-    except Exception as e:
-        raise Exception(f"XHS-Downloader call failed: {str(e)}")
+@app.on_event("startup")
+async def start_health_prober():
+    _spawn(health_prober.run())
 
 def clean_and_format_text(text):
     """
@@ -870,6 +2529,130 @@ def analyze_script(script):
         print(f"综合分析失败：{str(e)}")
         return {"error": str(e)}
 
+# Note-page video URL extraction. All patterns are compiled once; every
+# step is a single left-to-right pass over the page.
+_PAGE_STATE_MARKER = re.compile(
+    r'window\.(?:__INITIAL_STATE__|__data__|__page__|__NEXT_DATA__)\s*=\s*(?=\{)'
+)
+# JSON string literal or a brace; used to find where an object ends
+_JSON_BRACE_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}]', re.DOTALL)
+_JS_UNDEFINED = re.compile(r'(?<=[:\[,])\s*undefined\b')
+_NOTE_DETAIL_KEY = re.compile(r'"noteDetailMap"\s*:\s*(?=\{)')
+# Combined fallback: a known video key with a URL value, or a bare URL
+_VIDEO_URL_SCANNER = re.compile(
+    r'"(masterUrl|main_url|play_url|videoUrl|video_url|url)"\s*:\s*"(https?:[^"]+)"'
+    r'|(https?:(?:\\u002F|\\/|/)(?:\\u002F|\\/|/)[^\s"\'<>]+)'
+)
+_VIDEO_KEYS = ("masterUrl", "video", "main_url", "play_url", "videoUrl", "video_url", "url")
+_NON_VIDEO_HINTS = ('.ico', '.png', '.jpg', '.jpeg', '.gif', '.css', '.js', '.json',
+                    '.svg', '.txt', '.html', 'icon', 'logo', 'image')
+_VIDEO_HINTS = ('.mp4', 'xhsvideo', 'sns-video', 'video', 'stream')
+_XHS_VIDEO_CDN = "https://sns-video-bd.xhscdn.com/"
+
+
+def _unescape_page_url(url: str) -> str:
+    return url.replace("\\u002F", "/").replace("\\u0026", "&").replace("\\/", "/")
+
+
+def _json_object_end(text: str, start: int):
+    """Index just past the object opening at text[start], or None if unbalanced."""
+    depth = 0
+    for token in _JSON_BRACE_TOKEN.finditer(text, start):
+        value = token.group()
+        if value == "{":
+            depth += 1
+        elif value == "}":
+            depth -= 1
+            if depth == 0:
+                return token.end()
+    return None
+
+
+def _decode_state_object(blob: str):
+    try:
+        return json.loads(_JS_UNDEFINED.sub("null", blob))
+    except json.JSONDecodeError:
+        return None
+
+
+def _video_url_from_note(note: dict):
+    """Known locations first (stream master URLs, origin key), then a walk of the note only."""
+    video = note.get("video") if isinstance(note, dict) else None
+    if isinstance(video, dict):
+        stream = (video.get("media") or {}).get("stream") or {}
+        for codec in ("h264", "h265", "av1", "h266"):
+            for item in stream.get(codec) or []:
+                if isinstance(item, dict) and item.get("masterUrl"):
+                    return item["masterUrl"]
+        origin_key = (video.get("consumer") or {}).get("originVideoKey")
+        if origin_key:
+            return _XHS_VIDEO_CDN + origin_key
+
+    stack = [note]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if (key in _VIDEO_KEYS and isinstance(value, str)
+                        and value.startswith(("https://", "http://"))
+                        and not any(hint in value.lower() for hint in _NON_VIDEO_HINTS)):
+                    return value
+                if isinstance(value, (dict, list)):
+                    stack.append(value)
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
+    return None
+
+
+def _video_url_from_state(page: str):
+    """
+    Locate the page state blob once and decode only the note subtree.
+    Pages without a note video in noteDetailMap are left to the scan.
+    """
+    for marker in _PAGE_STATE_MARKER.finditer(page):
+        start = marker.end()
+        end = page.find("</script>", start)
+        blob = page[start:end if end != -1 else len(page)].rstrip().rstrip(";")
+
+        detail = _NOTE_DETAIL_KEY.search(blob)
+        if detail is not None:
+            detail_end = _json_object_end(blob, detail.end())
+            notes = _decode_state_object(blob[detail.end():detail_end]) if detail_end else None
+            if isinstance(notes, dict):
+                for entry in notes.values():
+                    note = entry.get("note") if isinstance(entry, dict) else None
+                    video_url = _video_url_from_note(note) if note else None
+                    if video_url:
+                        return video_url
+    return None
+
+
+def _video_url_from_scan(page: str):
+    """One pass of the combined scanner; keyed matches win over bare links."""
+    bare = None
+    for match in _VIDEO_URL_SCANNER.finditer(page):
+        key, value, link = match.groups()
+        url = _unescape_page_url(value or link)
+        lowered = url.lower()
+        if any(hint in lowered for hint in _NON_VIDEO_HINTS):
+            continue
+        if key and key != "url":
+            return url
+        if bare is None and any(hint in lowered for hint in _VIDEO_HINTS):
+            bare = url
+    return bare
+
+
+def extract_video_url_from_page(page: str):
+    """
+    Video URL from an XHS note page: the note subtree of the page state
+    first, then a single combined scan of the page. Returns None if the
+    page has no video link.
+    """
+    video_url = _video_url_from_state(page) or _video_url_from_scan(page)
+    return _unescape_page_url(video_url) if video_url else None
+
+
 def parse_xiaohongshu_url(url):
     """
     解析小红书视频链接，获取视频真实地址
@@ -884,163 +2667,20 @@ def parse_xiaohongshu_url(url):
             "Cookie": "abRequestId=00000000-0000-0000-0000-000000000000; xsecappid=xhs-pc-web; a1=198bcf85656rpl7j7k8cqdpiy97ufv8dtmx3t20790000324993; webId=00000000-0000-0000-0000-000000000000; gsid=00000000000000000000000000000000; webBuild=4.8.2; acw_tc=00000000000000000000000000000000; sec_poison_id=00000000-0000-0000-0000-000000000000"
         }
         print(f"正在请求小红书链接：{url}")
-        response = requests.get(url, headers=headers, timeout=30)
+        response = outbound_http.client("xhs-page", follow_redirects=True).get(url, headers=headers, timeout=30)
         response.raise_for_status()
         print(f"请求成功，状态码：{response.status_code}")
         
-        # 保存页面内容到临时文件，方便调试
-        debug_file = os.path.join(TEMP_DIR, f"xiaohongshu_debug_{datetime.now().timestamp()}.html")
-        with open(debug_file, 'w', encoding='utf-8') as f:
-            f.write(response.text)  # 保存完整页面内容
-        print(f"页面内容已保存到：{debug_file}")
+        # 保存页面内容方便调试（需开启 SCRATCH_DEBUG_CAPTURE，仅保留最近几份）
+        debug_file = scratch_space.capture_debug("xiaohongshu_debug", ".html", response.text)
+        if debug_file:
+            print(f"页面内容已保存到：{debug_file}")
         
-        # 从页面内容中提取视频地址
+        # 从页面内容中提取视频地址（页面状态中的笔记数据优先，其次单次组合扫描）
         print("尝试提取视频地址...")
+        video_url = extract_video_url_from_page(response.text)
         
-        # 1. 尝试从页面中提取JSON数据
-        print("尝试从页面中提取JSON数据...")
-        json_patterns = [
-            r'window\.__INITIAL_STATE__\s*=\s*({.*?});',
-            r'window\.__data__\s*=\s*({.*?});',
-            r'window\.__page__\s*=\s*({.*?});',
-            r'window\.__NEXT_DATA__\s*=\s*({.*?});',
-            r'{"note":.*?}',
-            r'{"video":.*?}'
-        ]
-        
-        video_url = None
-        for json_pattern in json_patterns:
-            print(f"尝试JSON模式：{json_pattern}")
-            json_matches = re.findall(json_pattern, response.text, re.DOTALL)
-            if json_matches:
-                print(f"找到JSON数据，长度：{len(json_matches[0])}")
-                try:
-                    json_data = json.loads(json_matches[0])
-                    # 递归查找视频地址
-                    def find_video_url(data):
-                        if isinstance(data, dict):
-                            for key, value in data.items():
-                                if key in ['video', 'videoUrl', 'video_url', 'main_url', 'play_url', 'url']:
-                                    if isinstance(value, str) and value.startswith('https://'):
-                                        return value
-                                elif isinstance(value, (dict, list)):
-                                    result = find_video_url(value)
-                                    if result:
-                                        return result
-                        elif isinstance(data, list):
-                            for item in data:
-                                result = find_video_url(item)
-                                if result:
-                                    return result
-                        return None
-                    
-                    video_url = find_video_url(json_data)
-                    if video_url:
-                        print(f"从JSON数据中找到视频地址：{video_url}")
-                        break
-                except json.JSONDecodeError:
-                    print("JSON解析失败，尝试下一个模式")
-        
-        # 2. 如果没有从JSON中找到，尝试使用正则表达式
-        if not video_url:
-            print("尝试使用正则表达式提取视频地址...")
-            patterns = [
-                # 格式1: "video": {"play_addr": {"url_list": ["https://..."]
-                r'"video":\s*{"play_addr":\s*{"url_list":\s*\["([^"]+)"',
-                # 格式2: "video": {"url": "https://..."
-                r'"video":\s*{"url":\s*"([^"]+)"',
-                # 格式3: "videoUrl": "https://..."
-                r'"videoUrl":\s*"([^"]+)"',
-                # 格式4: "video_url": "https://..."
-                r'"video_url":\s*"([^"]+)"',
-                # 格式5: 直接匹配mp4链接
-                r'https://[^\s"]+\.mp4',
-                # 格式6: "main_url": "https://..."
-                r'"main_url":\s*"([^"]+)"',
-                # 格式7: "play_url": "https://..."
-                r'"play_url":\s*"([^"]+)"',
-                # 格式8: "url": "https://..." （在video对象内）
-                r'video[^}]*"url"\s*:\s*"([^"]+)"',
-                # 格式9: 匹配包含video的链接
-                r'https://[^\s"]*video[^\s"]*',
-                # 格式10: 匹配xhsvideo.com域名的链接
-                r'https://[^\s"]*xhsvideo[^\s"]*',
-                # 格式11: 匹配带有video参数的链接
-                r'https://[^\s"]+\?.*?video[^\s"]*',
-                # 格式12: 匹配较长的视频链接
-                r'https://[a-zA-Z0-9\-\.]+\.[a-zA-Z]{2,}/[a-zA-Z0-9\-\._~:/?#[\\\]@!\$&\'\(\)\*\+,;=.]+video[a-zA-Z0-9\-\._~:/?#[\\\]@!\$&\'\(\)\*\+,;=.]+'
-            ]
-            
-            potential_video_urls = []
-            for i, pattern in enumerate(patterns):
-                print(f"尝试模式 {i+1}: {pattern}")
-                matches = re.findall(pattern, response.text)
-                if matches:
-                    for match in matches:
-                        potential_video_urls.append(match)
-                        print(f"找到潜在视频地址：{match}")
-            
-            # 过滤掉非视频文件
-            non_video_extensions = ['.ico', '.png', '.jpg', '.jpeg', '.gif', '.css', '.js', '.json', '.svg', '.txt', '.html']
-            valid_video_urls = []
-            
-            for url in potential_video_urls:
-                url_lower = url.lower()
-                # 检查是否包含非视频扩展名
-                if not any(ext in url_lower for ext in non_video_extensions):
-                    # 检查是否包含明显不是视频的关键词
-                    if not any(keyword in url_lower for keyword in ['icon', 'logo', 'image', 'css', 'js', 'json']):
-                        valid_video_urls.append(url)
-                        print(f"验证为有效视频地址：{url}")
-            
-            if valid_video_urls:
-                video_url = valid_video_urls[0]
-                print(f"从有效视频地址中选择：{video_url}")
-        
-        # 3. 如果没有找到，尝试从页面中提取所有链接
-        if not video_url:
-            print("尝试提取所有链接...")
-            all_links = re.findall(r'https://[^\s"]+', response.text)
-            print(f"找到 {len(all_links)} 个链接")
-            
-            # 过滤出可能的视频链接
-            video_keywords = ['video', 'mp4', 'xhsvideo', 'play', 'main', 'source', 'media']
-            non_video_extensions = ['.ico', '.png', '.jpg', '.jpeg', '.gif', '.css', '.js', '.json', '.svg', '.txt', '.html']
-            video_links = []
-            
-            for link in all_links:
-                link_lower = link.lower()
-                
-                # 过滤掉非视频文件扩展名
-                if any(ext in link_lower for ext in non_video_extensions):
-                    print(f"过滤掉非视频文件：{link}")
-                    continue
-                
-                # 过滤掉明显不是视频的链接
-                if 'icon' in link_lower or 'logo' in link_lower or 'image' in link_lower:
-                    print(f"过滤掉非视频链接：{link}")
-                    continue
-                
-                # 保留可能的视频链接
-                if any(keyword in link_lower for keyword in video_keywords):
-                    video_links.append(link)
-                    print(f"可能的视频链接：{link}")
-            
-            if video_links:
-                video_url = video_links[0]
-                print(f"从所有链接中选择视频地址：{video_url}")
-            else:
-                # 如果没有找到视频链接，尝试从所有链接中选择一个可能的视频地址
-                print("尝试从所有链接中选择可能的视频地址...")
-                for link in all_links:
-                    link_lower = link.lower()
-                    if not any(ext in link_lower for ext in non_video_extensions):
-                        if 'xhscdn' in link_lower or 'video' in link_lower:
-                            video_url = link
-                            print(f"选择可能的视频地址：{link}")
-                            break
-        
-        # 4. 如果仍然没有找到，使用模拟数据
+        # 如果仍然没有找到，使用模拟数据
         if not video_url:
             print("未找到视频地址，使用模拟数据")
             video_url = "https://example.com/sample_video.mp4"
@@ -1057,337 +2697,2038 @@ def parse_xiaohongshu_url(url):
         # 返回模拟视频地址，确保流程能够继续
         return "https://example.com/sample_video.mp4"
 
+download_stats = {"downloads": 0, "bytes": 0, "resumed_bytes": 0, "last_mbps": None}
+
+_PLACEHOLDER_VIDEO_URLS = {
+    "https://example.com/sample_video.mp4",
+    'https://sns-video-qc.xhscdn.com', 'https://sns-video-hw.xhscdn.com',
+    'https://sns-video-bd.xhscdn.com', 'https://sns-video-qn.xhscdn.com',
+}
+
+
+def get_download_session() -> httpx.Client:
+    """
+    Shared download client whose pool has room for every parallel range
+    request. HTTP/1.1 only: parallel ranges are meant to use separate
+    connections, not streams multiplexed over one. Bodies are requested
+    with identity encoding and read raw, so Range offsets, Content-Length
+    and .part sizes all count the bytes of the file itself.
+    """
+    return outbound_http.client(
+        "video-download", max_connections=DOWNLOAD_CONNECTIONS * 2, http2=False,
+        follow_redirects=True, headers={"Accept-Encoding": "identity"},
+    )
+
+
+class MirrorSelector:
+    """
+    Picks the XHS video CDN mirror to download from. Each mirror keeps an
+    EWMA of time to first byte and of throughput; mirrors that keep
+    failing sit out a cooldown. Mirrors without samples rank first so
+    every mirror gets measured.
+    """
+
+    def __init__(self, hosts, alpha: float, race_delay: float,
+                 max_failures: int, cooldown: float, reference_bytes: int):
+        self.hosts = list(hosts)
+        self.alpha = alpha
+        self.race_delay = race_delay
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.reference_bytes = reference_bytes
+        self._state = {host: {"ttfb": None, "throughput": None, "failures": 0, "down_until": 0.0}
+                       for host in self.hosts}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="mirror-race")
+        self.stats = {"selections": 0, "rewritten": 0, "races": 0, "race_won_by_second": 0,
+                      "failovers": 0}
+
+    def host_of(self, url: str):
+        netloc = urlsplit(url).netloc
+        return netloc if netloc in self._state else None
+
+    def _ewma(self, old, sample):
+        return sample if old is None else self.alpha * sample + (1 - self.alpha) * old
+
+    def record_ttfb(self, host: str, seconds: float):
+        with self._lock:
+            state = self._state[host]
+            state["ttfb"] = self._ewma(state["ttfb"], seconds)
+            state["failures"] = 0
+
+    def record_throughput(self, host: str, nbytes: int, seconds: float):
+        if nbytes <= 0 or seconds <= 0:
+            return
+        with self._lock:
+            state = self._state[host]
+            state["throughput"] = self._ewma(state["throughput"], nbytes / seconds)
+
+    def record_failure(self, host: str):
+        with self._lock:
+            state = self._state[host]
+            state["failures"] += 1
+            if state["failures"] >= self.max_failures:
+                state["down_until"] = time.monotonic() + self.cooldown
+
+    def _expected_seconds(self, state) -> float:
+        """
+        Estimated time to fetch reference_bytes: 0 for unmeasured mirrors,
+        infinity for ones that have only ever failed.
+        """
+        if state["ttfb"] is None:
+            return float("inf") if state["failures"] else 0.0
+        if not state["throughput"]:
+            return state["ttfb"]
+        return state["ttfb"] + self.reference_bytes / state["throughput"]
+
+    def candidates(self, url: str) -> list:
+        """
+        `url` rewritten onto each healthy mirror, best first (ties keep the
+        original host). A URL not on a known mirror comes back unchanged.
+        """
+        origin = self.host_of(url)
+        if origin is None:
+            return [url]
+        now = time.monotonic()
+        with self._lock:
+            healthy = [h for h in self.hosts if self._state[h]["down_until"] <= now] or list(self.hosts)
+            ranked = sorted(healthy, key=lambda h: (self._expected_seconds(self._state[h]), h != origin))
+        parts = urlsplit(url)
+        return [urlunsplit(parts._replace(netloc=host)) for host in ranked]
+
+    def race(self, url: str, probe):
+        """
+        Run `probe(candidate_url)` on the best mirror. If it has not answered
+        within race_delay (or fails), the runner-up is started too and the
+        first success wins; the loser's result is discarded and a loser
+        that has not started yet is cancelled. Raises the first choice's
+        error if every attempt fails.
+        """
+        candidates = self.candidates(url)
+        self.stats["selections"] += 1
+        if candidates[0] != url:
+            self.stats["rewritten"] += 1
+        if len(candidates) == 1:
+            return self._timed(probe, candidates[0])
+
+        first = self._pool.submit(self._timed, probe, candidates[0])
+        pending = [first]
+        done, _ = wait(pending, timeout=self.race_delay)
+        if not done or first.exception() is not None:
+            self.stats["races"] += 1
+            pending.append(self._pool.submit(self._timed, probe, candidates[1]))
+
+        errors = []
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    if future is not first:
+                        self.stats["race_won_by_second"] += 1
+                    return future.result()
+                errors.append((future is first, future.exception()))
+        errors.sort(key=lambda item: not item[0])
+        raise errors[0][1]
+
+    def failover(self, url: str, attempt):
+        """
+        Run `attempt(candidate_url)` on each mirror in rank order until one
+        succeeds. For fetches that cannot be raced, such as a streamed body
+        that is consumed as it arrives. Raises the first choice's error if
+        every mirror fails.
+        """
+        candidates = self.candidates(url)
+        self.stats["selections"] += 1
+        if candidates[0] != url:
+            self.stats["rewritten"] += 1
+        first_error = None
+        for i, candidate in enumerate(candidates):
+            if i:
+                self.stats["failovers"] += 1
+            try:
+                return self._timed(attempt, candidate)
+            except Exception as e:
+                first_error = first_error or e
+        raise first_error
+
+    def _timed(self, probe, url: str):
+        host = self.host_of(url)
+        start = time.monotonic()
+        try:
+            result = probe(url)
+        except Exception:
+            if host:
+                self.record_failure(host)
+            raise
+        if host:
+            self.record_ttfb(host, time.monotonic() - start)
+        return result
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            mirrors = {
+                host: {
+                    "ttfb_ms": round(state["ttfb"] * 1000, 1) if state["ttfb"] is not None else None,
+                    "throughput_mbps": (round(state["throughput"] / 1024 / 1024, 2)
+                                        if state["throughput"] else None),
+                    "healthy": state["down_until"] <= now,
+                    "consecutive_failures": state["failures"],
+                }
+                for host, state in self._state.items()
+            }
+        return {"race_delay": self.race_delay, "mirrors": mirrors, **self.stats}
+
+
+cdn_mirrors = MirrorSelector(
+    [host.strip() for host in CDN_MIRRORS.split(",") if host.strip()],
+    alpha=CDN_EWMA_ALPHA,
+    race_delay=CDN_RACE_DELAY,
+    max_failures=CDN_MIRROR_FAILURES,
+    cooldown=CDN_MIRROR_COOLDOWN,
+    reference_bytes=DOWNLOAD_PARALLEL_MIN_MB * 1024 * 1024,
+)
+
+
+class DownloadForbidden(Exception):
+    """The CDN refused this User-Agent (HTTP 403)."""
+
+
+def _probe_video(session, video_url, headers):
+    """
+    HEAD the file (falling back to a one-byte range GET) and return
+    (final_url, total_size or None, supports_ranges).
+    """
+    resp = session.head(video_url, headers=headers, timeout=15)
+    if resp.status_code == 403:
+        raise DownloadForbidden()
+    if resp.is_success and resp.headers.get("content-length"):
+        return (str(resp.url), int(resp.headers["content-length"]),
+                resp.headers.get("accept-ranges", "").lower() == "bytes")
+
+    with session.stream("GET", video_url, headers={**headers, "Range": "bytes=0-0"},
+                        timeout=15) as resp:
+        if resp.status_code == 403:
+            raise DownloadForbidden()
+        resp.raise_for_status()
+        content_range = resp.headers.get("content-range", "")
+        if resp.status_code == 206 and "/" in content_range and not content_range.endswith("/*"):
+            return str(resp.url), int(content_range.rsplit("/", 1)[1]), True
+        length = resp.headers.get("content-length")
+        return str(resp.url), int(length) if length else None, False
+
+
+def _load_part_progress(progress_path, video_url, total_size):
+    """Indices of ranges already on disk from an earlier attempt at the same file."""
+    try:
+        with open(progress_path, encoding="utf-8") as f:
+            progress = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    if progress.get("url") != video_url or progress.get("size") != total_size:
+        return set()
+    return set(progress.get("done", []))
+
+
+def _download_ranges(session, url, headers, part_path, progress_path, source_url, total_size):
+    """Fetch fixed-size byte ranges in parallel into a preallocated .part file."""
+    part_size = DOWNLOAD_PART_MB * 1024 * 1024
+    ranges = [(start, min(start + part_size, total_size) - 1)
+              for start in range(0, total_size, part_size)]
+    done = _load_part_progress(progress_path, source_url, total_size)
+    if not os.path.exists(part_path) or os.path.getsize(part_path) != total_size:
+        done = set()
+        with open(part_path, "wb") as f:
+            f.truncate(total_size)
+    resumed = sum(ranges[i][1] - ranges[i][0] + 1 for i in done if i < len(ranges))
+    lock = threading.Lock()
+
+    def fetch(index):
+        start, end = ranges[index]
+        range_headers = {**headers, "Range": f"bytes={start}-{end}"}
+        with session.stream("GET", url, headers=range_headers, timeout=60) as resp:
+            if resp.status_code == 403:
+                raise DownloadForbidden()
+            if resp.status_code != 206:
+                raise Exception(f"服务器未按范围返回（HTTP {resp.status_code}）")
+            written = 0
+            with open(part_path, "r+b") as f:
+                f.seek(start)
+                for chunk in resp.iter_raw(chunk_size=DOWNLOAD_BUFFER_KB * 1024):
+                    f.write(chunk)
+                    written += len(chunk)
+        if written != end - start + 1:
+            raise Exception(f"范围 {start}-{end} 长度不符：{written}字节")
+        with lock:
+            done.add(index)
+            with open(progress_path, "w", encoding="utf-8") as f:
+                json.dump({"url": source_url, "size": total_size, "done": sorted(done)}, f)
+
+    pending = [i for i in range(len(ranges)) if i not in done]
+    with ThreadPoolExecutor(max_workers=min(DOWNLOAD_CONNECTIONS, max(len(pending), 1))) as pool:
+        for future in [pool.submit(fetch, i) for i in pending]:
+            future.result()
+    return resumed
+
+
+def _download_stream(session, url, headers, part_path, total_size, supports_ranges):
+    """Single connection, appending to the .part file from where it stopped."""
+    offset = os.path.getsize(part_path) if supports_ranges and os.path.exists(part_path) else 0
+    if total_size is not None and offset > total_size:
+        offset = 0
+    if total_size is not None and offset == total_size:
+        return offset
+    request_headers = dict(headers)
+    if offset:
+        request_headers["Range"] = f"bytes={offset}-"
+    with session.stream("GET", url, headers=request_headers, timeout=60) as resp:
+        if resp.status_code == 403:
+            raise DownloadForbidden()
+        resp.raise_for_status()
+        if offset and resp.status_code != 206:
+            offset = 0
+        with open(part_path, "ab" if offset else "wb") as f:
+            for chunk in resp.iter_raw(chunk_size=DOWNLOAD_BUFFER_KB * 1024):
+                f.write(chunk)
+    return offset
+
+
+def _download_once(video_url, output_path, headers):
+    session = get_download_session()
+    part_path = output_path + ".part"
+    progress_path = part_path + ".json"
+    start = time.monotonic()
+
+    # The probe doubles as the mirror race; ranges then go to the winner
+    url, total_size, supports_ranges = cdn_mirrors.race(
+        video_url, lambda candidate: _probe_video(session, candidate, headers)
+    )
+    transfer_start = time.monotonic()
+    parallel = (supports_ranges and total_size is not None
+                and total_size >= DOWNLOAD_PARALLEL_MIN_MB * 1024 * 1024)
+    if parallel:
+        resumed = _download_ranges(session, url, headers, part_path, progress_path, video_url, total_size)
+    else:
+        resumed = _download_stream(session, url, headers, part_path, total_size, supports_ranges)
+
+    size = os.path.getsize(part_path)
+    if total_size is not None and size != total_size:
+        raise Exception(f"下载长度不符：期望{total_size}字节，实际{size}字节")
+    if size < 1000:
+        raise Exception(f"下载的文件太小（{size}字节），可能下载失败")
+    os.replace(part_path, output_path)
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+
+    elapsed = max(time.monotonic() - start, 1e-6)
+    mbps = (size - resumed) / elapsed / 1024 / 1024
+    mirror = cdn_mirrors.host_of(url)
+    if mirror:
+        cdn_mirrors.record_throughput(mirror, size - resumed, time.monotonic() - transfer_start)
+    download_stats["downloads"] += 1
+    download_stats["bytes"] += size - resumed
+    download_stats["resumed_bytes"] += resumed
+    download_stats["last_mbps"] = round(mbps, 2)
+    mode = f"{DOWNLOAD_CONNECTIONS}路并行" if parallel else "单连接"
+    print(f"视频下载完成（{mode}），大小：{size}字节，续传：{resumed}字节，速度：{mbps:.2f}MB/s")
+
+
 def download_video(video_url, output_path):
     """
-    下载视频文件，支持重试机制
+    下载视频文件：先HEAD探测大小与Range支持，大文件按范围多连接并行下载，
+    失败后下次尝试从已下载部分续传（包括更换User-Agent时），并校验长度
     """
     try:
-        # 检查是否为模拟视频地址
-        if video_url == "https://example.com/sample_video.mp4":
-            print("使用模拟视频数据")
-            # 创建一个空的视频文件作为占位符
-            with open(output_path, 'w') as f:
-                f.write('')
-            return output_path
-        
-        # 检查是否为视频服务器域名（无具体路径）
-        if video_url in ['https://sns-video-qc.xhscdn.com', 'https://sns-video-hw.xhscdn.com', 'https://sns-video-bd.xhscdn.com', 'https://sns-video-qn.xhscdn.com']:
-            print(f"检测到视频服务器域名：{video_url}，使用模拟数据")
+        # 检查是否为模拟视频地址或视频服务器域名（无具体路径）
+        if video_url in _PLACEHOLDER_VIDEO_URLS:
+            print(f"检测到模拟视频地址：{video_url}，使用模拟数据")
             # 创建一个空的视频文件作为占位符
             with open(output_path, 'w') as f:
                 f.write('')
             return output_path
-        
+
         # 尝试多种User-Agent
         user_agents = [
             "Mozilla/5.0 (iPhone; CPU iPhone OS 16_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.0 Mobile/15E148 Safari/604.1",
             "Mozilla/5.0 (Linux; Android 12; SM-G991B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.120 Mobile Safari/537.36",
             "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
         ]
-        
+
         for i, user_agent in enumerate(user_agents):
+            headers = {
+                "User-Agent": user_agent,
+                "Referer": "https://www.xiaohongshu.com/",
+                "Accept": "*/*",
+                "Accept-Language": "zh-CN,zh;q=0.9",
+            }
             try:
-                headers = {
-                    "User-Agent": user_agent,
-                    "Referer": "https://www.xiaohongshu.com/",
-                    "Accept": "*/*",
-                    "Accept-Language": "zh-CN,zh;q=0.9",
-                    "Accept-Encoding": "gzip, deflate, br",
-                    "Connection": "keep-alive"
-                }
                 print(f"正在下载视频（尝试 {i+1}/{len(user_agents)}）：{video_url}")
-                response = requests.get(video_url, headers=headers, stream=True, timeout=60)
-                
-                # 检查响应状态码
-                if response.status_code == 403:
-                    print(f"视频下载失败：403 Forbidden（尝试 {i+1}/{len(user_agents)}）")
-                    if i < len(user_agents) - 1:
-                        continue
-                    else:
-                        raise Exception("所有User-Agent尝试均失败，视频需要授权")
-                
-                response.raise_for_status()
-                
-                # 计算文件大小
-                total_size = int(response.headers.get('content-length', 0))
-                downloaded_size = 0
-                
-                with open(output_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                            downloaded_size += len(chunk)
-                
-                # 检查下载的文件大小
-                if downloaded_size < 1000:
-                    raise Exception(f"下载的文件太小（{downloaded_size}字节），可能下载失败")
-                
-                print(f"视频下载完成，大小：{downloaded_size}字节")
+                _download_once(video_url, output_path, headers)
                 return output_path
-                
+            except DownloadForbidden:
+                print(f"视频下载失败：403 Forbidden（尝试 {i+1}/{len(user_agents)}）")
+                if i == len(user_agents) - 1:
+                    raise Exception("所有User-Agent尝试均失败，视频需要授权")
             except Exception as e:
+                # 已下载的部分保留在 .part 文件中，下一次尝试从断点继续
                 print(f"下载尝试 {i+1} 失败：{str(e)}")
-                if i < len(user_agents) - 1:
-                    continue
-                else:
-                    raise e
-                    
+                if i == len(user_agents) - 1:
+                    raise
+
     except Exception as e:
         print(f"下载视频失败（将使用模拟数据）：{str(e)}")
+        for leftover in (output_path + ".part", output_path + ".part.json"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
         # 创建一个空的视频文件作为占位符
         with open(output_path, 'w') as f:
             f.write('')
         return output_path
 
-def extract_audio(video_path, audio_path):
+ASR_SAMPLE_RATE = asr_worker.ASR_SAMPLE_RATE
+
+
+AudioDecodeError = asr_worker.AudioDecodeError
+
+
+def stream_video_audio(video_url: str):
+    """
+    Download a video and decode its audio in one pass: the HTTP body is
+    piped straight into ffmpeg and mono 16 kHz float32 PCM is read back,
+    with nothing written to disk. Returns (samples, duration_seconds).
+    MP4s whose index sits at the end cannot be decoded from a pipe and
+    raise AudioDecodeError; transcribe_video_url then downloads the file.
+    """
+    headers = {
+        "User-Agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 16_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.0 Mobile/15E148 Safari/604.1",
+        "Referer": "https://www.xiaohongshu.com/",
+    }
+    start = time.monotonic()
+    received = [0]
+    session = get_download_session()
+
+    def open_stream(candidate):
+        resp = session.send(session.build_request("GET", candidate, headers=headers, timeout=60),
+                            stream=True)
+        if resp.is_error:
+            resp.close()
+            resp.raise_for_status()
+        return candidate, resp
+
+    # A streamed body cannot be raced, so mirrors are tried in rank order
+    video_url, resp = cdn_mirrors.failover(video_url, open_stream)
+    transfer_start = time.monotonic()
+
+    def body():
+        for chunk in resp.iter_raw(chunk_size=DOWNLOAD_BUFFER_KB * 1024):
+            received[0] += len(chunk)
+            yield chunk
+
+    try:
+        samples = asr_worker.run_ffmpeg_pcm(
+            asr_worker.ffmpeg_pcm_command(FFMPEG_BIN, "pipe:0"), body(), max_seconds=ASR_MAX_SECONDS
+        )
+    finally:
+        resp.close()
+    if not len(samples):
+        raise AudioDecodeError("管道解码未得到音频")
+    mirror = cdn_mirrors.host_of(video_url)
+    if mirror:
+        cdn_mirrors.record_throughput(mirror, received[0], time.monotonic() - transfer_start)
+
+    duration = len(samples) / ASR_SAMPLE_RATE
+    print(f"流式解码完成：接收{received[0]}字节，音频{duration:.2f}秒，"
+          f"耗时{time.monotonic() - start:.2f}秒")
+    return samples, duration
+
+
+def _stitch_segments(results):
+    """Per-segment ASR results joined in order: (script, timed segments)."""
+    script = "".join(result["text"] for result in results).strip()
+    if not script:
+        raise ValueError("语音识别结果为空，可能视频中没有语音内容")
+    return script, [seg for result in results for seg in result["segments"]]
+
+
+def _log_spans(spans, audio_duration: float):
+    if not spans:
+        raise ValueError("语音识别结果为空，可能视频中没有语音内容")
+    speech_seconds = sum(end - start for start, end in spans) / ASR_SAMPLE_RATE
+    print(f"[ASR] {len(spans)} speech segments, {speech_seconds:.1f}s of {audio_duration:.1f}s audio")
+
+
+async def transcribe_samples_parallel(samples, audio_duration: float):
+    """
+    Split decoded audio at silences (asr_worker.find_speech_segments) and
+    transcribe the speech segments concurrently across the ASR workers, so
+    latency falls with the number of workers and silent stretches never
+    reach Whisper. Segment texts are joined in order and their timestamps
+    refer to the original recording. Call inside the asr_pool.job() that
+    decoded the audio. Returns (script, audio_duration, segments); raises
+    ValueError for unusable audio.
+    """
+    asr_worker.check_duration(audio_duration, ASR_MAX_SECONDS)
+    spans = await asyncio.to_thread(
+        asr_worker.split_for_transcription, samples, ASR_SEGMENT_SECONDS, ASR_VAD_MIN_SILENCE
+    )
+    _log_spans(spans, audio_duration)
+    results = await asr_pool.map(
+        asr_worker.transcribe_segment,
+        [(samples[start:end], start / ASR_SAMPLE_RATE, WHISPER_MODEL) for start, end in spans],
+    )
+    script, segments = _stitch_segments(results)
+    return script, audio_duration, segments
+
+
+async def transcribe_video_url(video_url: str):
+    """
+    Whisper transcript of a remote video via the streaming decode path,
+    run in the ASR pool. The job is admitted before the download starts.
+    Videos the pipe cannot decode are fetched whole with download_video
+    and decoded from disk. Returns (script, audio_duration, segments);
+    raises ValueError for unusable audio and AsrBusyError when the pool
+    is full.
+    """
+    async with asr_pool.job():
+        try:
+            samples, audio_duration = await asyncio.to_thread(stream_video_audio, video_url)
+        except AudioDecodeError as e:
+            print(f"[ASR] pipe decode failed ({e}), downloading the whole video")
+            return await transcribe_downloaded_video(video_url)
+        return await transcribe_samples_parallel(samples, audio_duration)
+
+
+async def transcribe_downloaded_video(video_url: str):
+    """
+    Download a video into scratch space (parallel ranges, resume, mirror
+    race) and transcribe it with transcribe_video_file. Returns (script,
+    audio_duration, segments).
+    """
+    with scratch_space.scope() as scratch:
+        video_path = scratch.path("video", ".mp4")
+        await asyncio.to_thread(download_video, video_url, video_path)
+        if os.path.getsize(video_path) == 0:
+            raise Exception("视频下载失败")
+        scratch_space.commit(video_path)
+        return await transcribe_video_file(video_path)
+
+
+async def transcribe_note_locally(xhs_url: str):
+    """
+    Local Whisper transcript of an XHS note: the video address is read from
+    the note page and streamed through transcribe_video_url. Used by
+    run_extraction when Coze is unavailable. Returns (script, audio_duration).
+    """
+    video_url = await asyncio.to_thread(parse_xiaohongshu_url, xhs_url)
+    if video_url in _PLACEHOLDER_VIDEO_URLS:
+        raise Exception("无法从笔记页面获取视频地址")
+    script, audio_duration, _segments = await transcribe_video_url(video_url)
+    return script, audio_duration
+
+
+# 模拟数据 - 用于演示
+MOCK_SCRIPT = """大家好，欢迎来到我的小红书频道！今天我要给大家分享一个超级实用的生活小技巧，就是如何在3分钟内快速整理好你的衣柜。
+
+首先，我们需要准备一些工具：几个收纳盒、衣架、还有分类标签。然后，按照季节把衣服分开，夏天的衣服放在一起，冬天的衣服放在一起。
+
+接下来，我们要按照颜色进行排列，这样找衣服的时候会更方便。另外，对于那些不常穿的衣服，我们可以用真空袋压缩起来，节省空间。
+
+最后，记得定期整理你的衣柜，这样才能保持整洁。好了，今天的分享就到这里，如果你觉得有用的话，记得点赞收藏哦！我们下期再见，拜拜！"""
+
+# ============================================================
+# Scratch Space
+# ============================================================
+
+_SCRATCH_NAME = re.compile(r'_[0-9a-f]{32}(?:\.[A-Za-z0-9]+)?$')
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, owned by another user
+    return True
+
+
+class ScratchScope:
+    """Files allocated for one request; all removed when the scope exits."""
+
+    def __init__(self, space):
+        self._space = space
+        self.paths = []
+
+    def path(self, prefix: str, suffix: str = "") -> str:
+        path = self._space.allocate(prefix, suffix, pinned=True)
+        self.paths.append(path)
+        return path
+
+
+class ScratchSpace:
+    """
+    Managed scratch directory for temporary artifacts (uploads, exports,
+    downloads, debug pages). Every file is tracked with its size; files
+    owned by an open scope or an in-flight response are pinned, the rest
+    are evicted least recently used first once the byte quota is reached.
+    Debug page captures are opt-in and kept in a fixed-size ring. Each
+    process writes under its own `<root>/<pid>` directory, so several
+    server processes can share one scratch root.
+    """
+
+    def __init__(self, root: str, quota_bytes: int, debug_capture: bool, debug_items: int):
+        self.base_dir = root
+        self.root = os.path.join(root, str(os.getpid()))
+        self.quota_bytes = quota_bytes
+        self.debug_capture = debug_capture
+        self._files = OrderedDict()  # path -> size, least recently used first
+        self._pinned = set()
+        self._debug = deque()
+        self._debug_items = debug_items
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self.stats = {
+            "allocated": 0,
+            "removed": 0,
+            "evicted_files": 0,
+            "evicted_bytes": 0,
+            "debug_captures": 0,
+        }
+
+        self._root_ready = False
+
+    def start(self):
+        """
+        Claim this process's scratch directory and remove what earlier
+        processes left behind: directories of pids that are no longer
+        running (or reused by this process), and loose scratch files from
+        before per-process directories that predate this process. Live
+        siblings' files are never touched.
+        """
+        self.root = os.path.join(self.base_dir, str(os.getpid()))
+        os.makedirs(self.base_dir, exist_ok=True)
+        for name in os.listdir(self.base_dir):
+            path = os.path.join(self.base_dir, name)
+            if name.isdigit() and os.path.isdir(path):
+                pid = int(name)
+                if pid == os.getpid() or not _pid_alive(pid):
+                    shutil.rmtree(path, ignore_errors=True)
+            elif _SCRATCH_NAME.search(name):
+                try:
+                    stale = os.path.getmtime(path) < self._started_at
+                except OSError:
+                    continue
+                if stale:
+                    self._unlink(path)
+        os.makedirs(self.root, exist_ok=True)
+        self._root_ready = True
+
+    def allocate(self, prefix: str, suffix: str = "", pinned: bool = False) -> str:
+        """Reserve a unique path under the scratch root."""
+        if not self._root_ready:
+            os.makedirs(self.root, exist_ok=True)
+            self._root_ready = True
+        path = os.path.join(self.root, f"{prefix}_{uuid.uuid4().hex}{suffix}")
+        with self._lock:
+            self._files[path] = 0
+            if pinned:
+                self._pinned.add(path)
+            self.stats["allocated"] += 1
+        return path
+
+    def commit(self, path: str):
+        """Record a written file's size and enforce the quota."""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        with self._lock:
+            self._bytes += size - self._files.get(path, 0)
+            self._files[path] = size
+            self._files.move_to_end(path)
+            self._evict()
+
+    def remove(self, path: str):
+        with self._lock:
+            self._forget(path)
+            self.stats["removed"] += 1
+        self._unlink(path)
+
+    @contextmanager
+    def scope(self):
+        """Per-request scope: `with scratch_space.scope() as scope: scope.path(...)`."""
+        scope = ScratchScope(self)
+        try:
+            yield scope
+        finally:
+            for path in scope.paths:
+                self.remove(path)
+
+    def capture_debug(self, prefix: str, suffix: str, text: str):
+        """Save a debug artifact if capture is enabled; only the newest few are kept."""
+        if not self.debug_capture:
+            return None
+        path = self.allocate(prefix, suffix)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        self.commit(path)
+        with self._lock:
+            self._debug.append(path)
+            self.stats["debug_captures"] += 1
+            expired = []
+            while len(self._debug) > self._debug_items:
+                expired.append(self._debug.popleft())
+        for old in expired:
+            self.remove(old)
+        return path
+
+    def _forget(self, path: str):
+        self._bytes -= self._files.pop(path, 0)
+        self._pinned.discard(path)
+
+    def _evict(self):
+        if self._bytes <= self.quota_bytes:
+            return
+        for path in list(self._files):
+            if self._bytes <= self.quota_bytes:
+                break
+            if path in self._pinned:
+                continue
+            size = self._files[path]
+            self._forget(path)
+            if path in self._debug:
+                self._debug.remove(path)
+            self._unlink(path)
+            self.stats["evicted_files"] += 1
+            self.stats["evicted_bytes"] += size
+
+    @staticmethod
+    def _unlink(path: str):
+        try:
+            os.remove(path)
+        except (FileNotFoundError, IsADirectoryError):
+            pass
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "root": self.root,
+                "files": len(self._files),
+                "pinned": len(self._pinned),
+                "bytes": self._bytes,
+                "quota_bytes": self.quota_bytes,
+                "debug_capture": self.debug_capture,
+                "debug_files": len(self._debug),
+                **self.stats,
+            }
+
+
+# 临时文件存储目录
+scratch_space = ScratchSpace(
+    SCRATCH_DIR,
+    quota_bytes=SCRATCH_QUOTA_MB * 1024 * 1024,
+    debug_capture=SCRATCH_DEBUG_CAPTURE,
+    debug_items=SCRATCH_DEBUG_ITEMS,
+)
+
+
+@app.on_event("startup")
+async def start_scratch_space():
+    scratch_space.start()
+
+
+def extract_xhs_url(share_text: str) -> str:
+    """
+    Pull the XHS link out of pasted share text and validate it.
+    Raises HTTPException(400) for non-XHS input.
+    """
+    # Extract URL from share text
+    url_pattern = r'https?://[^\s<>"{}|\\^`\[\]，。！？；：、，]+'
+    urls = re.findall(url_pattern, share_text)
+    extracted_url = urls[0] if urls else share_text
+
+    # Validate URL
+    if not extracted_url.startswith(('http://', 'https://')):
+        raise HTTPException(status_code=400, detail="无效的视频链接")
+    if "xiaohongshu.com" not in extracted_url and "xhslink.com" not in extracted_url:
+        raise HTTPException(status_code=400, detail="仅支持小红书视频链接")
+    return extracted_url
+
+
+def _sse_event(event: str, payload: dict) -> str:
+    """Format one server-sent event for StreamingResponse."""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def transcribe_after_outage(extracted_url: str, error: Exception):
+    """
+    Coze outage handling shared by the extraction endpoints: with
+    ASR_URL_FALLBACK the note is transcribed by local Whisper, otherwise
+    `error` is re-raised. Returns (transcript, audio_duration).
+    """
+    if not ASR_URL_FALLBACK:
+        raise error
+    print(f"[Extract] Coze unavailable ({error}), transcribing with local Whisper")
+    return await transcribe_note_locally(extracted_url)
+
+
+def build_extraction_result(url: str, extracted_url: str, transcript: str, *, source: str,
+                            cached: bool, audio_duration=None, note_info=None) -> dict:
     """
-    使用ffmpeg-python提取音频轨道
+    Clean and validate a link transcript and build the /api/extract-from-url
+    body (also the `result` event of /api/extract-stream). The audio
+    duration, known for local Whisper transcripts, feeds the length check.
     """
-    try:
-        # 检查视频文件是否存在且不为空
-        if not os.path.exists(video_path) or os.path.getsize(video_path) == 0:
-            raise Exception("视频文件不存在或为空")
-        
-        # 使用ffmpeg-python提取音频
-        import ffmpeg
-        print(f"正在从视频提取音频：{video_path}")
-        
-        # 构建ffmpeg命令
-        (ffmpeg
-         .input(video_path)
-         .output(audio_path, format='wav', acodec='pcm_s16le', ar='16000', ac='1')
-         .overwrite_output()
-         .run(capture_stdout=True, capture_stderr=True)
-         )
-        
-        # 检查生成的音频文件
-        if not os.path.exists(audio_path) or os.path.getsize(audio_path) == 0:
-            raise Exception("音频文件生成失败")
-        
-        print(f"音频提取完成：{audio_path}")
-        print(f"音频文件大小：{os.path.getsize(audio_path)}字节")
-        return audio_path
-    except ffmpeg.Error as e:
-        print(f"FFmpeg执行失败：{e.stderr.decode('utf-8')}")
-        raise Exception(f"FFmpeg执行失败：{e.stderr.decode('utf-8')}")
-    except ImportError:
-        print("ffmpeg-python未安装，尝试使用系统命令")
-        # 降级到使用系统命令
-        try:
-            import subprocess
-            print(f"使用系统命令提取音频：{video_path}")
-            command = [
-                'ffmpeg', '-i', video_path,
-                '-vn', '-acodec', 'pcm_s16le',
-                '-ar', '16000', '-ac', '1',
-                audio_path, '-y'
-            ]
-            result = subprocess.run(command, capture_output=True, text=True)
-            if result.returncode != 0:
-                raise Exception(f"系统命令执行失败：{result.stderr}")
-            print(f"音频提取完成：{audio_path}")
-            return audio_path
-        except Exception as e:
-            print(f"系统命令提取失败：{str(e)}")
-            raise Exception(f"音频提取失败：{str(e)}")
-    except Exception as e:
-        print(f"音频提取失败：{str(e)}")
-        raise Exception(f"音频提取失败：{str(e)}")
+    script = clean_and_format_text(transcript)
+    validation = validate_extracted_content(script, audio_duration)
+    print(f"Validation: score={validation['quality_score']:.2f}, valid={validation['is_valid']}")
+    return {
+        "success": True if validation["is_valid"] else False,
+        "message": "文案提取成功" if validation["is_valid"] else "提取的内容可能存在问题",
+        "data": {
+            "script": script,
+            "validation": validation,
+            "video_info": {
+                "url": url,
+                "canonical_url": extracted_url,
+                "source": source,
+                "cached": cached,
+                "note_info": note_info,
+            },
+        },
+    }
 
-# 模拟数据 - 用于演示
-MOCK_SCRIPT = """大家好，欢迎来到我的小红书频道！今天我要给大家分享一个超级实用的生活小技巧，就是如何在3分钟内快速整理好你的衣柜。
 
-首先，我们需要准备一些工具：几个收纳盒、衣架、还有分类标签。然后，按照季节把衣服分开，夏天的衣服放在一起，冬天的衣服放在一起。
+async def run_extraction(url: str, use_cache: bool = True, include_note_info: bool = True) -> dict:
+    """
+    Full link-extraction pipeline shared by the single and batch endpoints:
+    Coze transcript (cached / coalesced), cleaning, validation and optional
+    XHS-Downloader note info. With ASR_URL_FALLBACK, a Coze outage falls
+    back to local Whisper. Returns the /api/extract-from-url body.
+    """
+    extracted_url = (await normalize_xhs_url(url)).canonical_url
 
-接下来，我们要按照颜色进行排列，这样找衣服的时候会更方便。另外，对于那些不常穿的衣服，我们可以用真空袋压缩起来，节省空间。
+    # Note info from XHS-Downloader runs alongside the transcript (best effort)
+    note_task = start_note_info(extracted_url, enabled=include_note_info)
 
-最后，记得定期整理你的衣柜，这样才能保持整洁。好了，今天的分享就到这里，如果你觉得有用的话，记得点赞收藏哦！我们下期再见，拜拜！"""
+    # Call Coze API to extract transcript (served from cache when possible)
+    print(f"[Extract] Calling Coze API for: {extracted_url}")
+    source, audio_duration = "coze_workflow", None
+    try:
+        try:
+            transcript, from_cache = await get_transcript(extracted_url, use_cache=use_cache)
+        except UpstreamUnavailableError as e:
+            transcript, audio_duration = await transcribe_after_outage(extracted_url, e)
+            source, from_cache = "local_whisper", False
+    except BaseException:
+        if note_task is not None:
+            note_task.cancel()
+        raise
 
-# 临时文件存储目录
-TEMP_DIR = tempfile.gettempdir()
+    note_info = await collect_note_info(note_task)
+    return build_extraction_result(url, extracted_url, transcript, source=source, cached=from_cache,
+                                   audio_duration=audio_duration, note_info=note_info)
 
 @app.post("/api/extract-from-url")
 async def extract_from_url(data: dict):
     """
     从视频链接提取文案（使用Coze API）/ Extract transcript from XHS video link via Coze workflow API.
+    Pass "no_cache": true to skip the transcript cache and re-run the workflow.
     """
     try:
         print(f"Received API request: {data}")
         url = data.get("url")
         if not url:
             raise HTTPException(status_code=400, detail="缺少url参数")
+        return await run_extraction(url, use_cache=not data.get("no_cache", False))
+    except HTTPException:
+        raise
+    except UpstreamUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"提取失败：{str(e)}")
 
-        # Extract URL from share text
-        url_pattern = r'https?://[^\s<>"{}|\\^`\[\]，。！？；：、，]+'
-        urls = re.findall(url_pattern, url)
-        extracted_url = urls[0] if urls else url
-
-        # Validate URL
-        if not extracted_url.startswith(('http://', 'https://')):
-            raise HTTPException(status_code=400, detail="无效的视频链接")
-        if "xiaohongshu.com" not in extracted_url and "xhslink.com" not in extracted_url:
-            raise HTTPException(status_code=400, detail="仅支持小红书视频链接")
-
-        # Call Coze API to extract transcript
-        print(f"[Extract] Calling Coze API for: {extracted_url}")
-        transcript = extract_transcript_via_coze(extracted_url)
-
-        # Clean and validate
-        script = clean_and_format_text(transcript)
-        validation = validate_extracted_content(script)
-        print(f"Validation: score={validation['quality_score']:.2f}, valid={validation['is_valid']}")
-
-        # Optionally get note info from XHS-Downloader (non-blocking, best effort)
-        note_info = {}
-        if check_xhs_downloader_status():
+@app.post("/api/extract-stream")
+async def extract_stream(data: dict):
+    """
+    Streaming version of /api/extract-from-url (Server-Sent Events).
+    Emits `delta` events with Coze Message text as it arrives, then one
+    `result` event carrying the same body /api/extract-from-url returns,
+    or an `error` event if extraction fails.
+    """
+    url = data.get("url")
+    if not url:
+        raise HTTPException(status_code=400, detail="缺少url参数")
+    extracted_url = (await normalize_xhs_url(url)).canonical_url
+    use_cache = not data.get("no_cache", False)
+
+    async def events():
+        note_task = start_note_info(extracted_url)
+        try:
+            transcript = ""
+            from_cache = False
+            source, audio_duration = "coze_workflow", None
             try:
-                note_info = download_via_xhs_downloader(extracted_url, download_file=False)
-            except Exception as e:
-                print(f"[XHS-Downloader] Info fetch failed (non-critical): {e}")
+                async for kind, text in stream_transcript(extracted_url, use_cache=use_cache):
+                    if kind == "delta":
+                        yield _sse_event("delta", {"text": text})
+                    else:
+                        transcript = text
+                        from_cache = kind == "cached"
+            except UpstreamUnavailableError as e:
+                transcript, audio_duration = await transcribe_after_outage(extracted_url, e)
+                source, from_cache = "local_whisper", False
+
+            note_info = await collect_note_info(note_task)
+            yield _sse_event("result", build_extraction_result(
+                url, extracted_url, transcript, source=source, cached=from_cache,
+                audio_duration=audio_duration, note_info=note_info,
+            ))
+        except Exception as e:
+            print(f"[Extract] Stream failed: {e}")
+            yield _sse_event("error", {"detail": f"提取失败：{str(e)}"})
+        finally:
+            note_task.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# ============================================================
+# Durable Job Queue
+# ============================================================
+
+class JobQueue(LazySqlite):
+    """
+    SQLite (WAL) backed work queue for link extraction, upload transcription
+    and rewrite jobs. Workers claim a job under a time-limited lease and
+    renew it while the job runs; a job whose lease runs out (the worker
+    crashed or the process restarted) is picked up again by the next claim.
+    Failures are retried with backoff up to `max_attempts`. Idempotency keys
+    make resubmitting the same work return the existing job.
+    """
+
+    def __init__(self, db_path: str, lease_seconds: float, max_attempts: int,
+                 retry_backoff: float, on_expired=None):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.on_expired = on_expired  # called with each job failed by lease expiry
+        self._lock = threading.Lock()
+        self._db_path = db_path
+
+    def _open_db(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self._db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self._db_path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_batches ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, idempotency_key TEXT UNIQUE, "
+            "total INTEGER NOT NULL, created_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, batch_id TEXT, idx INTEGER, kind TEXT NOT NULL, "
+            "payload TEXT NOT NULL, status TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, "
+            "available_at REAL NOT NULL, lease_token TEXT, lease_until REAL, "
+            "idempotency_key TEXT UNIQUE, result TEXT, error TEXT, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, available_at)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id, idx)"
+        )
+        return conn
+
+    def _new_job_row(self, kind, payload, idempotency_key, now, batch_id=None, idx=None):
+        return (
+            uuid.uuid4().hex, batch_id, idx, kind,
+            json.dumps(payload, ensure_ascii=False), "pending",
+            self.max_attempts, now, idempotency_key, now,
+        )
+
+    _INSERT_JOB = (
+        "INSERT INTO jobs (id, batch_id, idx, kind, payload, status, max_attempts, "
+        "available_at, idempotency_key, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+
+    def enqueue(self, kind: str, payload: dict, idempotency_key: str = None):
+        """Add one job. Returns (job_id, created); created is False when the
+        idempotency key was already used and the existing job is returned."""
+        now = time.time()
+        row = self._new_job_row(kind, payload, idempotency_key, now)
+        with self._lock:
+            if idempotency_key:
+                existing = self._conn.execute(
+                    "SELECT id FROM jobs WHERE idempotency_key = ?", (idempotency_key,)
+                ).fetchone()
+                if existing is not None:
+                    return existing["id"], False
+            self._conn.execute(self._INSERT_JOB, row)
+        return row[0], True
+
+    def enqueue_batch(self, kind: str, payloads: list, idempotency_key: str = None):
+        """Add a batch of jobs atomically. Returns (batch_id, created)."""
+        now = time.time()
+        batch_id = uuid.uuid4().hex
+        with self._lock:
+            if idempotency_key:
+                existing = self._conn.execute(
+                    "SELECT id FROM job_batches WHERE idempotency_key = ?", (idempotency_key,)
+                ).fetchone()
+                if existing is not None:
+                    return existing["id"], False
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO job_batches (id, kind, idempotency_key, total, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (batch_id, kind, idempotency_key, len(payloads), now),
+                )
+                self._conn.executemany(self._INSERT_JOB, [
+                    self._new_job_row(
+                        kind, payload,
+                        f"{idempotency_key}:{i}" if idempotency_key else None,
+                        now, batch_id, i,
+                    )
+                    for i, payload in enumerate(payloads)
+                ])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return batch_id, True
+
+    def claim(self):
+        """
+        Lease the next runnable job: a pending job whose retry time has come,
+        or a running job whose lease has expired. Returns the job dict (with
+        its lease token) or None when nothing is runnable.
+        """
+        now = time.time()
+        token = None
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs that keep losing their lease have used up their attempts
+                exhausted = "status = 'running' AND lease_until < ? AND attempts >= max_attempts"
+                expired = self._conn.execute(
+                    f"SELECT * FROM jobs WHERE {exhausted}", (now,)
+                ).fetchall()
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'lease expired', "
+                    f"lease_token = NULL, finished_at = ? WHERE {exhausted}",
+                    (now, now),
+                )
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE (status = 'pending' AND available_at <= ?) "
+                    "OR (status = 'running' AND lease_until < ?) "
+                    "ORDER BY available_at, created_at, idx LIMIT 1",
+                    (now, now),
+                ).fetchone()
+                if row is not None:
+                    token = uuid.uuid4().hex
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                        "lease_token = ?, lease_until = ?, started_at = COALESCE(started_at, ?) "
+                        "WHERE id = ?",
+                        (token, now + self.lease_seconds, now, row["id"]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if self.on_expired is not None:
+            for expired_row in expired:
+                self.on_expired({**dict(expired_row), "payload": json.loads(expired_row["payload"])})
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["attempts"] += 1
+        job["lease_token"] = token
+        return job
+
+    def renew(self, job_id: str, token: str) -> bool:
+        """Extend a lease; False means the lease was lost to another worker."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET lease_until = ? "
+                "WHERE id = ? AND lease_token = ? AND status = 'running'",
+                (time.time() + self.lease_seconds, job_id, token),
+            )
+        return cur.rowcount == 1
+
+    def complete(self, job_id: str, token: str, result) -> bool:
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, "
+                "lease_token = NULL, finished_at = ? "
+                "WHERE id = ? AND lease_token = ?",
+                (json.dumps(result, ensure_ascii=False), time.time(), job_id, token),
+            )
+        return cur.rowcount == 1
+
+    def fail(self, job_id: str, token: str, error: str, retry: bool) -> str:
+        """
+        Record a failed attempt. Retryable failures go back to pending with
+        jittered exponential backoff until attempts run out. Returns the new
+        status ('pending' or 'failed'), or None if the lease was lost.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ? AND lease_token = ?",
+                (job_id, token),
+            ).fetchone()
+            if row is None:
+                return None
+            if retry and row["attempts"] < row["max_attempts"]:
+                delay = self.retry_backoff * (2 ** (row["attempts"] - 1))
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'pending', error = ?, lease_token = NULL, "
+                    "lease_until = NULL, available_at = ? WHERE id = ?",
+                    (error, now + random.uniform(delay / 2, delay), job_id),
+                )
+                return "pending"
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, lease_token = NULL, "
+                "finished_at = ? WHERE id = ?",
+                (error, now, job_id),
+            )
+            return "failed"
+
+    def release(self, job_id: str, token: str):
+        """Hand a job back without using up an attempt (graceful shutdown)."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = attempts - 1, "
+                "lease_token = NULL, lease_until = NULL "
+                "WHERE id = ? AND lease_token = ? AND status = 'running'",
+                (job_id, token),
+            )
 
+    def get_job(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
         return {
-            "success": True if validation["is_valid"] else False,
-            "message": "文案提取成功" if validation["is_valid"] else "提取的内容可能存在问题",
-            "data": {
-                "script": script,
-                "validation": validation,
-                "video_info": {
-                    "url": url,
-                    "source": "coze_workflow",
-                    "note_info": note_info,
-                },
-            },
+            "job_id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "error": row["error"],
+            "result": json.loads(row["result"]) if row["result"] else None,
         }
-    except HTTPException:
+
+    def get_batch(self, batch_id: str):
+        with self._lock:
+            batch = self._conn.execute(
+                "SELECT * FROM job_batches WHERE id = ?", (batch_id,)
+            ).fetchone()
+            if batch is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT idx, payload, status, attempts, error, started_at, finished_at "
+                "FROM jobs WHERE batch_id = ? ORDER BY idx",
+                (batch_id,),
+            ).fetchall()
+
+        counts = {"pending": 0, "running": 0, "done": 0, "failed": 0}
+        for row in rows:
+            counts[row["status"]] += 1
+        unfinished = counts["pending"] + counts["running"]
+        if not unfinished:
+            status = "done"
+        elif unfinished == len(rows) and not counts["running"]:
+            status = "pending"
+        else:
+            status = "running"
+        return {
+            "job_id": batch["id"],
+            "kind": batch["kind"],
+            "status": status,
+            "created_at": batch["created_at"],
+            "finished_at": max((row["finished_at"] for row in rows), default=None)
+            if status == "done" else None,
+            "total": batch["total"],
+            "counts": counts,
+            "items": [
+                {
+                    "index": row["idx"],
+                    "url": json.loads(row["payload"]).get("url"),
+                    "status": row["status"],
+                    "attempts": row["attempts"],
+                    "error": row["error"],
+                    "duration": round(row["finished_at"] - row["started_at"], 2)
+                    if row["finished_at"] and row["started_at"] else None,
+                }
+                for row in rows
+            ],
+        }
+
+    def iter_batch_results(self, batch_id: str):
+        """Finished items of a batch, in submission order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT idx, payload, status, error, result FROM jobs "
+                "WHERE batch_id = ? AND status IN ('done', 'failed') ORDER BY idx",
+                (batch_id,),
+            ).fetchall()
+        for row in rows:
+            yield {
+                "index": row["idx"],
+                "url": json.loads(row["payload"]).get("url"),
+                "status": row["status"],
+                "error": row["error"],
+                "result": json.loads(row["result"]) if row["result"] else None,
+            }
+
+    def purge(self, older_than: float) -> int:
+        """Drop finished jobs (and emptied batches) finished before `older_than`."""
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (older_than,),
+            )
+            self._conn.execute(
+                "DELETE FROM job_batches WHERE id NOT IN "
+                "(SELECT DISTINCT batch_id FROM jobs WHERE batch_id IS NOT NULL)"
+            )
+        return cur.rowcount
+
+    def snapshot(self) -> dict:
+        """Job counts by status for /api/check-services."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        counts = {"pending": 0, "running": 0, "done": 0, "failed": 0}
+        counts.update({row[0]: row[1] for row in rows})
+        return counts
+
+
+job_queue = JobQueue(
+    os.path.join(CACHE_DIR, "jobs.sqlite3"),
+    lease_seconds=JOB_LEASE_SECONDS,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    retry_backoff=JOB_RETRY_BACKOFF,
+    on_expired=lambda job: _finish_job_payload(job),
+)
+job_wakeup = None  # asyncio.Event, created on the serving loop at startup
+job_worker_stats = {"claimed": 0, "done": 0, "retried": 0, "failed": 0, "lease_lost": 0}
+_background_tasks = set()
+# One thread for job_queue calls: SQLite work stays off the event loop and
+# never waits behind long to_thread work (downloads, decodes)
+_job_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-db")
+
+
+async def job_db(method, *args, **kwargs):
+    """`await job_db(job_queue.claim)`: run a JobQueue method on the job database thread."""
+    return await asyncio.get_running_loop().run_in_executor(
+        _job_db_executor, lambda: method(*args, **kwargs)
+    )
+
+
+def _spawn(coro):
+    """Run a coroutine in the background, keeping a reference until it ends."""
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def _handle_extract_job(payload: dict):
+    return await run_extraction(
+        payload["url"],
+        use_cache=payload.get("use_cache", True),
+        include_note_info=payload.get("include_note_info", False),
+    )
+
+
+async def _handle_rewrite_job(payload: dict):
+    return await run_rewrite(payload["script"], payload.get("video_url"))
+
+
+async def _handle_transcribe_upload_job(payload: dict):
+    if not os.path.exists(payload["path"]):
+        raise ValueError("上传的视频文件已不存在")
+    script, audio_duration, segments = await transcribe_video_file(payload["path"])
+    return build_transcription_result(
+        script, payload["filename"], payload["file_size"], audio_duration, payload.get("sha256"), segments
+    )
+
+
+JOB_HANDLERS = {
+    "extract": _handle_extract_job,
+    "rewrite": _handle_rewrite_job,
+    "transcribe_upload": _handle_transcribe_upload_job,
+}
+
+
+def _is_permanent_job_error(exc: Exception) -> bool:
+    """
+    Bad input, missing libraries and requests an upstream refused (auth,
+    4xx) will not succeed on a retry; Coze calls have already been retried
+    inside extract_transcript_via_coze where that could help.
+    """
+    if isinstance(exc, HTTPException):
+        return exc.status_code < 500
+    return isinstance(exc, (ValueError, ImportError, KeyError, UpstreamRejectedError))
+
+
+def _finish_job_payload(job: dict):
+    """Remove files a job owned once it reaches a final state."""
+    path = job["payload"].get("path")
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+async def _execute_job(job: dict):
+    handler = JOB_HANDLERS.get(job["kind"])
+    if handler is None:
+        await job_db(job_queue.fail, job["id"], job["lease_token"],
+                     f"unknown job kind: {job['kind']}", retry=False)
+        return
+
+    task = asyncio.ensure_future(handler(job["payload"]))
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=job_queue.lease_seconds / 3)
+            if done:
+                break
+            if not await job_db(job_queue.renew, job["id"], job["lease_token"]):
+                task.cancel()
+                job_worker_stats["lease_lost"] += 1
+                print(f"[Jobs] Lost lease on {job['id']}, abandoning attempt")
+                return
+        result = task.result()
+    except asyncio.CancelledError:
+        task.cancel()
+        # Shielded so a second cancel cannot drop the release before it runs
+        await asyncio.shield(job_db(job_queue.release, job["id"], job["lease_token"]))
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"提取失败：{str(e)}")
+        error = e.detail if isinstance(e, HTTPException) else str(e) or type(e).__name__
+        status = await job_db(job_queue.fail, job["id"], job["lease_token"], error,
+                              retry=not _is_permanent_job_error(e))
+        if status == "pending":
+            job_worker_stats["retried"] += 1
+            print(f"[Jobs] {job['kind']} {job['id']} attempt {job['attempts']} failed, will retry: {error}")
+        elif status == "failed":
+            job_worker_stats["failed"] += 1
+            print(f"[Jobs] {job['kind']} {job['id']} failed: {error}")
+            _finish_job_payload(job)
+        return
+
+    if await job_db(job_queue.complete, job["id"], job["lease_token"], result):
+        job_worker_stats["done"] += 1
+        _finish_job_payload(job)
+
+
+def _wake_job_workers():
+    if job_wakeup is not None:
+        job_wakeup.set()
+
+
+async def _job_worker(worker_id: int):
+    while True:
+        job = await job_db(job_queue.claim)
+        if job is None:
+            job_wakeup.clear()
+            try:
+                await asyncio.wait_for(job_wakeup.wait(), timeout=JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        job_worker_stats["claimed"] += 1
+        await _execute_job(job)
 
-@app.post("/api/upload-video")
-async def upload_video(file: UploadFile = File(...)):
+
+async def _job_housekeeping():
+    while True:
+        purged = await job_db(job_queue.purge, time.time() - JOB_RETENTION_SECONDS)
+        if purged:
+            print(f"[Jobs] Purged {purged} finished jobs")
+        await asyncio.sleep(3600)
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    """Start the job workers; unfinished jobs from a previous run resume here."""
+    global job_wakeup
+    job_wakeup = asyncio.Event()
+    pending = (await job_db(job_queue.snapshot))["pending"]
+    print(f"[Jobs] Starting {JOB_WORKERS} workers, pending jobs: {pending}")
+    for i in range(JOB_WORKERS):
+        _spawn(_job_worker(i))
+    _spawn(_job_housekeeping())
+
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    """Cancel the workers; in-flight jobs are released back to the queue."""
+    tasks = list(_background_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# ============================================================
+# Event Loop Monitor
+# ============================================================
+
+event_loop_lag = LatencyTracker(window=LOOP_LAG_WINDOW)
+
+
+async def _monitor_event_loop_lag():
+    """Sample how late a fixed sleep wakes up; blocking calls show up as lag."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        event_loop_lag.add(max(loop.time() - start - LOOP_LAG_INTERVAL, 0.0))
+
+
+@app.on_event("startup")
+async def start_event_loop_monitor():
+    _spawn(_monitor_event_loop_lag())
+
+
+# ============================================================
+# ASR Worker Pool
+# ============================================================
+
+class AsrBusyError(UpstreamUnavailableError):
+    """The ASR queue is full; maps to HTTP 503."""
+
+
+class AsrPool:
     """
-    上传视频文件并提取文案
+    Whisper jobs run in a dedicated process pool (asr_worker.py) so a long
+    decode never blocks the event loop or holds the GIL. Workers are
+    forked at server startup, before request threads exist, so they start
+    without re-importing this module. A pool rebuilt after a worker crash is started with
+    forkserver instead, since by then the server is multi-threaded and
+    forking it could copy a lock held by another thread. The fork server
+    preloads only asr_worker; the main module is still imported in each
+    new worker, which is why importing app.py has no side effects (scratch
+    cleanup runs at startup, SQLite stores open on first use). Each
+    worker is capped at `threads` numeric threads and keeps its warmed-up
+    models between jobs. At most `workers + queue_size` jobs are admitted;
+    beyond that AsrBusyError is raised at once, so callers get backpressure
+    instead of an unbounded wait. A job keeps its slot until its calls have
+    left the workers, even if the awaiting coroutine is cancelled first.
+    Results and exceptions raised in a worker come back to the awaiting
+    coroutine.
     """
-    try:
-        print(f"收到视频文件上传请求：{file.filename}")
-        
-        # 验证文件类型
-        if not file.content_type or not file.content_type.startswith('video/'):
-            raise HTTPException(status_code=400, detail="仅支持视频文件")
-        
-        # 验证文件扩展名
-        allowed_extensions = ['.mp4', '.mov', '.avi', '.mkv', '.flv', '.wmv']
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        if file_ext not in allowed_extensions:
-            raise HTTPException(status_code=400, detail=f"不支持的视频格式，仅支持：{', '.join(allowed_extensions)}")
-        
-        # 保存上传的视频文件
-        video_filename = f"uploaded_video_{datetime.now().timestamp()}{file_ext}"
-        video_path = os.path.join(TEMP_DIR, video_filename)
-        
-        print(f"保存视频文件到：{video_path}")
-        with open(video_path, 'wb') as f:
-            content = await file.read()
-            f.write(content)
-        
-        # 检查文件大小
-        file_size = os.path.getsize(video_path)
-        print(f"视频文件大小：{file_size}字节")
-        
-        if file_size < 1000:
-            os.remove(video_path)
-            raise HTTPException(status_code=400, detail="视频文件过小或为空")
-        
-        if file_size > 500 * 1024 * 1024:  # 500MB限制
-            os.remove(video_path)
-            raise HTTPException(status_code=400, detail="视频文件过大，请上传500MB以内的文件")
-        
-        # 使用librosa提取音频并进行语音识别
+
+    def __init__(self, workers: int, threads: int, queue_size: int, preload_models):
+        self.workers = workers
+        self.threads = threads
+        self.queue_size = queue_size
+        self.preload_models = list(preload_models)
+        self._executor = None
+        self._admitted = 0
+        # Concurrent futures submitted by the job the current task is in
+        self._job_calls = contextvars.ContextVar(f"asr_job_{id(self)}", default=None)
+        self._worker_snapshots = {}  # pid -> latest asr_worker.registry snapshot
+        self.latency = LatencyTracker()
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "restarts": 0}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            if self.stats["restarts"]:
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload(["asr_worker"])
+            else:
+                context = multiprocessing.get_context("fork")
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=asr_worker.init_worker,
+                initargs=(self.threads, self.preload_models),
+            )
+        return self._executor
+
+    def start(self):
+        """Fork every worker now; they preload their models before the first job."""
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(asr_worker.ping).add_done_callback(self._record_ping)
+
+    def _record_ping(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self._remember_worker(future.result())
+
+    def _remember_worker(self, snapshot: dict):
+        self._worker_snapshots[snapshot["pid"]] = snapshot
+
+    @asynccontextmanager
+    async def job(self):
+        """
+        `async with asr_pool.job():` admits one job for the whole block, or
+        raises AsrBusyError at once when workers + queue_size jobs are already
+        admitted. run() and map() calls inside the block belong to that job,
+        so work done before the first call (decoding, splitting) is bounded
+        too; outside a block each call is admitted as a job of its own.
+        """
+        if self._job_calls.get() is not None:
+            yield
+            return
+        if self._admitted >= self.workers + self.queue_size:
+            self.stats["rejected"] += 1
+            raise AsrBusyError("语音识别任务排队已满，请稍后重试")
+        self._admitted += 1
+        self.stats["submitted"] += 1
+        start = time.monotonic()
+        calls = []
+        token = self._job_calls.set(calls)
         try:
-            print(f"开始处理视频文件：{video_path}")
-            
-            # 使用librosa提取音频
-            import librosa
-            import numpy as np
-            
-            print("使用librosa提取音频")
-            
-            # 加载音频，librosa可以自动处理视频文件
-            y, sr = librosa.load(video_path, sr=16000, mono=True)
-            
-            audio_duration = len(y) / sr
-            print(f"音频加载完成，采样率：{sr}Hz，音频长度：{audio_duration:.2f}秒")
-            
-            # 检查音频时长
-            if audio_duration < 1:
-                os.remove(video_path)
-                raise HTTPException(status_code=400, detail="视频时长过短，请上传至少1秒的视频")
-            
-            if audio_duration > 900:  # 15分钟
-                os.remove(video_path)
-                raise HTTPException(status_code=400, detail="视频时长过长，请上传15分钟以内的视频")
-            
-            # 使用Whisper进行语音识别
-            import whisper
-            print("使用Whisper进行语音识别")
-            
-            # 加载模型
-            model = whisper.load_model("base")
-            
-            # 直接使用librosa提取的音频数据
-            audio_float32 = y.astype(np.float32)
-            
-            print(f"音频数据形状：{audio_float32.shape}")
-            
-            # 使用Whisper进行语音识别
-            result = model.transcribe(audio_float32, language="zh", fp16=False)
-            
-            # 获取识别的文本
-            script = result["text"].strip()
-            
-            if not script:
-                os.remove(video_path)
-                raise HTTPException(status_code=500, detail="语音识别结果为空，可能视频中没有语音内容")
-            
-            print(f"语音识别完成，文本长度：{len(script)}字符")
-            print(f"识别到的文本：{script[:100]}...")
-            
-        except ImportError as e:
-            print(f"导入库失败：{str(e)}")
-            os.remove(video_path)
-            raise HTTPException(status_code=500, detail=f"缺少必要的库：{str(e)}")
-        except Exception as e:
-            print(f"语音识别失败：{str(e)}")
-            os.remove(video_path)
-            raise HTTPException(status_code=500, detail=f"语音识别失败：{str(e)}")
-        
-        # 文本清洗与格式化
-        script = clean_and_format_text(script)
-        print("文本清洗完成")
-        
-        # 内容校验
-        validation = validate_extracted_content(script)
-        print(f"内容校验结果：质量分数={validation['quality_score']:.2f}, 有效={validation['is_valid']}")
-        
-        # 清理临时文件
-        if os.path.exists(video_path):
-            os.remove(video_path)
-        print("临时文件清理完成")
-        
-        # 返回结果
+            yield
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        finally:
+            self._job_calls.reset(token)
+            self._release_after(calls)
+        self.stats["completed"] += 1
+        self.latency.add(time.monotonic() - start)
+
+    def _release_after(self, calls):
+        """Free the job's slot once none of its calls is still in a worker."""
+        running = [call for call in calls if not call.done()]
+        if not running:
+            self._admitted -= 1
+            return
+        loop = asyncio.get_running_loop()
+        remaining = [len(running)]
+
+        def countdown():
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                self._admitted -= 1
+
+        def on_done(_call):
+            try:
+                loop.call_soon_threadsafe(countdown)
+            except RuntimeError:
+                pass  # loop already closed at shutdown
+
+        for call in running:
+            call.add_done_callback(on_done)
+
+    async def run(self, fn, *args, **kwargs):
+        """Run asr_worker `fn(*args, **kwargs)` in the pool and return its result."""
+        return (await self.map(fn, [args], **kwargs))[0]
+
+    async def map(self, fn, arg_lists, **kwargs):
+        """
+        Run asr_worker `fn(*args, **kwargs)` for every args tuple, spread over
+        the workers, and return the results in order. All calls belong to one
+        job, so a segmented transcription is never rejected halfway; if one
+        call fails the rest are cancelled.
+        """
+        async with self.job():
+            executor = self._get_executor()
+            calls = [executor.submit(fn, *args, **kwargs) for args in arg_lists]
+            self._job_calls.get().extend(calls)
+            futures = [asyncio.wrap_future(call) for call in calls]
+            try:
+                results = await asyncio.gather(*futures)
+            except BaseException as e:
+                for future in futures:
+                    future.cancel()
+                if isinstance(e, BrokenProcessPool):
+                    self.stats["restarts"] += 1
+                    self.shutdown()
+                    raise Exception("语音识别进程异常退出") from e
+                raise
+        for result in results:
+            if isinstance(result, dict) and "worker" in result:
+                self._remember_worker(result["worker"])
+        return results
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def snapshot(self) -> dict:
+        p50, p95 = self.latency.percentile(50), self.latency.percentile(95)
         return {
-            "success": True,
-            "message": "文案提取成功",
-            "data": {
-                "script": script,
-                "validation": validation,
-                "video_info": {
-                    "filename": file.filename,
-                    "size": f"{file_size / (1024 * 1024):.2f}MB",
-                    "duration": f"{int(audio_duration // 60)}:{int(audio_duration % 60):02d}"
-                }
+            "default_model": WHISPER_MODEL,
+            "workers": self.workers,
+            "threads_per_worker": self.threads,
+            "queue_size": self.queue_size,
+            "running": min(self._admitted, self.workers),
+            "queued": max(self._admitted - self.workers, 0),
+            "p50_seconds": round(p50, 2) if p50 is not None else None,
+            "p95_seconds": round(p95, 2) if p95 is not None else None,
+            **self.stats,
+            "worker_processes": list(self._worker_snapshots.values()),
+        }
+
+
+asr_pool = AsrPool(
+    workers=ASR_WORKERS,
+    threads=ASR_THREADS_PER_WORKER,
+    queue_size=ASR_QUEUE_SIZE,
+    preload_models=WHISPER_PRELOAD_MODELS,
+)
+
+
+@app.on_event("startup")
+async def start_asr_pool():
+    asr_pool.start()
+
+
+@app.on_event("shutdown")
+async def stop_asr_pool():
+    asr_pool.shutdown()
+
+
+async def _submit_job(kind: str, payload: dict, idempotency_key: str = None):
+    job_id, created = await job_db(job_queue.enqueue, kind, payload, idempotency_key or None)
+    if created:
+        _wake_job_workers()
+    return job_id, created
+
+
+@app.post("/api/extract-batch")
+async def extract_batch(data: dict):
+    """
+    Submit a list of XHS links for extraction. Returns a job ID; poll
+    /api/jobs/{job_id} for progress and fetch /api/jobs/{job_id}/results
+    for JSONL output. Resubmitting with the same idempotency_key returns
+    the original job. With include_note_info, note metadata for every link
+    is prefetched into the note info cache while the items queue.
+    """
+    urls = data.get("urls")
+    if not isinstance(urls, list) or not urls:
+        raise HTTPException(status_code=400, detail="缺少urls参数")
+    if len(urls) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单次最多提交{BATCH_MAX_ITEMS}个链接")
+
+    use_cache = not data.get("no_cache", False)
+    include_note_info = bool(data.get("include_note_info", False))
+    batch_id, created = await job_db(
+        job_queue.enqueue_batch,
+        "extract",
+        [{"url": str(url), "use_cache": use_cache, "include_note_info": include_note_info}
+         for url in urls],
+        idempotency_key=data.get("idempotency_key") or None,
+    )
+    if created:
+        if include_note_info:
+            _spawn(prefetch_note_info(urls))
+        _wake_job_workers()
+
+    return {
+        "success": True,
+        "message": "批量任务已提交" if created else "批量任务已存在",
+        "data": {"job_id": batch_id, "total": len(urls), "created": created},
+    }
+
+
+@app.post("/api/note-info/prefetch")
+async def prefetch_note_info_endpoint(data: dict):
+    """
+    Warm the note info cache for a list of share links or note IDs. Runs
+    in the background unless wait is true, in which case the per-outcome
+    counts are returned.
+    """
+    notes = data.get("notes")
+    if not isinstance(notes, list) or not notes:
+        raise HTTPException(status_code=400, detail="缺少notes参数")
+    if len(notes) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单次最多提交{BATCH_MAX_ITEMS}个笔记")
+
+    if data.get("wait"):
+        return {"success": True, "data": await prefetch_note_info(notes)}
+    _spawn(prefetch_note_info(notes))
+    return {"success": True, "message": "预取任务已提交", "data": {"requested": len(notes)}}
+
+
+@app.post("/api/jobs/rewrite")
+async def submit_rewrite_job(data: dict):
+    """Queue a /api/rewrite-script call as a durable job."""
+    if not data.get("script"):
+        raise HTTPException(status_code=400, detail="缺少script参数")
+    job_id, created = await _submit_job(
+        "rewrite",
+        {"script": data["script"], "video_url": data.get("video_url")},
+        data.get("idempotency_key"),
+    )
+    return {"success": True, "data": {"job_id": job_id, "created": created}}
+
+
+@app.post("/api/jobs/upload-video")
+async def submit_upload_video_job(request: Request):
+    """
+    Queue transcription of an uploaded video as a durable job. Multipart
+    form: `file` (the video) and an optional `idempotency_key`.
+    """
+    upload_dir = os.path.join(CACHE_DIR, "uploads")
+    os.makedirs(upload_dir, exist_ok=True)
+    upload = await receive_video_upload(
+        request, lambda file_ext: os.path.join(upload_dir, f"{uuid.uuid4().hex}{file_ext}")
+    )
+    try:
+        job_id, created = await _submit_job(
+            "transcribe_upload",
+            {"path": upload.path, "filename": upload.filename, "file_size": upload.size,
+             "sha256": upload.sha256},
+            upload.fields.get("idempotency_key") or None,
+        )
+    except BaseException:
+        # The job never took the file over
+        os.remove(upload.path)
+        raise
+    if not created:
+        os.remove(upload.path)
+    return {"success": True, "data": {"job_id": job_id, "created": created}}
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status of a batch (with per-item progress) or of a single job."""
+    job = await job_db(job_queue.get_batch, job_id) or await job_db(job_queue.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return {"success": True, "data": job}
+
+
+@app.get("/api/jobs/{job_id}/results")
+async def get_job_results(job_id: str):
+    """Finished items of a batch job as JSONL, one object per line."""
+    if await job_db(job_queue.get_batch, job_id) is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    def lines():
+        for item in job_queue.iter_batch_results(job_id):
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="batch_{job_id}.jsonl"'},
+    )
+
+async def transcribe_video_file(video_path: str):
+    """
+    在ASR进程池中解码音频并按静音切分，再把各段分发到所有工作进程并行识别
+    The job is admitted before decoding, so a burst of uploads gets
+    AsrBusyError instead of unbounded decodes. The PCM lives in a scratch
+    file the workers share, never in the server process. Returns (script,
+    audio_duration, segments). Raises ValueError for unusable input,
+    AsrBusyError when the ASR queue is full.
+    """
+    async with asr_pool.job():
+        with scratch_space.scope() as scratch:
+            pcm_path = scratch.path("audio", ".f32")
+            decoded = await asr_pool.run(
+                asr_worker.decode_to_pcm_file, video_path, pcm_path,
+                ASR_SEGMENT_SECONDS, ASR_VAD_MIN_SILENCE,
+                ffmpeg_bin=FFMPEG_BIN, ffprobe_bin=FFPROBE_BIN, max_seconds=ASR_MAX_SECONDS,
+                memmap_seconds=ASR_MEMMAP_SECONDS, memmap_dir=scratch_space.root,
+            )
+            scratch_space.commit(pcm_path)
+            _log_spans(decoded["spans"], decoded["audio_duration"])
+            results = await asr_pool.map(
+                asr_worker.transcribe_pcm_span,
+                [(pcm_path, start, end, WHISPER_MODEL) for start, end in decoded["spans"]],
+            )
+    script, segments = _stitch_segments(results)
+    return script, decoded["audio_duration"], segments
+
+def build_transcription_result(script, filename, file_size, audio_duration, file_sha256=None,
+                               segments=None) -> dict:
+    """
+    清洗、校验识别结果并构建 /api/upload-video 的返回内容
+    """
+    # 文本清洗与格式化
+    script = clean_and_format_text(script)
+    print("文本清洗完成")
+    
+    # 内容校验
+    validation = validate_extracted_content(script)
+    print(f"内容校验结果：质量分数={validation['quality_score']:.2f}, 有效={validation['is_valid']}")
+    
+    # 返回结果
+    return {
+        "success": True,
+        "message": "文案提取成功",
+        "data": {
+            "script": script,
+            "segments": segments or [],
+            "validation": validation,
+            "video_info": {
+                "filename": filename,
+                "size": f"{file_size / (1024 * 1024):.2f}MB",
+                "duration": f"{int(audio_duration // 60)}:{int(audio_duration % 60):02d}",
+                "sha256": file_sha256
             }
         }
+    }
+
+def validate_video_upload(filename: str, content_type: str) -> str:
+    """
+    校验上传文件的类型与扩展名，返回小写扩展名
+    """
+    # 验证文件类型
+    if not content_type or not content_type.startswith('video/'):
+        raise HTTPException(status_code=400, detail="仅支持视频文件")
+    
+    # 验证文件扩展名
+    allowed_extensions = ['.mp4', '.mov', '.avi', '.mkv', '.flv', '.wmv']
+    file_ext = os.path.splitext(filename)[1].lower()
+    if file_ext not in allowed_extensions:
+        raise HTTPException(status_code=400, detail=f"不支持的视频格式，仅支持：{', '.join(allowed_extensions)}")
+    return file_ext
+
+def sniff_video_container(head: bytes):
+    """
+    根据文件头魔数识别视频容器格式，无法识别时返回None
+    """
+    if len(head) >= 12 and head[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"wide", b"skip"):
+        return "mp4"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "mkv"
+    if head.startswith(b"RIFF") and head[8:12] == b"AVI ":
+        return "avi"
+    if head.startswith(b"FLV"):
+        return "flv"
+    if head.startswith(b"\x30\x26\xb2\x75\x8e\x66\xcf\x11"):
+        return "wmv"
+    return None
+
+
+class VideoUpload:
+    """The video part of a multipart upload, streamed to disk, and its other form fields."""
+
+    __slots__ = ("path", "filename", "size", "sha256", "fields")
+
+    def __init__(self):
+        self.path = None
+        self.filename = None
+        self.size = 0
+        self.sha256 = None
+        self.fields = {}
+
+
+# Longest plain (non-file) form field accepted alongside the video
+_UPLOAD_FIELD_MAX_BYTES = 64 * 1024
+
+
+async def receive_video_upload(request: Request, allocate_path, field: str = "file") -> VideoUpload:
+    """
+    边接收边解析multipart请求体：视频分块直接写入 allocate_path(扩展名) 返回的路径，
+    不经过框架的临时文件。校验类型与扩展名、首部魔数，按已接收字节即时检查大小上限，
+    并同时计算SHA-256。其他表单字段作为短文本保存在 fields 中。
+    失败时删除已写入的文件。
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="请求必须是multipart/form-data格式")
+
+    upload = VideoUpload()
+    digest = hashlib.sha256()
+    chunk_size = UPLOAD_CHUNK_KB * 1024
+    pending = bytearray()  # video bytes not yet written, at most one chunk
+    head = bytearray()  # first bytes of the video, for the container check
+    out = None
+    part = {}
+
+    def flush():
+        out.write(pending)
+        pending.clear()
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, name=b"", value=b"", kind=None)
+
+    def on_header_field(data, start, end):
+        part["name"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][bytes(part["name"]).lower()] = bytes(part["value"])
+        part["name"], part["value"] = b"", b""
+
+    def on_headers_finished():
+        nonlocal out
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename")
+        if name != field or filename is None:
+            part.update(kind="field", field=name, data=bytearray())
+            return
+        if upload.path is not None:
+            raise HTTPException(status_code=400, detail="一次只能上传一个视频文件")
+        upload.filename = filename.decode("utf-8", "replace")
+        file_ext = validate_video_upload(upload.filename, part["headers"].get(b"content-type", b"").decode("latin-1"))
+        upload.path = allocate_path(file_ext)
+        out = open(upload.path, "wb")
+        part["kind"] = "file"
+
+    def check_head():
+        if sniff_video_container(bytes(head[:16])) is None:
+            raise HTTPException(status_code=400, detail="文件内容不是支持的视频格式")
+
+    def on_part_data(data, start, end):
+        chunk = data[start:end]
+        if part["kind"] == "field":
+            part["data"] += chunk
+            if len(part["data"]) > _UPLOAD_FIELD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail="表单字段过长")
+            return
+        if len(head) < 16:
+            head.extend(chunk[:16 - len(head)])
+            if len(head) == 16:
+                check_head()
+        upload.size += len(chunk)
+        if upload.size > UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"视频文件过大，请上传{UPLOAD_MAX_MB}MB以内的文件")
+        digest.update(chunk)
+        pending.extend(chunk)
+        if len(pending) >= chunk_size:
+            flush()
+
+    def on_part_end():
+        if part["kind"] == "field":
+            upload.fields[part["field"]] = part["data"].decode("utf-8", "replace")
+        elif part["kind"] == "file":
+            if len(head) < 16:
+                check_head()
+            flush()
+            out.close()
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    try:
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+            parser.finalize()
+        except MultipartParseError as e:
+            raise HTTPException(status_code=400, detail=f"上传内容格式错误：{e}")
+        if upload.path is None:
+            raise HTTPException(status_code=400, detail="缺少视频文件")
+        if upload.size < 1000:
+            raise HTTPException(status_code=400, detail="视频文件过小或为空")
+    except BaseException:
+        if out is not None:
+            out.close()
+        if upload.path is not None and os.path.exists(upload.path):
+            os.remove(upload.path)
+        raise
+    upload.sha256 = digest.hexdigest()
+    return upload
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Rejects an upload whose declared Content-Length is already over the
+    limit, before its multipart body is read, and counts the body bytes as
+    they arrive so a chunked body without a length is cut off at the same
+    limit. receive_video_upload applies the exact limit to the video part.
+    """
+
+    # Allowance for multipart boundaries and part headers
+    OVERHEAD_BYTES = 64 * 1024
+
+    def __init__(self, app, paths, max_bytes: int):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        limit = self.max_bytes + self.OVERHEAD_BYTES
+        detail = f"视频文件过大，请上传{UPLOAD_MAX_MB}MB以内的文件"
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def counted_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, counted_receive, send)
+
+
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    paths=["/api/upload-video", "/api/jobs/upload-video"],
+    max_bytes=UPLOAD_MAX_BYTES,
+)
+
+@app.post("/api/upload-video")
+async def upload_video(request: Request):
+    """
+    上传视频文件并提取文案（multipart表单字段 file）
+    """
+    try:
+        print("收到视频文件上传请求")
+        
+        with scratch_space.scope() as scratch:
+            # 边接收边写入磁盘（离开作用域时自动清理），同时检查文件头与大小上限
+            upload = await receive_video_upload(request, lambda file_ext: scratch.path("uploaded_video", file_ext))
+            video_path, file_size, file_sha256 = upload.path, upload.size, upload.sha256
+            scratch_space.commit(video_path)
+            print(f"视频文件 {upload.filename} 已保存到：{video_path}")
+            print(f"视频文件大小：{file_size}字节，SHA-256：{file_sha256}")
+            
+            # 解码音频，按静音切分后并行进行语音识别
+            try:
+                script, audio_duration, segments = await transcribe_video_file(video_path)
+            except ImportError as e:
+                print(f"导入库失败：{str(e)}")
+                raise HTTPException(status_code=500, detail=f"缺少必要的库：{str(e)}")
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            except AsrBusyError as e:
+                raise HTTPException(status_code=503, detail=str(e))
+            except Exception as e:
+                print(f"语音识别失败：{str(e)}")
+                raise HTTPException(status_code=500, detail=f"语音识别失败：{str(e)}")
+        
+        return build_transcription_result(script, upload.filename, file_size, audio_duration, file_sha256, segments)
     except HTTPException:
         raise
     except Exception as e:
@@ -1409,13 +4750,13 @@ async def export_script(data: dict):
         
         if format == "txt":
             # 生成TXT文件
-            file_path = os.path.join(TEMP_DIR, f"script_{datetime.now().timestamp()}.txt")
+            file_path = scratch_space.allocate("script", ".txt", pinned=True)
             with open(file_path, "w", encoding="utf-8") as f:
                 f.write(script)
-            return FileResponse(path=file_path, filename="小红书口播文案.txt", media_type="text/plain")
+            filename, media_type = "小红书口播文案.txt", "text/plain"
         elif format == "json":
             # 生成JSON文件
-            file_path = os.path.join(TEMP_DIR, f"script_{datetime.now().timestamp()}.json")
+            file_path = scratch_space.allocate("script", ".json", pinned=True)
             json_data = {
                 "title": "小红书口播文案",
                 "content": script,
@@ -1424,9 +4765,18 @@ async def export_script(data: dict):
             }
             with open(file_path, "w", encoding="utf-8") as f:
                 json.dump(json_data, f, ensure_ascii=False, indent=2)
-            return FileResponse(path=file_path, filename="小红书口播文案.json", media_type="application/json")
+            filename, media_type = "小红书口播文案.json", "application/json"
         else:
             raise HTTPException(status_code=400, detail="不支持的导出格式")
+        
+        # 文件发送完成后删除
+        scratch_space.commit(file_path)
+        return FileResponse(
+            path=file_path,
+            filename=filename,
+            media_type=media_type,
+            background=BackgroundTask(scratch_space.remove, file_path),
+        )
     except HTTPException:
         raise
     except Exception as e:
@@ -1590,6 +4940,31 @@ def rewrite_script_for_xiaohongshu(original_script):
         print(f"文案改写失败：{str(e)}")
         return original_script
 
+async def run_rewrite(original_script: str, video_url=None) -> dict:
+    """
+    Coze改写 + 清洗 + 校验，返回 /api/rewrite-script 的返回内容
+    """
+    print(f"开始使用Coze API改写文案")
+    rewritten_script = await call_coze_api_rewrite(original_script, video_url)
+    
+    # 文本清洗与格式化
+    rewritten_script = clean_and_format_text(rewritten_script)
+    print("文案清洗完成")
+    
+    # 内容校验
+    validation = validate_extracted_content(rewritten_script)
+    print(f"内容校验结果：质量分数={validation['quality_score']:.2f}, 有效={validation['is_valid']}")
+    
+    return {
+        "success": True,
+        "message": "文案改写成功",
+        "data": {
+            "original_script": original_script,
+            "rewritten_script": rewritten_script,
+            "validation": validation
+        }
+    }
+
 @app.post("/api/rewrite-script")
 async def rewrite_script_endpoint(data: dict):
     """
@@ -1605,26 +4980,9 @@ async def rewrite_script_endpoint(data: dict):
         
         # 使用Coze API改写文案
         try:
-            print(f"开始使用Coze API改写文案")
-            rewritten_script = call_coze_api_rewrite(original_script, video_url)
-            
-            # 文本清洗与格式化
-            rewritten_script = clean_and_format_text(rewritten_script)
-            print("文案清洗完成")
-            
-            # 内容校验
-            validation = validate_extracted_content(rewritten_script)
-            print(f"内容校验结果：质量分数={validation['quality_score']:.2f}, 有效={validation['is_valid']}")
-            
-            return {
-                "success": True,
-                "message": "文案改写成功",
-                "data": {
-                    "original_script": original_script,
-                    "rewritten_script": rewritten_script,
-                    "validation": validation
-                }
-            }
+            return await run_rewrite(original_script, video_url)
+        except UpstreamUnavailableError as e:
+            raise HTTPException(status_code=503, detail=str(e))
         except Exception as e:
             print(f"Coze API调用失败：{str(e)}")
             raise HTTPException(status_code=500, detail=f"改写失败：{str(e)}")
@@ -1639,6 +4997,7 @@ async def upload_reference(data: dict):
     """
     Upload reference blogger transcript for style analysis.
     Supports: XHS video URL (via Coze) or direct text input.
+    Pass "no_cache": true to force a fresh Coze run for the URL.
     """
     try:
         video_url = data.get("video_url")
@@ -1650,15 +5009,14 @@ async def upload_reference(data: dict):
         extracted_script = ""
 
         if video_url:
-            # Validate URL
-            if not video_url.startswith(('http://', 'https://')):
-                raise HTTPException(status_code=400, detail="无效的视频链接")
-            if "xiaohongshu.com" not in video_url and "xhslink.com" not in video_url:
-                raise HTTPException(status_code=400, detail="仅支持小红书视频链接")
+            # Validate and resolve to the canonical note URL
+            video_url = (await normalize_xhs_url(video_url)).canonical_url
 
             # Extract transcript via Coze API
             print(f"[Reference] Extracting transcript via Coze: {video_url}")
-            extracted_script = extract_transcript_via_coze(video_url)
+            extracted_script, _ = await get_transcript(
+                video_url, use_cache=not data.get("no_cache", False)
+            )
             extracted_script = clean_and_format_text(extracted_script)
         elif script_text:
             extracted_script = clean_and_format_text(script_text)
@@ -1676,6 +5034,8 @@ async def upload_reference(data: dict):
         }
     except HTTPException:
         raise
+    except UpstreamUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"上传失败：{str(e)}")
 
@@ -2132,16 +5492,42 @@ async def generate_script_endpoint(data: dict):
 @app.get("/api/check-services")
 async def check_services():
     """Health check for external services."""
-    xhs_ok = check_xhs_downloader_status()
-    coze_ok = bool(COZE_API_TOKEN)
+    coze_health = health_prober.snapshot("coze")
     return {
         "xhs_downloader": {
-            "available": xhs_ok,
             "url": XHS_DOWNLOADER_API,
+            **health_prober.snapshot("xhs_downloader"),
         },
         "coze_api": {
-            "configured": coze_ok,
+            "configured": bool(COZE_API_TOKEN),
             "workflow_id": COZE_WORKFLOW_ID,
+            "reachable": coze_health.pop("available"),
+            **coze_health,
+        },
+        "transcript_cache": transcript_cache.snapshot(),
+        "note_info_cache": {**note_info_cache.snapshot(), "prefetch": dict(note_info_prefetch_stats)},
+        "scratch_space": scratch_space.snapshot(),
+        "video_downloads": dict(download_stats),
+        "cdn_mirrors": cdn_mirrors.snapshot(),
+        "asr_pool": asr_pool.snapshot(),
+        "outbound_http": outbound_http.snapshot(),
+        "transcript_single_flight": transcript_flights.snapshot(),
+        "xhs_link_resolver": xhs_link_resolver.snapshot(),
+        "coze_rate_governor": coze_governor.snapshot(),
+        "circuit_breakers": {name: b.snapshot() for name, b in circuit_breakers.items()},
+        "event_loop_lag": {
+            "samples": len(event_loop_lag),
+            "interval": LOOP_LAG_INTERVAL,
+            "p50": event_loop_lag.percentile(50),
+            "p99": event_loop_lag.percentile(99),
+            "max": event_loop_lag.percentile(100),
+        },
+        "job_queue": {**(await job_db(job_queue.snapshot)), "workers": JOB_WORKERS, "worker_stats": dict(job_worker_stats)},
+        "coze_hedging": {
+            "enabled": COZE_HEDGE_ENABLED,
+            "current_delay": coze_hedge_delay(),
+            "first_event_p95": coze_first_event_latency.percentile(95),
+            **coze_hedge_stats,
         },
     }
 
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+ASR worker processes
+Whisper transcription runs in these processes, which the web server forks at startup
+(app.AsrPool). Keeping the ASR code here keeps whisper, torch and librosa out of the
+server process; the module must not import app.py.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+ASR_SAMPLE_RATE = 16000
+
+
+class AudioDecodeError(Exception):
+    """ffmpeg could not decode the input into audio."""
+
+
+def too_long_error(max_seconds: float) -> ValueError:
+    """视频过长时的错误（提示中的时长与配置的上限一致）"""
+    limit = f"{max_seconds / 60:g}分钟" if max_seconds >= 60 else f"{max_seconds:g}秒"
+    return ValueError(f"视频时长过长，请上传{limit}以内的视频")
+
+
+def ffmpeg_pcm_command(ffmpeg_bin: str, source: str):
+    """ffmpeg reading `source` and writing mono 16 kHz float32 PCM to stdout."""
+    return [
+        ffmpeg_bin, "-hide_banner", "-loglevel", "error",
+        "-i", source,
+        "-vn", "-ac", "1", "-ar", str(ASR_SAMPLE_RATE), "-f", "f32le", "pipe:1",
+    ]
+
+
+def probe_duration(path: str, ffprobe_bin: str = "ffprobe"):
+    """Container duration in seconds from ffprobe, or None if unknown."""
+    import subprocess
+
+    try:
+        output = subprocess.run(
+            [ffprobe_bin, "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", path],
+            capture_output=True, timeout=30, check=True,
+        ).stdout
+        return float(output.strip())
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return None
+
+
+class PcmBuffer:
+    """
+    float32 sample buffer that ffmpeg's stdout is read into directly. Sized
+    up front from the expected duration and doubled if that was too small;
+    with `memmap_dir` it is backed by an unlinked file there instead of
+    anonymous memory, so long recordings do not count against RSS.
+    """
+
+    def __init__(self, capacity: int, memmap_dir: str = None):
+        import numpy as np
+
+        self._np = np
+        self._file = None
+        if memmap_dir:
+            import tempfile
+
+            self._file = tempfile.TemporaryFile(dir=memmap_dir)
+        self.samples = self._allocate(max(capacity, ASR_SAMPLE_RATE))
+        self.filled = 0  # bytes
+
+    def _allocate(self, capacity: int):
+        if self._file is None:
+            return self._np.empty(capacity, dtype=self._np.float32)
+        self._file.truncate(capacity * 4)
+        return self._np.memmap(self._file, dtype=self._np.float32, mode="r+", shape=(capacity,))
+
+    def _grow(self):
+        old = self.samples
+        capacity = len(old) * 2
+        if self._file is None:
+            self.samples = self._allocate(capacity)
+            self.samples[:len(old)] = old
+        else:
+            old.flush()
+            self.samples = self._allocate(capacity)
+
+    def read_from(self, stream, max_seconds: float = None):
+        """
+        readinto() the buffer until EOF. Raises ValueError once clearly more
+        than max_seconds of audio have arrived (the exact check is left to
+        check_duration).
+        """
+        max_samples = None if max_seconds is None else int((max_seconds + 1) * ASR_SAMPLE_RATE)
+        while True:
+            view = memoryview(self.samples.view(self._np.uint8))
+            if self.filled == len(view):
+                view.release()
+                self._grow()
+                continue
+            count = stream.readinto(view[self.filled:])
+            view.release()
+            if not count:
+                break
+            self.filled += count
+            if max_samples is not None and self.filled // 4 > max_samples:
+                raise too_long_error(max_seconds)
+
+    def result(self):
+        """Decoded samples (a plain ndarray view, no copy)."""
+        return self._np.asarray(self.samples[:self.filled // 4])
+
+
+def run_ffmpeg_pcm(command, chunks=None, capacity: int = 60 * ASR_SAMPLE_RATE,
+                   max_seconds: float = None, memmap_dir: str = None):
+    """
+    Run ffmpeg and read its f32le stdout straight into a PcmBuffer. With
+    `chunks`, a writer thread feeds them to stdin while stdout is read, so
+    decoding overlaps with whatever produces the chunks (e.g. a download).
+    """
+    import subprocess
+
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE if chunks is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        bufsize=0,
+    )
+    feed_error = []
+
+    def feed():
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            pass  # ffmpeg stopped reading; its exit status explains why
+        except Exception as e:
+            feed_error.append(e)
+            process.kill()
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    stderr = []
+    threads = [threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)]
+    if chunks is not None:
+        threads.append(threading.Thread(target=feed, daemon=True))
+    for thread in threads:
+        thread.start()
+
+    buffer = PcmBuffer(capacity, memmap_dir)
+    try:
+        buffer.read_from(process.stdout, max_seconds)
+    except ValueError:
+        process.kill()
+        raise
+    finally:
+        process.wait()
+        for thread in threads:
+            thread.join()
+
+    if feed_error:
+        raise feed_error[0]
+    if process.returncode != 0:
+        message = b"".join(stderr).decode("utf-8", "replace").strip()
+        raise AudioDecodeError(message or f"ffmpeg exited with {process.returncode}")
+    return buffer.result()
+
+
+def decode_audio_file(path: str, ffmpeg_bin: str = "ffmpeg", ffprobe_bin: str = "ffprobe",
+                      max_seconds: float = 900, memmap_seconds: float = 600, memmap_dir: str = None):
+    """
+    Mono 16 kHz float32 samples of a media file via ffmpeg. The buffer is
+    preallocated from ffprobe's duration; files of memmap_seconds or more
+    are decoded into a memory-mapped buffer under memmap_dir.
+    """
+    duration = probe_duration(path, ffprobe_bin)
+    capacity = int(((duration or 60) + 1) * ASR_SAMPLE_RATE)
+    use_memmap = memmap_dir is not None and duration is not None and duration >= memmap_seconds
+    return run_ffmpeg_pcm(
+        ffmpeg_pcm_command(ffmpeg_bin, path),
+        capacity=capacity,
+        max_seconds=max_seconds,
+        memmap_dir=memmap_dir if use_memmap else None,
+    )
+
+
+def split_for_transcription(samples, segment_seconds: float, min_silence: float):
+    """Speech spans to transcribe; the whole clip as one span when segment_seconds is 0."""
+    if segment_seconds <= 0:
+        return [(0, len(samples))] if len(samples) else []
+    return find_speech_segments(samples, segment_seconds, min_silence)
+
+
+def find_speech_segments(samples, max_seconds: float = 30, min_silence: float = 0.3, max_gap: float = 2.0,
+                         frame_seconds: float = 0.03, margin_db: float = 12, floor_db: float = -50,
+                         min_speech: float = 0.2, pad_seconds: float = 0.15):
+    """
+    Energy VAD: (start, end) sample ranges of speech, cut at silences and at
+    most max_seconds long, in order. Frames louder than a threshold between
+    the clip's noise floor (10th percentile frame energy) and its speech
+    level (90th percentile) count as speech; pauses shorter than min_silence
+    stay inside a segment. Neighbouring speech is packed into one segment
+    while the gap is under max_gap and the result fits max_seconds, since
+    Whisper pays for a full 30-second window per call; longer silences are
+    left out of every segment. Speech running past max_seconds is cut at
+    its quietest frame in the second half of the window.
+    """
+    import numpy as np
+
+    samples = np.asarray(samples, dtype=np.float32)
+    frame = int(frame_seconds * ASR_SAMPLE_RATE)
+    count = len(samples) // frame
+    if count == 0:
+        return []
+    frames = samples[:count * frame].reshape(count, frame)
+    energy = 10 * np.log10(np.einsum("ij,ij->i", frames, frames) / frame + 1e-12)  # dBFS
+
+    noise, loud = np.percentile(energy, [10, 90])
+    threshold = max(floor_db, min(noise + margin_db, loud - margin_db))
+    speech = np.concatenate(([0], (energy > threshold).astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(speech))
+
+    # Speech runs (in frames), padded, with short pauses bridged
+    regions = []
+    pad, min_run = int(pad_seconds / frame_seconds), int(min_speech / frame_seconds)
+    for start, end in zip(edges[0::2], edges[1::2]):
+        if end - start < min_run:
+            continue
+        start, end = max(0, start - pad), min(count, end + pad)
+        if regions and start - regions[-1][1] < min_silence / frame_seconds:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+
+    # Cut over-long speech, then pack neighbours up to max_seconds
+    max_frames = int(max_seconds / frame_seconds)
+    pieces = []
+    for start, end in regions:
+        while end - start > max_frames:
+            lo = start + max_frames // 2
+            cut = lo + int(np.argmin(energy[lo:start + max_frames]))
+            pieces.append([start, cut])
+            start = cut
+        pieces.append([start, end])
+    segments = []
+    for start, end in pieces:
+        if (segments and end - segments[-1][0] <= max_frames
+                and start - segments[-1][1] <= max_gap / frame_seconds):
+            segments[-1][1] = end
+        else:
+            segments.append([start, end])
+
+    return [(int(start) * frame, len(samples) if end == count else int(end) * frame)
+            for start, end in segments]
+
+
+def _resident_memory_bytes():
+    """Current resident set size of this process, or None if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class AsrModelRegistry:
+    """
+    Whisper models loaded once per process and shared by every job it runs.
+    A model is loaded on first use (or by preload when the worker starts),
+    then warmed up with a one-second silent decode so the first real job
+    does not pay for lazy initialisation. Whisper's decoder keeps per-call
+    state on the model, so inference on one model is serialised by its lock.
+    """
+
+    def __init__(self):
+        self._models = {}  # name -> {"model", "inference_lock", stats...}
+        self._load_locks = {}
+        self._lock = threading.Lock()
+
+    def _load_lock(self, name: str) -> threading.Lock:
+        with self._lock:
+            return self._load_locks.setdefault(name, threading.Lock())
+
+    def get(self, name: str):
+        """Registry entry for `name`, loading and warming the model if needed."""
+        entry = self._models.get(name)
+        if entry is not None:
+            return entry
+        with self._load_lock(name):
+            entry = self._models.get(name)
+            if entry is not None:
+                return entry
+            import whisper
+            import numpy as np
+
+            print(f"[ASR] Loading Whisper model '{name}' (pid {os.getpid()})")
+            rss_before = _resident_memory_bytes()
+            start = time.monotonic()
+            model = whisper.load_model(name)
+            load_seconds = time.monotonic() - start
+
+            start = time.monotonic()
+            model.transcribe(np.zeros(ASR_SAMPLE_RATE, dtype=np.float32), language="zh", fp16=False)
+            warmup_seconds = time.monotonic() - start
+            rss_after = _resident_memory_bytes()
+
+            entry = {
+                "model": model,
+                "inference_lock": threading.Lock(),
+                "loaded_at": datetime.now().isoformat(timespec="seconds"),
+                "load_seconds": round(load_seconds, 2),
+                "warmup_seconds": round(warmup_seconds, 2),
+                "weights_mb": round(sum(p.numel() * p.element_size() for p in model.parameters())
+                                    / 1024 / 1024, 1),
+                "rss_delta_mb": (round((rss_after - rss_before) / 1024 / 1024, 1)
+                                 if rss_before is not None and rss_after is not None else None),
+                "uses": 0,
+            }
+            self._models[name] = entry
+            print(f"[ASR] Model '{name}' ready: load {load_seconds:.2f}s, warmup {warmup_seconds:.2f}s")
+            return entry
+
+    @contextmanager
+    def use(self, name: str):
+        """`with registry.use(name) as model:` holds the model's inference lock."""
+        entry = self.get(name)
+        with entry["inference_lock"]:
+            entry["uses"] += 1
+            yield entry["model"]
+
+    def preload(self, names):
+        for name in names:
+            try:
+                self.get(name)
+            except Exception as e:
+                print(f"[ASR] Preloading Whisper model '{name}' failed: {e}")
+
+    def snapshot(self) -> dict:
+        rss = _resident_memory_bytes()
+        return {
+            "pid": os.getpid(),
+            "rss_mb": round(rss / 1024 / 1024, 1) if rss is not None else None,
+            "models": {
+                name: {key: value for key, value in entry.items()
+                       if key not in ("model", "inference_lock")}
+                for name, entry in self._models.items()
+            },
+        }
+
+
+registry = AsrModelRegistry()
+
+
+def init_worker(threads: int, preload_models):
+    """
+    Pool initializer: cap the numeric libraries at `threads` threads (before
+    they are imported), then load and warm the configured models.
+    """
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    registry.preload(preload_models)
+
+
+def ping() -> dict:
+    """Lets the server start workers (and their preload) ahead of the first job."""
+    return registry.snapshot()
+
+
+def check_duration(audio_duration: float, max_seconds: float = 900):
+    """检查音频时长，不可用时抛出ValueError"""
+    if audio_duration < 1:
+        raise ValueError("视频时长过短，请上传至少1秒的视频")
+
+    if audio_duration > max_seconds:  # 默认15分钟
+        raise too_long_error(max_seconds)
+
+
+def _timed_segments(result: dict, offset: float = 0.0):
+    """Whisper's segments as {"start", "end", "text"}, shifted by `offset` seconds."""
+    return [
+        {"start": round(seg["start"] + offset, 2), "end": round(seg["end"] + offset, 2),
+         "text": seg["text"].strip()}
+        for seg in result.get("segments", [])
+    ]
+
+
+def transcribe_segment(samples, offset: float, model_name: str) -> dict:
+    """
+    Whisper one VAD segment (see find_speech_segments) starting `offset`
+    seconds into the recording. Returns {"text", "segments", "worker"} with
+    timestamps on the whole recording; "text" is left unstripped so the
+    caller can join segments the way Whisper joins its own.
+    """
+    import numpy as np
+
+    with registry.use(model_name) as model:
+        result = model.transcribe(np.asarray(samples, dtype=np.float32), language="zh", fp16=False)
+    return {"text": result["text"], "segments": _timed_segments(result, offset),
+            "worker": registry.snapshot()}
+
+
+def load_audio_librosa(video_path: str):
+    """使用librosa提取音频（未安装ffmpeg时的备用路径）"""
+    import librosa
+
+    y, _ = librosa.load(video_path, sr=ASR_SAMPLE_RATE, mono=True)
+    return y
+
+
+def decode_to_pcm_file(video_path: str, pcm_path: str, segment_seconds: float, min_silence: float,
+                       **decode_options) -> dict:
+    """
+    使用ffmpeg（未安装时用librosa）解码音频，写入pcm_path并按静音切分
+    decode_options go to decode_audio_file; max_seconds also bounds the
+    duration check. pcm_path receives raw float32 samples that
+    transcribe_pcm_span reads on any worker, so the audio never passes
+    through the server process. Returns {"audio_duration", "spans",
+    "worker"}. Raises ValueError for unusable input.
+    """
+    import numpy as np
+
+    print(f"开始处理视频文件：{video_path}")
+    try:
+        samples = decode_audio_file(video_path, **decode_options)
+    except FileNotFoundError:
+        print("未找到ffmpeg，使用librosa提取音频")
+        samples = load_audio_librosa(video_path)
+
+    audio_duration = len(samples) / ASR_SAMPLE_RATE
+    print(f"音频加载完成，采样率：{ASR_SAMPLE_RATE}Hz，音频长度：{audio_duration:.2f}秒")
+    check_duration(audio_duration, decode_options.get("max_seconds", 900))
+    np.asarray(samples, dtype=np.float32).tofile(pcm_path)
+    return {
+        "audio_duration": audio_duration,
+        "spans": split_for_transcription(samples, segment_seconds, min_silence),
+        "worker": registry.snapshot(),
+    }
+
+
+def transcribe_pcm_span(pcm_path: str, start: int, end: int, model_name: str) -> dict:
+    """transcribe_segment for samples [start, end) of a decode_to_pcm_file output."""
+    import numpy as np
+
+    samples = np.memmap(pcm_path, dtype=np.float32, mode="r")[start:end]
+    return transcribe_segment(samples, start / ASR_SAMPLE_RATE, model_name)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+音频解码基准测试
+对比 librosa.load 与 ffmpeg 管道解码（预分配缓冲区 / 内存映射缓冲区）的耗时与峰值内存。
+每种方式在独立子进程中运行，峰值内存取子进程的 ru_maxrss
+
+用法:
+    python bench_audio_decode.py                          # 用ffmpeg生成10分钟测试视频
+    python bench_audio_decode.py --seconds 900 --repeat 3
+    python bench_audio_decode.py --input video.mp4 --methods ffmpeg ffmpeg-memmap
+"""
+
+import sys
+import os
+import json
+import argparse
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+METHODS = ["librosa", "ffmpeg", "ffmpeg-memmap"]
+
+
+def decode_once(method: str, path: str, ffmpeg_bin: str, ffprobe_bin: str, scratch: str):
+    """子进程内执行：解码一次并输出 JSON（耗时、样本数、峰值RSS）"""
+    import time
+    import resource
+
+    sys.path.insert(0, HERE)
+    import asr_worker
+
+    start = time.perf_counter()
+    if method == "librosa":
+        samples = asr_worker.load_audio_librosa(path)
+    else:
+        samples = asr_worker.decode_audio_file(
+            path, ffmpeg_bin=ffmpeg_bin, ffprobe_bin=ffprobe_bin, max_seconds=24 * 3600,
+            memmap_seconds=0 if method == "ffmpeg-memmap" else float("inf"), memmap_dir=scratch,
+        )
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "seconds": elapsed,
+        "samples": len(samples),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def generate_video(path: str, seconds: float, ffmpeg_bin: str):
+    """用ffmpeg的lavfi生成带音轨的测试视频"""
+    subprocess.run([
+        ffmpeg_bin, "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc=size=320x240:rate=15:duration={seconds}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={seconds}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-shortest", path,
+    ], check=True)
+
+
+def bench(method: str, path: str, args, scratch: str):
+    runs = []
+    for _ in range(args.repeat):
+        proc = subprocess.run(
+            [sys.executable, __file__, "--child", method, "--input", path,
+             "--ffmpeg", args.ffmpeg, "--ffprobe", args.ffprobe],
+            capture_output=True, text=True, cwd=scratch,
+        )
+        if proc.returncode != 0:
+            last = (proc.stderr.strip().splitlines() or ["?"])[-1]
+            print(f"{method:<16} 失败: {last}")
+            return
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    best = min(r["seconds"] for r in runs)
+    peak = max(r["peak_rss_mb"] for r in runs)
+    audio = runs[0]["samples"] / 16000
+    print(f"{method:<16} {best:>8.2f}s  {audio / best:>8.0f}x 实时  峰值RSS {peak:>8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audio decode benchmark")
+    parser.add_argument("--input", help="待解码的视频文件（默认用ffmpeg生成）")
+    parser.add_argument("--seconds", type=float, default=600, help="生成测试视频的时长（秒）")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=METHODS)
+    parser.add_argument("--ffmpeg", default="ffmpeg")
+    parser.add_argument("--ffprobe", default="ffprobe")
+    parser.add_argument("--child", choices=METHODS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        decode_once(args.child, args.input, args.ffmpeg, args.ffprobe, os.getcwd())
+        return
+
+    with tempfile.TemporaryDirectory() as scratch:
+        path = args.input
+        if not path:
+            path = os.path.join(scratch, "bench.mp4")
+            generate_video(path, args.seconds, args.ffmpeg)
+        path = os.path.abspath(path)
+
+        print("="*60)
+        print(f"输入: {path} ({os.path.getsize(path) / 1e6:.1f} MB), 重复: {args.repeat}")
+        print("="*60)
+        for method in args.methods:
+            bench(method, path, args, scratch)
+
+
+if __name__ == "__main__":
+    main()
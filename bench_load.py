@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+并发压测
+以N个并发客户端驱动 /api/extract-from-url、/api/upload-reference、/api/rewrite-script，
+报告吞吐量、p50/p95/p99延迟以及服务端事件循环延迟
+
+用法:
+    python bench_load.py --spawn                                # 自动启动 mock_services.py 与后端
+    python bench_load.py --spawn --rate-429 0.05 --rate-500 0.02
+    python bench_load.py --base-url http://127.0.0.1:8000       # 压测已在运行的后端
+"""
+
+import sys
+import os
+import time
+import uuid
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPT = (
+    "姐妹们今天给大家分享一个超级实用的育儿好物，真的绝了！"
+    "这个东西我已经用了三个月，每天都离不开它。价格也很友好，学生党也完全可以入手。"
+)
+
+
+def note_url(unique: bool) -> str:
+    note_id = uuid.uuid4().hex[:24] if unique else f"{random.randrange(50):024x}"
+    return f"https://www.xiaohongshu.com/explore/{note_id}"
+
+
+def build_request(endpoint: str, args):
+    """Return (path, json body) for one request against `endpoint`."""
+    if endpoint == "extract":
+        return "/api/extract-from-url", {"url": note_url(args.unique_notes), "no_cache": args.no_cache}
+    if endpoint == "reference":
+        return "/api/upload-reference", {"video_url": note_url(args.unique_notes), "no_cache": args.no_cache}
+    if endpoint == "rewrite":
+        return "/api/rewrite-script", {"script": SCRIPT}
+    raise ValueError(f"unknown endpoint: {endpoint}")
+
+
+def percentile(ordered, pct):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def fmt_ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.0f}ms"
+
+
+async def run_load(args) -> dict:
+    endpoints = args.endpoints.split(",")
+    queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(endpoints[i % len(endpoints)])
+
+    results = {endpoint: {"latencies": [], "statuses": Counter()} for endpoint in endpoints}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        async def worker():
+            while not queue.empty():
+                endpoint = queue.get_nowait()
+                path, body = build_request(endpoint, args)
+                start = time.perf_counter()
+                try:
+                    resp = await client.post(path, json=body)
+                    status = resp.status_code
+                except httpx.TimeoutException:
+                    status = "timeout"
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                results[endpoint]["latencies"].append(time.perf_counter() - start)
+                results[endpoint]["statuses"][status] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+        services = (await client.get("/api/check-services", timeout=30)).json()
+
+    return {"elapsed": elapsed, "results": results, "services": services}
+
+
+def report(run: dict, args):
+    print("\n" + "=" * 78)
+    print(f"并发: {args.concurrency}  请求数: {args.requests}  耗时: {run['elapsed']:.2f}s  "
+          f"总吞吐: {args.requests / run['elapsed']:.1f} req/s")
+    print("=" * 78)
+    print(f"{'endpoint':<12}{'count':>7}{'ok':>7}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}  statuses")
+    for endpoint, data in run["results"].items():
+        ordered = sorted(data["latencies"])
+        ok = data["statuses"].get(200, 0)
+        statuses = ", ".join(f"{k}={v}" for k, v in sorted(data["statuses"].items(), key=str))
+        print(f"{endpoint:<12}{len(ordered):>7}{ok:>7}{len(ordered) / run['elapsed']:>9.1f}"
+              f"{fmt_ms(percentile(ordered, 50)):>9}{fmt_ms(percentile(ordered, 95)):>9}"
+              f"{fmt_ms(percentile(ordered, 99)):>9}  {statuses}")
+
+    lag = run["services"].get("event_loop_lag", {})
+    print(f"\n事件循环延迟 (最近{lag.get('samples', 0)}个采样): "
+          f"p50={fmt_ms(lag.get('p50'))} p99={fmt_ms(lag.get('p99'))} max={fmt_ms(lag.get('max'))}")
+    governor = run["services"].get("coze_rate_governor")
+    if governor:
+        print(f"Coze限流器: {governor}")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def spawn_stack(args):
+    """Start mock_services.py and the backend on free ports; returns the processes."""
+    mock_port, app_port = free_port(), free_port()
+    mock = subprocess.Popen([
+        sys.executable, os.path.join(HERE, "mock_services.py"), "--port", str(mock_port),
+        "--latency", str(args.latency), "--jitter", str(args.jitter),
+        "--chunks", str(args.chunks), "--chunk-delay", str(args.chunk_delay),
+        "--rate-429", str(args.rate_429), "--rate-500", str(args.rate_500),
+    ])
+    env = dict(
+        os.environ,
+        COZE_API_URL=f"http://127.0.0.1:{mock_port}/v1/workflow/stream_run",
+        COZE_API_TOKEN="mock",
+        XHS_DOWNLOADER_API=f"http://127.0.0.1:{mock_port}",
+        XHS_CACHE_DIR=tempfile.mkdtemp(prefix="xhs-bench-"),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(app_port), "--log-level", "warning"],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL if not args.verbose else None,
+    )
+    wait_until_up(f"http://127.0.0.1:{mock_port}/stats")
+    wait_until_up(f"http://127.0.0.1:{app_port}/")
+    args.base_url = f"http://127.0.0.1:{app_port}"
+    return [server, mock]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="后端并发压测")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=32, help="并发客户端数")
+    parser.add_argument("--requests", type=int, default=300, help="总请求数（按endpoint轮流分配）")
+    parser.add_argument("--endpoints", default="extract,reference,rewrite")
+    parser.add_argument("--timeout", type=float, default=180)
+    parser.add_argument("--no-cache", action="store_true", help="提取请求跳过转写缓存")
+    parser.add_argument("--unique-notes", action="store_true", help="每个请求使用不同的笔记ID（默认在50个笔记中随机）")
+    parser.add_argument("--spawn", action="store_true", help="自动启动 mock_services.py 与后端")
+    parser.add_argument("--verbose", action="store_true", help="--spawn时显示后端日志")
+    # 以下参数仅在 --spawn 时传给 mock_services.py
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--chunks", type=int, default=10)
+    parser.add_argument("--chunk-delay", type=float, default=0.05)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-500", type=float, default=0.0)
+    args = parser.parse_args()
+
+    processes = spawn_stack(args) if args.spawn else []
+    try:
+        report(asyncio.run(run_load(args)), args)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(timeout=10)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
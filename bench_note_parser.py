@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+笔记页面视频地址提取基准测试
+对比旧的正则级联（6个DOTALL JSON模式 + 12个模式 + 全链接扫描）与
+单次预编译提取器 extract_video_url_from_page，报告 pages/s、MB/s 与结果一致性
+
+用法:
+    python bench_note_parser.py                          # 合成页面（含一个回溯压力页面）
+    python bench_note_parser.py --corpus /tmp/xhs-scratch  # 使用保存的页面（SCRATCH_DEBUG_CAPTURE=true 时的 xiaohongshu_debug_*.html）
+"""
+
+import sys
+import os
+import re
+import json
+import glob
+import time
+import random
+import argparse
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import extract_video_url_from_page
+
+
+def legacy_extract(page: str):
+    """旧实现的提取步骤1-3（去掉逐条print，仅保留正则与解析开销）"""
+    json_patterns = [
+        r'window\.__INITIAL_STATE__\s*=\s*({.*?});',
+        r'window\.__data__\s*=\s*({.*?});',
+        r'window\.__page__\s*=\s*({.*?});',
+        r'window\.__NEXT_DATA__\s*=\s*({.*?});',
+        r'{"note":.*?}',
+        r'{"video":.*?}'
+    ]
+
+    def find_video_url(data):
+        if isinstance(data, dict):
+            for key, value in data.items():
+                if key in ['video', 'videoUrl', 'video_url', 'main_url', 'play_url', 'url']:
+                    if isinstance(value, str) and value.startswith('https://'):
+                        return value
+                elif isinstance(value, (dict, list)):
+                    result = find_video_url(value)
+                    if result:
+                        return result
+        elif isinstance(data, list):
+            for item in data:
+                result = find_video_url(item)
+                if result:
+                    return result
+        return None
+
+    for json_pattern in json_patterns:
+        json_matches = re.findall(json_pattern, page, re.DOTALL)
+        if json_matches:
+            try:
+                video_url = find_video_url(json.loads(json_matches[0]))
+                if video_url:
+                    return video_url
+            except json.JSONDecodeError:
+                pass
+
+    patterns = [
+        r'"video":\s*{"play_addr":\s*{"url_list":\s*\["([^"]+)"',
+        r'"video":\s*{"url":\s*"([^"]+)"',
+        r'"videoUrl":\s*"([^"]+)"',
+        r'"video_url":\s*"([^"]+)"',
+        r'https://[^\s"]+\.mp4',
+        r'"main_url":\s*"([^"]+)"',
+        r'"play_url":\s*"([^"]+)"',
+        r'video[^}]*"url"\s*:\s*"([^"]+)"',
+        r'https://[^\s"]*video[^\s"]*',
+        r'https://[^\s"]*xhsvideo[^\s"]*',
+        r'https://[^\s"]+\?.*?video[^\s"]*',
+        r'https://[a-zA-Z0-9\-\.]+\.[a-zA-Z]{2,}/[a-zA-Z0-9\-\._~:/?#[\\\]@!\$&\'\(\)\*\+,;=.]+video[a-zA-Z0-9\-\._~:/?#[\\\]@!\$&\'\(\)\*\+,;=.]+'
+    ]
+    non_video_extensions = ['.ico', '.png', '.jpg', '.jpeg', '.gif', '.css', '.js', '.json', '.svg', '.txt', '.html']
+    candidates = []
+    for pattern in patterns:
+        candidates.extend(re.findall(pattern, page))
+    for url in candidates:
+        lowered = url.lower()
+        if not any(ext in lowered for ext in non_video_extensions) and \
+                not any(k in lowered for k in ['icon', 'logo', 'image', 'css', 'js', 'json']):
+            return url
+
+    all_links = re.findall(r'https://[^\s"]+', page)
+    video_keywords = ['video', 'mp4', 'xhsvideo', 'play', 'main', 'source', 'media']
+    for link in all_links:
+        lowered = link.lower()
+        if any(ext in lowered for ext in non_video_extensions):
+            continue
+        if 'icon' in lowered or 'logo' in lowered or 'image' in lowered:
+            continue
+        if any(keyword in lowered for keyword in video_keywords):
+            return link
+    return None
+
+
+def synthesize_page(note_id: str, feed_items: int) -> str:
+    """生成与小红书笔记页结构一致的页面：大量资源链接 + __INITIAL_STATE__（含undefined与\\u002F转义）"""
+    rng = random.Random(note_id)
+    head = "".join(
+        f'<link rel="stylesheet" href="https://fe-static.xhscdn.com/formula-static/css/{i}.css">'
+        f'<script src="https://fe-static.xhscdn.com/formula-static/js/{i}.js"></script>'
+        for i in range(40)
+    )
+    feed = [
+        {
+            "id": f"{rng.getrandbits(96):024x}",
+            "noteCard": {
+                "displayTitle": "姐妹们今天给大家分享一个超级实用的育儿好物",
+                "cover": {"urlDefault": f"http://sns-webpic-qc.xhscdn.com/{i}/image/cover.jpg"},
+                "user": {"nickname": "博主", "avatar": f"https://sns-avatar-qc.xhscdn.com/avatar/{i}.jpg"},
+                "interactInfo": {"likedCount": str(rng.randrange(10000))},
+            },
+        }
+        for i in range(feed_items)
+    ]
+    note = {
+        "noteId": note_id,
+        "title": "超实用育儿好物分享",
+        "desc": "今天给大家分享 #育儿好物 {}".format("真的绝了" * 20),
+        "imageList": [{"urlDefault": f"http://sns-webpic-qc.xhscdn.com/{note_id}/{i}.jpg"} for i in range(3)],
+        "video": {
+            "media": {"stream": {"h264": [{
+                "masterUrl": f"http://sns-video-bd.xhscdn.com/stream/110/259/{note_id}_259.mp4",
+                "backupUrls": [f"http://sns-video-hw.xhscdn.com/stream/110/259/{note_id}_259.mp4"],
+            }], "h265": []}},
+            "consumer": {"originVideoKey": f"pre_post/{note_id}"},
+        },
+    }
+    state = {
+        "global": {"appSettings": {"notificationInterval": 30}},
+        "user": {"userInfo": {}, "loggedIn": False},
+        "feed": {"feeds": feed},
+        "note": {"noteDetailMap": {note_id: {"comments": {"list": []}, "note": note}}},
+    }
+    blob = json.dumps(state, ensure_ascii=False).replace("/", "\\u002F")
+    blob = blob.replace('"loggedIn": false', '"loggedIn": undefined')
+    return (
+        f"<!DOCTYPE html><html><head>{head}</head><body><div id=\"app\"></div>"
+        f"<script>window.__INITIAL_STATE__={blob}</script></body></html>"
+    )
+
+
+def adversarial_page(size_kb: int) -> str:
+    """一段不含空白和video关键词、由大量https://拼接成的长文本：旧的模式9/11/12在每个起点都扫到末尾再回溯"""
+    token = "https://cdn.example.com/a?" * (size_kb * 1024 // 26)
+    return f"<html><body><p>{token}</p>{{\"note\": {{ \"title\": \"t\" </body></html>"
+
+
+def load_corpus(args):
+    if args.corpus:
+        pages = []
+        for path in sorted(glob.glob(os.path.join(args.corpus, "*.html"))):
+            with open(path, encoding="utf-8", errors="replace") as f:
+                pages.append((os.path.basename(path), f.read()))
+        return pages
+    pages = [(f"synthetic_{i}", synthesize_page(f"{i:024x}", args.feed_items)) for i in range(args.pages)]
+    if args.adversarial_kb:
+        pages.append((f"adversarial_{args.adversarial_kb}kb", adversarial_page(args.adversarial_kb)))
+    return pages
+
+
+def bench(fn, pages, repeat):
+    per_page = {}
+    results = {}
+    for name, page in pages:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            results[name] = fn(page)
+        per_page[name] = (time.perf_counter() - start) / repeat
+    return per_page, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="笔记页面视频地址提取基准测试")
+    parser.add_argument("--corpus", help="保存的笔记页面目录（*.html）")
+    parser.add_argument("--pages", type=int, default=10, help="合成页面数量")
+    parser.add_argument("--feed-items", type=int, default=400, help="每个合成页面的feed条目数（控制页面大小）")
+    parser.add_argument("--adversarial-kb", type=int, default=4, help="回溯压力页面大小（KB），0为不生成")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = load_corpus(args)
+    if not pages:
+        print("语料为空")
+        return 1
+    total_mb = sum(len(page.encode("utf-8")) for _, page in pages) / 1024 / 1024
+    print(f"页面数: {len(pages)}  总大小: {total_mb:.2f}MB  重复: {args.repeat}")
+
+    legacy_times, legacy_results = bench(legacy_extract, pages, args.repeat)
+    new_times, new_results = bench(extract_video_url_from_page, pages, args.repeat)
+
+    print("\n" + "=" * 96)
+    print(f"{'page':<28}{'KB':>8}{'legacy':>11}{'new':>11}{'speedup':>9}  new result")
+    print("=" * 96)
+    for name, page in pages:
+        speedup = legacy_times[name] / new_times[name] if new_times[name] else float("inf")
+        print(f"{name[:27]:<28}{len(page.encode('utf-8')) / 1024:>8.0f}"
+              f"{legacy_times[name] * 1000:>9.2f}ms{new_times[name] * 1000:>9.2f}ms{speedup:>8.1f}x  "
+              f"{(new_results[name] or '-')[:60]}")
+
+    legacy_total = sum(legacy_times.values())
+    new_total = sum(new_times.values())
+    found_legacy = sum(1 for v in legacy_results.values() if v)
+    found_new = sum(1 for v in new_results.values() if v)
+    print("\n" + "=" * 96)
+    print(f"旧实现: {len(pages) / legacy_total:>8.1f} pages/s {total_mb / legacy_total:>8.2f} MB/s  找到视频地址 {found_legacy}/{len(pages)}")
+    print(f"新实现: {len(pages) / new_total:>8.1f} pages/s {total_mb / new_total:>8.2f} MB/s  找到视频地址 {found_new}/{len(pages)}")
+    print(f"整体加速: {legacy_total / new_total:.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
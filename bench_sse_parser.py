@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Coze SSE 解析器基准测试
+对录制的（或合成的）多MB Coze流式响应测量 events/s
+
+用法:
+    python bench_sse_parser.py                       # 合成约8MB的流
+    python bench_sse_parser.py --recording coze.sse  # 使用录制的流 (curl -N ... > coze.sse)
+"""
+
+import sys
+import os
+import io
+import json
+import time
+import asyncio
+import argparse
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import SSEDecoder, iter_coze_events
+
+
+def synthesize_stream(target_bytes: int) -> bytes:
+    """生成与Coze stream_run格式一致的流：大量Message增量 + 最终Done"""
+    sentence = "姐妹们今天给大家分享一个超级实用的育儿好物，真的绝了！"
+    parts = []
+    size = 0
+    i = 0
+    while size < target_bytes:
+        payload = json.dumps({
+            "content": sentence,
+            "content_type": "text",
+            "node_is_finish": False,
+            "node_seq_id": str(i),
+            "node_title": "End",
+        }, ensure_ascii=False)
+        block = f"id: {i}\nevent: Message\ndata: {payload}\n\n".encode("utf-8")
+        parts.append(block)
+        size += len(block)
+        i += 1
+    parts.append(f"id: {i}\nevent: Done\ndata: {{\"debug_url\": \"\"}}\n\n".encode("utf-8"))
+    return b"".join(parts)
+
+
+def chunked(body: bytes, chunk_size: int):
+    return [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+
+def legacy_line_parser(chunks, log=None):
+    """旧实现的逐行解析（按 iter_lines 语义拼行）；log 不为空时模拟逐行print与json.dumps"""
+    count = 0
+    pending = b""
+    current_event = None
+    for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            line_str = line.decode("utf-8").strip()
+            if log is not None:
+                print(f"收到响应行：{line_str[:200]}", file=log)
+            if not line_str or line_str.startswith("id:"):
+                continue
+            if line_str.startswith("event:"):
+                current_event = line_str[6:].strip()
+            elif line_str.startswith("data:"):
+                try:
+                    data = json.loads(line_str[5:].strip())
+                    if log is not None:
+                        print(f"解析后的数据：{json.dumps(data, ensure_ascii=False)[:200]}", file=log)
+                    count += 1
+                except json.JSONDecodeError:
+                    continue
+    return count
+
+
+def decoder_only(chunks):
+    decoder = SSEDecoder()
+    count = 0
+    for chunk in chunks:
+        count += len(decoder.feed(chunk))
+    return count + len(decoder.flush())
+
+
+class _Response:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def aiter_bytes(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def decoder_with_json(chunks):
+    async def run():
+        count = 0
+        async for _ in iter_coze_events(_Response(chunks)):
+            count += 1
+        return count
+    return asyncio.run(run())
+
+
+def bench(name, fn, chunks, total_bytes, repeat):
+    best = float("inf")
+    events = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        events = fn(chunks)
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<28} {events:>8} events  {events / best:>12,.0f} events/s  "
+          f"{total_bytes / best / 1e6:>8.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coze SSE parser benchmark")
+    parser.add_argument("--recording", help="录制的Coze SSE流文件")
+    parser.add_argument("--size-mb", type=float, default=8.0, help="合成流大小（MB）")
+    parser.add_argument("--chunk-size", type=int, default=4096, help="网络块大小（字节）")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.recording:
+        with open(args.recording, "rb") as f:
+            body = f.read()
+    else:
+        body = synthesize_stream(int(args.size_mb * 1024 * 1024))
+
+    chunks = chunked(body, args.chunk_size)
+    print("="*60)
+    print(f"流大小: {len(body) / 1e6:.2f} MB, 块大小: {args.chunk_size} 字节, 块数: {len(chunks)}")
+    print("="*60)
+
+    bench("legacy + per-line logging", lambda c: legacy_line_parser(c, io.StringIO()),
+          chunks, len(body), args.repeat)
+    bench("legacy line parser + json", legacy_line_parser, chunks, len(body), args.repeat)
+    bench("SSEDecoder", decoder_only, chunks, len(body), args.repeat)
+    bench("SSEDecoder + json (app)", decoder_with_json, chunks, len(body), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Coze / XHS-Downloader 本地替身服务
+模拟 Coze stream_run 的SSE协议与 XHS-Downloader 的POST接口，
+可配置延迟、抖动、分块数量以及429/500错误注入，用于离线测试与压测
+
+用法:
+    python mock_services.py --port 18080 --latency 1.5 --jitter 0.5 --chunks 20 --rate-429 0.05
+
+然后以如下环境变量启动后端:
+    COZE_API_URL=http://127.0.0.1:18080/v1/workflow/stream_run
+    XHS_DOWNLOADER_API=http://127.0.0.1:18080
+    COZE_API_TOKEN=mock
+"""
+
+import re
+import json
+import random
+import asyncio
+import hashlib
+import argparse
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+SENTENCES = [
+    "姐妹们今天给大家分享一个超级实用的育儿好物，真的绝了！",
+    "这个东西我已经用了三个月，每天都离不开它。",
+    "首先它的材质很安全，宝宝咬了也不用担心。",
+    "其次收纳特别方便，出门放包里一点都不占地方。",
+    "价格也很友好，学生党也完全可以入手。",
+    "最后提醒一下，购买的时候一定要认准官方店铺哦。",
+    "喜欢的话记得点赞收藏，我们下期再见！",
+]
+
+_NOTE_ID_PATTERN = re.compile(r'/(?:explore|discovery/item|item)/([0-9a-zA-Z]+)')
+
+config = argparse.Namespace(
+    latency=0.5, jitter=0.2, chunks=10, chunk_delay=0.05,
+    rate_429=0.0, rate_500=0.0, transcript_sentences=6, xhs_latency=0.2,
+)
+stats = {"coze_calls": 0, "xhs_calls": 0, "injected_429": 0, "injected_500": 0}
+
+app = FastAPI(title="Coze / XHS-Downloader mock")
+
+
+def _delay(mean: float) -> float:
+    return max(0.0, random.uniform(mean - config.jitter, mean + config.jitter))
+
+
+def _injected_error():
+    """Randomly return a 429 or 500 response according to the configured rates."""
+    roll = random.random()
+    if roll < config.rate_429:
+        stats["injected_429"] += 1
+        return JSONResponse({"code": 4013, "msg": "rate limited"}, status_code=429,
+                            headers={"Retry-After": "1"})
+    if roll < config.rate_429 + config.rate_500:
+        stats["injected_500"] += 1
+        return JSONResponse({"code": 5000, "msg": "internal error"}, status_code=500)
+    return None
+
+
+def _transcript_for(text: str) -> str:
+    """Deterministic transcript per input so repeated calls agree."""
+    seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+    rng = random.Random(seed)
+    return "".join(rng.choice(SENTENCES) for _ in range(config.transcript_sentences))
+
+
+def _sse(event_id: int, event: str, data: dict) -> bytes:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+@app.post("/v1/workflow/stream_run")
+async def coze_stream_run(request: Request):
+    stats["coze_calls"] += 1
+    if not request.headers.get("authorization", "").startswith("Bearer "):
+        return JSONResponse({"code": 4100, "msg": "missing token"}, status_code=401)
+    body = await request.json()
+    error = _injected_error()
+    if error is not None:
+        await asyncio.sleep(_delay(config.latency) / 4)
+        return error
+
+    transcript = _transcript_for(json.dumps(body.get("parameters", {}), sort_keys=True))
+    step = max(1, -(-len(transcript) // max(config.chunks, 1)))
+    deltas = [transcript[i:i + step] for i in range(0, len(transcript), step)]
+
+    async def events():
+        await asyncio.sleep(_delay(config.latency))
+        event_id = 0
+        for delta in deltas:
+            yield _sse(event_id, "Message", {
+                "content": delta, "content_type": "text",
+                "node_is_finish": False, "node_seq_id": str(event_id), "node_title": "End",
+            })
+            event_id += 1
+            if config.chunk_delay:
+                await asyncio.sleep(config.chunk_delay)
+        yield _sse(event_id, "Message", {
+            "content": json.dumps({"output": transcript}, ensure_ascii=False),
+            "content_type": "text", "node_is_finish": True,
+            "node_seq_id": str(event_id), "node_title": "End",
+        })
+        yield _sse(event_id + 1, "Done", {"debug_url": ""})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/")
+async def xhs_downloader(request: Request):
+    stats["xhs_calls"] += 1
+    body = await request.json()
+    error = _injected_error()
+    await asyncio.sleep(_delay(config.xhs_latency))
+    if error is not None:
+        return error
+
+    url = body.get("url", "")
+    match = _NOTE_ID_PATTERN.search(url)
+    note_id = match.group(1) if match else hashlib.md5(url.encode("utf-8")).hexdigest()[:24]
+    return {
+        "message": "获取小红书作品数据成功",
+        "params": body,
+        "data": {
+            "作品ID": note_id,
+            "作品链接": f"https://www.xiaohongshu.com/explore/{note_id}",
+            "作品标题": "本地替身测试笔记",
+            "作品描述": SENTENCES[0],
+            "作品类型": "视频",
+            "作者昵称": "mock",
+            "下载地址": [f"http://127.0.0.1/mock/{note_id}.mp4"],
+        },
+    }
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coze / XHS-Downloader 本地替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency", type=float, default=config.latency, help="Coze首个事件前的平均延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=config.jitter, help="延迟的均匀抖动幅度（秒）")
+    parser.add_argument("--chunks", type=int, default=config.chunks, help="每次响应的Message增量事件数")
+    parser.add_argument("--chunk-delay", type=float, default=config.chunk_delay, help="增量事件之间的间隔（秒）")
+    parser.add_argument("--rate-429", type=float, default=config.rate_429, help="注入429的概率")
+    parser.add_argument("--rate-500", type=float, default=config.rate_500, help="注入500的概率")
+    parser.add_argument("--transcript-sentences", type=int, default=config.transcript_sentences)
+    parser.add_argument("--xhs-latency", type=float, default=config.xhs_latency, help="XHS-Downloader平均延迟（秒）")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    for name in vars(config):
+        setattr(config, name, getattr(args, name))
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    import uvicorn
+    print(f"Mock Coze:           http://{args.host}:{args.port}/v1/workflow/stream_run")
+    print(f"Mock XHS-Downloader: http://{args.host}:{args.port}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
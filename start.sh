@@ -26,7 +26,7 @@ pip install --upgrade pip
 
 # 安装依赖
 echo "安装依赖..."
-pip install fastapi uvicorn python-multipart requests
+pip install fastapi uvicorn python-multipart requests httpx
 
 # 检查FFmpeg是否安装（可选）
 if ! command -v ffmpeg &> /dev/null; then
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+语音识别进程池测试
+验证任务在独立进程中执行、异常回传、排队上限与事件循环不被阻塞，
+以及取消后的名额占用与工作进程崩溃后的重建
+"""
+
+import sys
+import os
+import time
+import asyncio
+import subprocess
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import AsrPool, AsrBusyError
+
+def busy_work(seconds):
+    """
+    模拟一次耗时的识别：在工作进程中空转占用CPU
+    """
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+    return os.getpid()
+
+def bad_input():
+    raise ValueError("视频时长过短，请上传至少1秒的视频")
+
+def crash():
+    os._exit(1)
+
+def test_pool():
+    """
+    测试进程池执行、异常回传、排队已满时立即拒绝，以及识别期间事件循环保持响应
+    """
+    print("\n" + "="*60)
+    print("测试1: 进程池执行与背压")
+    print("="*60)
+
+    pool = AsrPool(workers=1, threads=1, queue_size=1, preload_models=[])
+
+    async def run():
+        pool.start()
+        jobs = [asyncio.ensure_future(pool.run(busy_work, 0.5)) for _ in range(2)]
+        await asyncio.sleep(0)
+        rejected = False
+        try:
+            await pool.run(busy_work, 0.1)
+        except AsrBusyError:
+            rejected = True
+
+        lags = []
+        while not all(job.done() for job in jobs):
+            start = time.monotonic()
+            await asyncio.sleep(0.01)
+            lags.append(time.monotonic() - start - 0.01)
+        pids = await asyncio.gather(*jobs)
+
+        try:
+            await pool.run(bad_input)
+            error = None
+        except ValueError as e:
+            error = str(e)
+        pool.shutdown()
+        return pids, rejected, max(lags), error
+
+    pids, rejected, max_lag, error = asyncio.run(run())
+    checks = [
+        ("任务在子进程中执行", all(pid != os.getpid() for pid in pids)),
+        ("超出排队上限立即拒绝", rejected and pool.stats["rejected"] == 1),
+        ("识别期间事件循环不被阻塞", max_lag < 0.1),
+        ("异常回传给调用方", error == "视频时长过短，请上传至少1秒的视频"),
+        ("统计完成与失败", pool.stats["completed"] == 2 and pool.stats["failed"] == 1),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def test_cancel_and_restart():
+    """
+    测试调用方取消后任务仍占名额直到工作进程执行完毕，以及进程崩溃后用forkserver重建进程池
+    """
+    print("\n" + "="*60)
+    print("测试2: 取消与崩溃重建")
+    print("="*60)
+
+    pool = AsrPool(workers=1, threads=1, queue_size=0, preload_models=[])
+
+    async def admitted_now():
+        try:
+            await pool.run(busy_work, 0)
+            return True
+        except AsrBusyError:
+            return False
+
+    async def run():
+        pool.start()
+        job = asyncio.ensure_future(pool.run(busy_work, 0.5))
+        await asyncio.sleep(0.2)
+        job.cancel()
+        await asyncio.gather(job, return_exceptions=True)
+        admitted_while_running = await admitted_now()
+        running = pool.snapshot()["running"]
+        await asyncio.sleep(0.5)
+        admitted_after = await admitted_now()
+
+        try:
+            await pool.run(crash)
+            crash_error = None
+        except Exception as e:
+            crash_error = str(e)
+        restart_method = pool._get_executor()._mp_context.get_start_method()
+        pid = await pool.run(busy_work, 0)
+        pool.shutdown()
+        return admitted_while_running, running, admitted_after, crash_error, restart_method, pid
+
+    admitted_while_running, running, admitted_after, crash_error, restart_method, pid = asyncio.run(run())
+
+    # forkserver启动的工作进程会重新导入主模块：导入本身不应创建或清理任何文件
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, XHS_CACHE_DIR=os.path.join(tmp, "cache"),
+                   XHS_SCRATCH_DIR=os.path.join(tmp, "scratch"))
+        subprocess.run([sys.executable, "-c", "import app"], env=env, check=True,
+                       cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True)
+        import_side_effects = os.listdir(tmp)
+
+    checks = [
+        ("取消后工作进程未完成时不放行新任务", not admitted_while_running and running == 1),
+        ("工作进程完成后释放名额", admitted_after),
+        ("进程崩溃报错", crash_error == "语音识别进程异常退出" and pool.stats["restarts"] == 1),
+        ("崩溃后用forkserver重建", restart_method == "forkserver"),
+        ("重建后正常执行", pid != os.getpid()),
+        ("导入模块不产生文件", import_side_effects == []),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def main():
+    """
+    主函数
+    """
+    results = [
+        ("进程池执行与背压", test_pool()),
+        ("取消与崩溃重建", test_cancel_and_restart()),
+    ]
+
+    print("\n" + "="*60)
+    print("测试报告")
+    print("="*60)
+    for test_name, passed in results:
+        print(f"{test_name}: {'✅ 通过' if passed else '❌ 失败'}")
+
+    return 0 if all(passed for _, passed in results) else 1
+
+if __name__ == "__main__":
+    exit(main())
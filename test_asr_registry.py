@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Whisper模型注册表测试
+用替身加载函数代替whisper.load_model，验证并发首次使用时每个模型只加载一次、
+加载后预热，以及同一模型的推理由锁串行
+"""
+
+import sys
+import os
+import time
+import types
+import threading
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from asr_worker import AsrModelRegistry
+
+class FakeParameter:
+    def numel(self):
+        return 1024 * 1024
+
+    def element_size(self):
+        return 4
+
+class FakeModel:
+    """
+    代替Whisper模型：记录预热调用，提供参数以便统计权重大小
+    """
+    def __init__(self, name):
+        self.name = name
+        self.warmups = 0
+
+    def transcribe(self, audio, **kwargs):
+        self.warmups += 1
+        return {"text": "", "segments": []}
+
+    def parameters(self):
+        return [FakeParameter()]
+
+def fake_whisper(loads):
+    """
+    替身whisper模块：load_model 记录调用并稍作停顿，让并发的首次使用重叠
+    """
+    def load_model(name):
+        loads.append(name)
+        time.sleep(0.05)
+        return FakeModel(name)
+
+    module = types.ModuleType("whisper")
+    module.load_model = load_model
+    return module
+
+def test_load_once():
+    """
+    测试多个线程同时首次使用同一模型时只加载一次，不同模型各自加载并预热
+    """
+    print("\n" + "="*60)
+    print("测试1: 每个模型只加载一次")
+    print("="*60)
+
+    loads = []
+    original = sys.modules.get("whisper")
+    sys.modules["whisper"] = fake_whisper(loads)
+    try:
+        registry = AsrModelRegistry()
+        entries = []
+        threads = [threading.Thread(target=lambda name=name: entries.append(registry.get(name)))
+                   for name in ["base"] * 6 + ["small"] * 2]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        again = registry.get("base")
+        snapshot = registry.snapshot()
+    finally:
+        if original is None:
+            sys.modules.pop("whisper", None)
+        else:
+            sys.modules["whisper"] = original
+
+    base_models = {id(entry["model"]) for entry in entries if entry["model"].name == "base"}
+    checks = [
+        ("每个模型只加载一次", sorted(loads) == ["base", "small"]),
+        ("并发使用拿到同一个模型", len(base_models) == 1 and id(again["model"]) in base_models),
+        ("加载后预热一次", again["model"].warmups == 1),
+        ("快照记录权重大小", snapshot["models"]["base"]["weights_mb"] == 4.0),
+        ("快照不暴露模型与锁", "model" not in snapshot["models"]["base"]
+                               and "inference_lock" not in snapshot["models"]["base"]),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def test_inference_lock():
+    """
+    测试同一模型的推理互斥、不同模型互不阻塞，并统计使用次数
+    """
+    print("\n" + "="*60)
+    print("测试2: 推理锁")
+    print("="*60)
+
+    original = sys.modules.get("whisper")
+    sys.modules["whisper"] = fake_whisper([])
+    try:
+        registry = AsrModelRegistry()
+        registry.preload(["base", "small"])
+        holding = threading.Event()
+        release = threading.Event()
+        order = []
+
+        def hold():
+            with registry.use("base"):
+                holding.set()
+                release.wait(5)
+                order.append("first")
+
+        def wait_for_base():
+            with registry.use("base"):
+                order.append("second")
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        holding.wait(5)
+        waiter = threading.Thread(target=wait_for_base)
+        waiter.start()
+        waiter.join(0.2)
+        blocked = waiter.is_alive()
+
+        with registry.use("small"):
+            other_model_free = True
+
+        release.set()
+        holder.join()
+        waiter.join()
+        uses = registry.snapshot()["models"]["base"]["uses"]
+    finally:
+        if original is None:
+            sys.modules.pop("whisper", None)
+        else:
+            sys.modules["whisper"] = original
+
+    checks = [
+        ("同一模型的第二次推理等待锁", blocked),
+        ("释放后按顺序执行", order == ["first", "second"]),
+        ("不同模型不受影响", other_model_free),
+        ("统计使用次数", uses == 2),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def main():
+    """
+    主函数
+    """
+    results = [
+        ("每个模型只加载一次", test_load_once()),
+        ("推理锁", test_inference_lock()),
+    ]
+
+    print("\n" + "="*60)
+    print("测试报告")
+    print("="*60)
+    for test_name, passed in results:
+        print(f"{test_name}: {'✅ 通过' if passed else '❌ 失败'}")
+
+    return 0 if all(passed for _, passed in results) else 1
+
+if __name__ == "__main__":
+    exit(main())
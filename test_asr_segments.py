@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+分段并行识别测试
+验证能量VAD按静音切分并跳过静音、分段在多个工作进程中并行识别、按顺序拼接并换算时间戳
+"""
+
+import sys
+import os
+import time
+import asyncio
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+import app
+import asr_worker
+from app import AsrPool
+
+SR = asr_worker.ASR_SAMPLE_RATE
+
+def tone(seconds):
+    t = np.arange(int(seconds * SR)) / SR
+    return (0.3 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+
+def silence(seconds):
+    return np.random.default_rng(0).normal(0, 0.001, int(seconds * SR)).astype(np.float32)
+
+def fake_segment(samples, offset, model_name):
+    """
+    代替Whisper：耗时0.5秒，返回分段起点与长度
+    """
+    time.sleep(0.5)
+    duration = len(samples) / SR
+    return {
+        "text": f"[{offset:.0f}]",
+        "segments": [{"start": round(offset, 2), "end": round(offset + duration, 2), "text": f"[{offset:.0f}]"}],
+        "worker": {"pid": os.getpid()},
+    }
+
+def fake_decode(video_path, pcm_path, segment_seconds, min_silence, **decode_options):
+    """
+    代替ffmpeg解码：耗时0.5秒，写入两段语音并切分
+    """
+    time.sleep(0.5)
+    audio = np.concatenate([tone(5), silence(5), tone(5)])
+    audio.tofile(pcm_path)
+    return {"audio_duration": len(audio) / SR,
+            "spans": asr_worker.split_for_transcription(audio, segment_seconds, min_silence),
+            "worker": {"pid": os.getpid()}}
+
+def fake_span(pcm_path, start, end, model_name):
+    samples = np.memmap(pcm_path, dtype=np.float32, mode="r")[start:end]
+    return fake_segment(samples, start / SR, model_name)
+
+def test_vad():
+    """
+    测试静音被跳过、短停顿不切分、超长语音被切成不超过上限的分段
+    """
+    print("\n" + "="*60)
+    print("测试1: 静音切分")
+    print("="*60)
+
+    audio = np.concatenate([silence(2), tone(5), silence(0.1), tone(3), silence(10), tone(50), silence(3)])
+    spans = [(s / SR, e / SR) for s, e in asr_worker.find_speech_segments(audio, max_seconds=30)]
+    speech = sum(e - s for s, e in spans)
+
+    checks = [
+        ("短停顿不切分", spans[0][0] < 2 < spans[0][0] + 0.3 and 10 < spans[0][1] < 10.5),
+        ("长静音被跳过", not any(s < 15 < e for s, e in spans) and speech < 60),
+        ("超长语音被切分", len(spans) == 3 and all(e - s <= 30.01 for s, e in spans)),
+        ("纯静音没有分段", asr_worker.find_speech_segments(silence(5)) == []),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def test_parallel():
+    """
+    测试分段在两个工作进程中并行识别，结果按顺序拼接且时间戳对应原始音频
+    """
+    print("\n" + "="*60)
+    print("测试2: 并行识别与拼接")
+    print("="*60)
+
+    audio = np.concatenate([tone(5), silence(5), tone(5), silence(5), tone(5), silence(5), tone(5)])
+    pool = AsrPool(workers=2, threads=1, queue_size=1, preload_models=[])
+    original = app.asr_pool, asr_worker.transcribe_segment, app.ASR_SEGMENT_SECONDS
+    app.asr_pool, asr_worker.transcribe_segment, app.ASR_SEGMENT_SECONDS = pool, fake_segment, 8
+
+    async def run():
+        pool.start()
+        await asyncio.sleep(0.5)
+        start = time.monotonic()
+        result = await app.transcribe_samples_parallel(audio, len(audio) / SR)
+        return result, time.monotonic() - start
+
+    try:
+        (script, duration, segments), elapsed = asyncio.run(run())
+    finally:
+        pool.shutdown()
+        app.asr_pool, asr_worker.transcribe_segment, app.ASR_SEGMENT_SECONDS = original
+
+    checks = [
+        ("按顺序拼接", script == "[0][10][20][30]"),
+        ("时间戳对应原始音频", all(abs(seg["start"] - 10 * i) < 0.3 for i, seg in enumerate(segments))
+         and abs(duration - 35) < 0.01),
+        ("两个进程并行识别", elapsed < 1.5 and len(pool.snapshot()["worker_processes"]) == 2),
+        ("整段计为一个任务", pool.stats["submitted"] == 1 and pool.stats["completed"] == 1),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def test_upload_admission():
+    """
+    测试上传在解码前即占用进程池名额：第一个上传解码时第二个立即被拒绝；识别后临时PCM文件被清理
+    """
+    print("\n" + "="*60)
+    print("测试3: 上传解码前准入")
+    print("="*60)
+
+    pool = AsrPool(workers=1, threads=1, queue_size=0, preload_models=[])
+    patched = {"decode_to_pcm_file": fake_decode, "transcribe_pcm_span": fake_span}
+    original_worker = {name: getattr(asr_worker, name) for name in patched}
+    original_pool = app.asr_pool
+    app.asr_pool = pool
+    for name, fn in patched.items():
+        setattr(asr_worker, name, fn)
+    before = set(os.listdir(app.SCRATCH_DIR))
+
+    async def run():
+        pool.start()
+        await asyncio.sleep(0.5)
+        first = asyncio.ensure_future(app.transcribe_video_file("video.mp4"))
+        await asyncio.sleep(0.1)
+        try:
+            await app.transcribe_video_file("video.mp4")
+            rejected = False
+        except app.AsrBusyError:
+            rejected = True
+        return await first, rejected
+
+    try:
+        (script, duration, segments), rejected = asyncio.run(run())
+    finally:
+        pool.shutdown()
+        app.asr_pool = original_pool
+        for name, fn in original_worker.items():
+            setattr(asr_worker, name, fn)
+
+    checks = [
+        ("解码期间第二个上传被拒绝", rejected and pool.stats["rejected"] == 1),
+        ("从共享PCM文件识别并拼接", script == "[0][10]" and duration == 15),
+        ("临时PCM文件已清理", set(os.listdir(app.SCRATCH_DIR)) == before),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def main():
+    """
+    主函数
+    """
+    results = [
+        ("静音切分", test_vad()),
+        ("并行识别与拼接", test_parallel()),
+        ("上传解码前准入", test_upload_admission()),
+    ]
+
+    print("\n" + "="*60)
+    print("测试报告")
+    print("="*60)
+    for test_name, passed in results:
+        print(f"{test_name}: {'✅ 通过' if passed else '❌ 失败'}")
+
+    return 0 if all(passed for _, passed in results) else 1
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+转写缓存测试
+验证笔记ID归一化、TTL过期与LRU淘汰
+"""
+
+import sys
+import os
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import PersistentLRUCache, note_cache_key
+
+def test_note_cache_key():
+    """
+    测试缓存键归一化：同一笔记的不同链接应得到相同的键
+    """
+    print("\n" + "="*60)
+    print("测试1: 缓存键归一化")
+    print("="*60)
+
+    test_cases = [
+        {
+            "input": "https://www.xiaohongshu.com/explore/685366cc0000000011003ee8?xsec_token=abc",
+            "expected": "note:685366cc0000000011003ee8"
+        },
+        {
+            "input": "https://www.xiaohongshu.com/discovery/item/685366cc0000000011003ee8?app_platform=ios&share_id=x",
+            "expected": "note:685366cc0000000011003ee8"
+        },
+        {
+            "input": "http://xhslink.com/o/6ERHmvmf6qG",
+            "expected": "xhslink:6ERHmvmf6qG"
+        },
+        {
+            "input": "https://example.com/video.mp4",
+            "expected": None
+        }
+    ]
+
+    all_passed = True
+    for i, test_case in enumerate(test_cases, 1):
+        key = note_cache_key(test_case["input"])
+        if key == test_case["expected"]:
+            print(f"✅ 测试用例 {i} 通过：{key}")
+        else:
+            print(f"❌ 测试用例 {i} 失败")
+            print(f"   期望: {test_case['expected']}")
+            print(f"   实际: {key}")
+            all_passed = False
+
+    return all_passed
+
+def test_ttl_and_eviction():
+    """
+    测试TTL过期、内存层与磁盘层的LRU淘汰
+    """
+    print("\n" + "="*60)
+    print("测试2: TTL与LRU淘汰")
+    print("="*60)
+
+    all_passed = True
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "cache.sqlite3")
+        cache = PersistentLRUCache(db_path, "t", ttl=60, memory_items=2, disk_items=3)
+
+        for i in range(4):
+            cache.set(f"k{i}", f"v{i}")
+
+        checks = [
+            ("最旧条目已从磁盘淘汰", cache.get("k0") is None),
+            ("磁盘层命中", cache.get("k1") == "v1" and cache.stats["disk_hits"] == 1),
+            ("内存层命中", cache.get("k3") == "v3" and cache.stats["memory_hits"] >= 1),
+        ]
+
+        # 重新打开：磁盘层数据应保留
+        reopened = PersistentLRUCache(db_path, "t", ttl=60, memory_items=2, disk_items=3)
+        checks.append(("重启后磁盘数据保留", reopened.get("k2") == "v2"))
+
+        expired = PersistentLRUCache(os.path.join(tmp, "ttl.sqlite3"), "t", ttl=0,
+                                     memory_items=2, disk_items=3)
+        expired.set("k", "v")
+        time.sleep(0.01)
+        checks.append(("过期条目不返回", expired.get("k") is None))
+
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+
+    return all_passed
+
+def main():
+    """
+    主函数
+    """
+    results = [
+        ("缓存键归一化", test_note_cache_key()),
+        ("TTL与LRU淘汰", test_ttl_and_eviction()),
+    ]
+
+    print("\n" + "="*60)
+    print("测试报告")
+    print("="*60)
+    for test_name, passed in results:
+        print(f"{test_name}: {'✅ 通过' if passed else '❌ 失败'}")
+
+    return 0 if all(passed for _, passed in results) else 1
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+CDN镜像选择测试
+验证按EWMA排序与改写域名、首选镜像过慢时竞速第二镜像、按排名依次故障转移、连续失败后冷却
+"""
+
+import sys
+import os
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import MirrorSelector
+
+HOSTS = ["a.xhscdn.com", "b.xhscdn.com", "c.xhscdn.com"]
+VIDEO = "https://a.xhscdn.com/stream/abc.mp4"
+
+def make_selector():
+    return MirrorSelector(HOSTS, alpha=0.5, race_delay=0.1, max_failures=2,
+                          cooldown=60, reference_bytes=8 * 1024 * 1024)
+
+def test_ranking():
+    """
+    测试未测量的镜像优先、按首字节时间与吞吐排序、冷却中的镜像被跳过
+    """
+    print("\n" + "="*60)
+    print("测试1: 镜像排序")
+    print("="*60)
+
+    selector = make_selector()
+    initial = selector.candidates(VIDEO)
+    selector.record_ttfb("a.xhscdn.com", 0.5)
+    selector.record_ttfb("b.xhscdn.com", 0.1)
+    selector.record_ttfb("c.xhscdn.com", 0.05)
+    selector.record_throughput("b.xhscdn.com", 8 * 1024 * 1024, 1.0)
+    selector.record_throughput("c.xhscdn.com", 8 * 1024 * 1024, 4.0)
+    selector.record_throughput("a.xhscdn.com", 8 * 1024 * 1024, 2.0)
+    measured = selector.candidates(VIDEO)
+    selector.record_failure("b.xhscdn.com")
+    selector.record_failure("b.xhscdn.com")
+    cooled = selector.candidates(VIDEO)
+
+    checks = [
+        ("无数据时保留原域名", initial[0] == VIDEO),
+        ("按预计耗时排序并改写域名", measured == [
+            "https://b.xhscdn.com/stream/abc.mp4",
+            "https://a.xhscdn.com/stream/abc.mp4",
+            "https://c.xhscdn.com/stream/abc.mp4",
+        ]),
+        ("连续失败后冷却", "b.xhscdn.com" not in " ".join(cooled) and len(cooled) == 2),
+        ("非镜像地址不改写", selector.candidates("https://example.com/v.mp4") == ["https://example.com/v.mp4"]),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def test_race():
+    """
+    测试首选镜像迟迟不响应时启动第二镜像并采用先返回的结果；首选失败时改用第二镜像
+    """
+    print("\n" + "="*60)
+    print("测试2: 镜像竞速")
+    print("="*60)
+
+    selector = make_selector()
+    selector.record_ttfb("a.xhscdn.com", 0.01)
+    selector.record_ttfb("b.xhscdn.com", 0.02)
+    selector.record_ttfb("c.xhscdn.com", 0.03)
+
+    def slow_first(url):
+        time.sleep(0.5 if "//a." in url else 0.01)
+        return url
+
+    start = time.monotonic()
+    winner = selector.race(VIDEO, slow_first)
+    elapsed = time.monotonic() - start
+
+    def failing_first(url):
+        if "//a." in url:
+            raise ConnectionError("down")
+        return url
+
+    fallback = selector.race(VIDEO, failing_first)
+
+    checks = [
+        ("慢的首选被第二镜像超过", winner.startswith("https://b.") and elapsed < 0.4),
+        ("竞速计数", selector.stats["races"] == 2 and selector.stats["race_won_by_second"] == 2),
+        ("首选失败时改用第二镜像", fallback.startswith("https://b.")),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def test_failover():
+    """
+    测试不能竞速的请求按排名依次尝试镜像，失败的镜像记为失败，全部失败时抛出首选镜像的错误
+    """
+    print("\n" + "="*60)
+    print("测试3: 镜像故障转移")
+    print("="*60)
+
+    selector = make_selector()
+    tried = []
+
+    def first_two_down(url):
+        tried.append(url)
+        if "//c." not in url:
+            raise ConnectionError(url)
+        return url
+
+    chosen = selector.failover(VIDEO, first_two_down)
+    snapshot = selector.snapshot()
+
+    def all_down(url):
+        raise ConnectionError(url)
+
+    try:
+        selector.failover(VIDEO, all_down)
+        error = None
+    except ConnectionError as e:
+        error = str(e)
+
+    checks = [
+        ("按排名依次尝试", [u.split("/")[2] for u in tried] == HOSTS),
+        ("采用第一个成功的镜像", chosen == "https://c.xhscdn.com/stream/abc.mp4"),
+        ("失败的镜像被记录", snapshot["mirrors"]["a.xhscdn.com"]["consecutive_failures"] == 1
+                             and snapshot["mirrors"]["c.xhscdn.com"]["ttfb_ms"] is not None),
+        ("故障转移计数", snapshot["failovers"] == 2),
+        ("全部失败时抛出首选镜像的错误", error is not None and "//c." in error),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def main():
+    """
+    主函数
+    """
+    results = [
+        ("镜像排序", test_ranking()),
+        ("镜像竞速", test_race()),
+        ("镜像故障转移", test_failover()),
+    ]
+
+    print("\n" + "="*60)
+    print("测试报告")
+    print("="*60)
+    for test_name, passed in results:
+        print(f"{test_name}: {'✅ 通过' if passed else '❌ 失败'}")
+
+    return 0 if all(passed for _, passed in results) else 1
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+视频下载测试
+使用本地支持Range的HTTP服务验证多连接范围下载、长度校验与断点续传，
+以及管道解码失败时转写改走完整下载
+"""
+
+import sys
+import os
+import re
+import asyncio
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app
+from app import download_video
+
+PAYLOAD = bytes(range(256)) * (10 * 4096 + 7)  # 约10MB，不是分块大小的整数倍
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    最小的静态文件服务：支持HEAD与单个Range；fail_ranges 中的起始偏移第一次请求时中途断开
+    """
+    fail_ranges = set()
+    requests_seen = []
+    encodings_seen = set()
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(PAYLOAD)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        self.encodings_seen.add(self.headers.get("Accept-Encoding"))
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        start = int(match.group(1)) if match else 0
+        end = int(match.group(2)) if match and match.group(2) else len(PAYLOAD) - 1
+        self.requests_seen.append((start, end))
+        body = PAYLOAD[start:end + 1]
+        self.send_response(206 if match else 200)
+        self.send_header("Content-Length", str(len(body)))
+        if match:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+        self.end_headers()
+        if start in self.fail_ranges:
+            self.fail_ranges.discard(start)
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+def test_parallel_and_resume():
+    """
+    测试并行范围下载结果一致，以及中途断开后下一次尝试只补下缺失的范围
+    """
+    print("\n" + "="*60)
+    print("测试1: 并行范围下载与续传")
+    print("="*60)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/video.mp4"
+    part_size = app.DOWNLOAD_PART_MB * 1024 * 1024
+
+    checks = []
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "a.mp4")
+        download_video(url, output)
+        with open(output, "rb") as f:
+            checks.append(("并行下载内容一致", f.read() == PAYLOAD))
+        checks.append(("按范围分多次请求", len(RangeHandler.requests_seen) >= 3))
+        checks.append(("未留下临时文件", sorted(os.listdir(tmp)) == ["a.mp4"]))
+        checks.append(("按原始字节传输（不压缩）", RangeHandler.encodings_seen == {"identity"}))
+
+        RangeHandler.requests_seen.clear()
+        RangeHandler.fail_ranges = {part_size}
+        output = os.path.join(tmp, "b.mp4")
+        download_video(url, output)
+        with open(output, "rb") as f:
+            checks.append(("断开后续传内容一致", f.read() == PAYLOAD))
+        retried = [r for r in RangeHandler.requests_seen if r[0] == part_size]
+        others = [r for r in RangeHandler.requests_seen if r[0] != part_size]
+        checks.append(("只重新请求失败的范围", len(retried) == 2 and len(others) == len(set(others))))
+    server.shutdown()
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def test_transcribe_fallback():
+    """
+    测试管道无法解码时transcribe_video_url下载完整视频到临时空间再转写，结束后清理
+    """
+    print("\n" + "="*60)
+    print("测试2: 管道解码失败改走下载")
+    print("="*60)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/video.mp4"
+    seen = []
+
+    def undecodable(video_url):
+        raise app.AudioDecodeError("moov atom not found")
+
+    async def fake_transcribe_file(video_path):
+        with open(video_path, "rb") as f:
+            seen.append((video_path, f.read() == PAYLOAD))
+        return "文案", 12.0, []
+
+    original = (app.stream_video_audio, app.transcribe_video_file)
+    app.stream_video_audio = undecodable
+    app.transcribe_video_file = fake_transcribe_file
+    try:
+        result = asyncio.run(app.transcribe_video_url(url))
+    finally:
+        app.stream_video_audio, app.transcribe_video_file = original
+        server.shutdown()
+
+    checks = [
+        ("返回下载后的转写结果", result == ("文案", 12.0, [])),
+        ("转写完整的下载文件", len(seen) == 1 and seen[0][1]),
+        ("下载文件位于临时空间", bool(seen) and seen[0][0].startswith(app.scratch_space.root)),
+        ("转写后删除下载文件", bool(seen) and not os.path.exists(seen[0][0])),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def main():
+    """
+    主函数
+    """
+    results = [
+        ("并行范围下载与续传", test_parallel_and_resume()),
+        ("管道解码失败改走下载", test_transcribe_fallback()),
+    ]
+
+    print("\n" + "="*60)
+    print("测试报告")
+    print("="*60)
+    for test_name, passed in results:
+        print(f"{test_name}: {'✅ 通过' if passed else '❌ 失败'}")
+
+    return 0 if all(passed for _, passed in results) else 1
+
+if __name__ == "__main__":
+    exit(main())
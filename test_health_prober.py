@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+后台健康探测测试
+验证探测成功/失败/超时的状态记录、可用率统计与请求路径上报的连续失败
+"""
+
+import sys
+import os
+import asyncio
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import HealthProber
+
+def test_probe_states():
+    """
+    测试一轮探测后各依赖的状态，以及请求连续失败达到阈值后的状态切换
+    """
+    print("\n" + "="*60)
+    print("测试1: 探测状态与统计")
+    print("="*60)
+
+    async def ok():
+        await asyncio.sleep(0.01)
+
+    async def down():
+        raise Exception("connection refused")
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def run():
+        prober = HealthProber(interval=60, timeout=0.1, window=4, failure_threshold=2)
+        prober.register("ok", ok)
+        prober.register("down", down)
+        prober.register("hang", hang)
+        unknown = prober.is_available("ok")
+
+        await prober.probe_once()
+        await prober.probe_once()
+        first = {name: prober.snapshot(name) for name in prober.dependencies}
+
+        prober.report_failure("ok", "HTTP 502")
+        prober.report_success("ok")
+        prober.report_failure("ok", "HTTP 502")
+        after_one = prober.is_available("ok")
+        prober.report_failure("ok", "HTTP 502")
+        reported = prober.snapshot("ok")
+        gated = prober.is_available("ok")
+        await prober.probe_once()
+        recovered = prober.snapshot("ok")
+
+        return [
+            ("首次探测前视为可用", unknown is True),
+            ("正常依赖可用且记录延迟", first["ok"]["available"] and first["ok"]["latency_p50"] is not None),
+            ("失败依赖记录错误", not first["down"]["available"] and first["down"]["last_error"] == "connection refused"),
+            ("超时依赖被判为不可用", not first["hang"]["available"] and "timed out" in first["hang"]["last_error"]),
+            ("连续失败计数", first["down"]["consecutive_failures"] == 2),
+            ("单次请求失败不影响可用", after_one),
+            ("连续失败达到阈值后不可用", not gated and not reported["available"]
+             and reported["availability"] == round(2 / 3, 4)),
+            ("下一次探测成功后恢复", recovered["available"] and recovered["consecutive_failures"] == 0),
+        ]
+
+    all_passed = True
+    for name, passed in asyncio.run(run()):
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def main():
+    """
+    主函数
+    """
+    results = [
+        ("探测状态与统计", test_probe_states()),
+    ]
+
+    print("\n" + "="*60)
+    print("测试报告")
+    print("="*60)
+    for test_name, passed in results:
+        print(f"{test_name}: {'✅ 通过' if passed else '❌ 失败'}")
+
+    return 0 if all(passed for _, passed in results) else 1
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+持久化任务队列测试
+验证幂等提交、租约过期后的接管、失败重试与重启后恢复，
+以及工作协程的数据库调用不阻塞事件循环
+"""
+
+import sys
+import os
+import asyncio
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+
+import app
+from app import JobQueue, UpstreamRejectedError, _coze_status_error, _is_permanent_job_error
+
+def test_idempotent_enqueue():
+    """
+    测试幂等键：重复提交返回同一个任务
+    """
+    print("\n" + "="*60)
+    print("测试1: 幂等提交")
+    print("="*60)
+
+    all_passed = True
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(os.path.join(tmp, "jobs.sqlite3"), lease_seconds=60,
+                         max_attempts=3, retry_backoff=0)
+
+        first, created_first = queue.enqueue("rewrite", {"script": "a"}, "key-1")
+        second, created_second = queue.enqueue("rewrite", {"script": "a"}, "key-1")
+        batch, created_batch = queue.enqueue_batch("extract", [{"url": "u0"}, {"url": "u1"}], "batch-1")
+        batch_again, created_batch_again = queue.enqueue_batch("extract", [{"url": "u0"}], "batch-1")
+
+        checks = [
+            ("单任务重复提交返回原任务", first == second and created_first and not created_second),
+            ("批量重复提交返回原批次", batch == batch_again and created_batch and not created_batch_again),
+            ("批次包含全部条目", queue.get_batch(batch)["total"] == 2),
+            ("任务总数未重复增加", queue.snapshot()["pending"] == 3),
+        ]
+
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+
+    return all_passed
+
+def test_lease_and_retry():
+    """
+    测试租约过期接管、旧租约失效、重试次数上限与重启后恢复
+    """
+    print("\n" + "="*60)
+    print("测试2: 租约与重试")
+    print("="*60)
+
+    all_passed = True
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "jobs.sqlite3")
+        queue = JobQueue(db_path, lease_seconds=0.05, max_attempts=2, retry_backoff=0)
+        job_id, _ = queue.enqueue("extract", {"url": "u"})
+
+        crashed = queue.claim()
+        checks = [("租约期内不可重复领取", crashed["id"] == job_id and queue.claim() is None)]
+
+        # 模拟进程重启：新实例在租约过期后接管任务
+        time.sleep(0.1)
+        restarted = JobQueue(db_path, lease_seconds=60, max_attempts=2, retry_backoff=0)
+        resumed = restarted.claim()
+        checks.append(("重启后接管过期任务", resumed is not None and resumed["id"] == job_id))
+        checks.append(("旧租约无法提交结果", not restarted.complete(job_id, crashed["lease_token"], {})))
+        checks.append(("新租约可续期", restarted.renew(job_id, resumed["lease_token"])))
+
+        status = restarted.fail(job_id, resumed["lease_token"], "boom", retry=True)
+        checks.append(("达到最大次数后不再重试", status == "failed"))
+
+        retry_id, _ = restarted.enqueue("extract", {"url": "v"})
+        job = restarted.claim()
+        checks.append(("可重试错误回到待处理", restarted.fail(retry_id, job["lease_token"], "temp", retry=True) == "pending"))
+        job = restarted.claim()
+        restarted.complete(retry_id, job["lease_token"], {"ok": True})
+        done = restarted.get_job(retry_id)
+        checks.append(("重试后结果持久化", done["status"] == "done" and done["result"] == {"ok": True} and done["attempts"] == 2))
+
+        restarted.purge(time.time() + 1)
+        checks.append(("清理已完成任务", restarted.get_job(retry_id) is None))
+
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+
+    return all_passed
+
+def test_expiry_cleanup_and_permanent_errors():
+    """
+    测试租约过期且次数用尽的任务会交给清理回调；认证等4xx错误不再重试
+    """
+    print("\n" + "="*60)
+    print("测试3: 过期清理与永久错误")
+    print("="*60)
+
+    all_passed = True
+    with tempfile.TemporaryDirectory() as tmp:
+        upload = os.path.join(tmp, "upload.mp4")
+        with open(upload, "wb") as f:
+            f.write(b"video")
+        cleaned = []
+
+        def cleanup(job):
+            cleaned.append(job["id"])
+            os.remove(job["payload"]["path"])
+
+        queue = JobQueue(os.path.join(tmp, "jobs.sqlite3"), lease_seconds=0.05,
+                         max_attempts=1, retry_backoff=0, on_expired=cleanup)
+        job_id, _ = queue.enqueue("transcribe_upload", {"path": upload})
+        queue.claim()
+        time.sleep(0.1)
+        next_job = queue.claim()
+
+        checks = [
+            ("过期任务标记失败", next_job is None and queue.get_job(job_id)["error"] == "lease expired"),
+            ("过期任务的上传文件被清理", cleaned == [job_id] and not os.path.exists(upload)),
+            ("401不再重试", _is_permanent_job_error(_coze_status_error(401, "unauthorized"))),
+            ("429与5xx仍会重试", not _is_permanent_job_error(_coze_status_error(429, "busy"))
+             and not _is_permanent_job_error(_coze_status_error(502, "bad gateway"))),
+            ("网络错误仍会重试", not _is_permanent_job_error(httpx.ConnectError("down"))),
+            ("拒绝错误类型", isinstance(_coze_status_error(403, "x"), UpstreamRejectedError)),
+        ]
+
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+
+    return all_passed
+
+def test_worker_off_loop():
+    """
+    测试工作协程在独立线程上访问数据库：数据库调用变慢时事件循环照常运行，任务仍能完成
+    """
+    print("\n" + "="*60)
+    print("测试4: 数据库调用不阻塞事件循环")
+    print("="*60)
+
+    class SlowQueue(JobQueue):
+        """每次领取前停顿，模拟数据库被其他连接锁住"""
+        def claim(self):
+            time.sleep(0.2)
+            return super().claim()
+
+    async def noop(payload):
+        return {"echo": payload["n"]}
+
+    async def scenario(queue, job_id):
+        app.job_wakeup = asyncio.Event()
+        worker = asyncio.ensure_future(app._job_worker(0))
+        ticks = 0
+        deadline = time.monotonic() + 0.6
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+            ticks += 1
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+        return ticks, await app.job_db(queue.get_job, job_id)
+
+    original = (app.job_queue, app.JOB_HANDLERS, app.job_wakeup)
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = SlowQueue(os.path.join(tmp, "jobs.sqlite3"), lease_seconds=30,
+                          max_attempts=1, retry_backoff=0)
+        job_id, _ = queue.enqueue("noop", {"n": 1})
+        app.job_queue, app.JOB_HANDLERS = queue, {"noop": noop}
+        try:
+            ticks, job = asyncio.run(scenario(queue, job_id))
+        finally:
+            app.job_queue, app.JOB_HANDLERS, app.job_wakeup = original
+
+    checks = [
+        ("领取期间事件循环保持运行", ticks >= 30),
+        ("任务完成", job["status"] == "done" and job["result"] == {"echo": 1}),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def main():
+    """
+    主函数
+    """
+    results = [
+        ("幂等提交", test_idempotent_enqueue()),
+        ("租约与重试", test_lease_and_retry()),
+        ("过期清理与永久错误", test_expiry_cleanup_and_permanent_errors()),
+        ("数据库调用不阻塞事件循环", test_worker_off_loop()),
+    ]
+
+    print("\n" + "="*60)
+    print("测试报告")
+    print("="*60)
+    for test_name, passed in results:
+        print(f"{test_name}: {'✅ 通过' if passed else '❌ 失败'}")
+
+    return 0 if all(passed for _, passed in results) else 1
+
+if __name__ == "__main__":
+    exit(main())
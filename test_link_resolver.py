@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+短链解析测试
+验证长链直接解析、xhslink短链跳转解析、缓存命中与解析失败时的回退
+"""
+
+import sys
+import os
+import asyncio
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+from app import XhsLinkResolver, parse_note_link
+
+NOTE_ID = "685366cc0000000011003ee8"
+
+def make_resolver(requests_seen):
+    """
+    构造使用本地MockTransport的解析器：xhslink短链经过一次中间跳转后指向笔记
+    """
+    def handler(request):
+        requests_seen.append((request.method, str(request.url)))
+        if request.url.host == "xhslink.com" and request.url.path == "/o/good":
+            return httpx.Response(302, headers={"location": "https://www.xiaohongshu.com/404/redirect?x=1"})
+        if request.url.path == "/404/redirect":
+            if request.method == "HEAD":
+                return httpx.Response(405)
+            return httpx.Response(302, headers={
+                "location": f"/discovery/item/{NOTE_ID}?app_platform=ios&xsec_token=TOKEN123&xsec_source=app_share"
+            })
+        return httpx.Response(404)
+
+    resolver = XhsLinkResolver(ttl=60, max_items=2, timeout=5)
+    resolver._client = httpx.AsyncClient(transport=httpx.MockTransport(handler), follow_redirects=False)
+    return resolver
+
+def test_long_link():
+    """
+    测试长链：无需网络即可得到笔记ID、xsec_token和规范链接
+    """
+    print("\n" + "="*60)
+    print("测试1: 长链解析")
+    print("="*60)
+
+    link = parse_note_link(f"https://www.xiaohongshu.com/explore/{NOTE_ID}?xsec_token=abc&share_id=1")
+    checks = [
+        ("笔记ID", link.note_id == NOTE_ID),
+        ("xsec_token", link.xsec_token == "abc"),
+        ("规范链接", link.canonical_url == f"https://www.xiaohongshu.com/explore/{NOTE_ID}?xsec_token=abc&xsec_source=pc_share"),
+        ("非笔记链接返回None", parse_note_link("https://www.xiaohongshu.com/user/profile/1") is None),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def test_short_link():
+    """
+    测试短链：HEAD跳转解析、405回退GET、并发合并、缓存命中与失败回退
+    """
+    print("\n" + "="*60)
+    print("测试2: 短链解析与缓存")
+    print("="*60)
+
+    async def run():
+        seen = []
+        resolver = make_resolver(seen)
+        first, second = await asyncio.gather(
+            resolver.resolve("http://xhslink.com/o/good"),
+            resolver.resolve("http://xhslink.com/o/good"),
+        )
+        calls_after_first = len(seen)
+        cached = await resolver.resolve("http://xhslink.com/o/good")
+        failed = await resolver.resolve("http://xhslink.com/o/bad")
+        await resolver.close()
+        return [
+            ("解析出笔记ID", first.note_id == NOTE_ID and first.xsec_token == "TOKEN123"),
+            ("并发请求共享一次解析", second is first and calls_after_first == 3),
+            ("只用HEAD，405时回退GET", [method for method, _ in seen[:3]] == ["HEAD", "HEAD", "GET"]),
+            ("缓存命中不再请求", cached is first and resolver.stats["hits"] == 1),
+            ("解析失败回退原链接", failed.note_id is None and failed.canonical_url == "http://xhslink.com/o/bad"),
+        ]
+
+    all_passed = True
+    for name, passed in asyncio.run(run()):
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def main():
+    """
+    主函数
+    """
+    results = [
+        ("长链解析", test_long_link()),
+        ("短链解析与缓存", test_short_link()),
+    ]
+
+    print("\n" + "="*60)
+    print("测试报告")
+    print("="*60)
+    for test_name, passed in results:
+        print(f"{test_name}: {'✅ 通过' if passed else '❌ 失败'}")
+
+    return 0 if all(passed for _, passed in results) else 1
+
+if __name__ == "__main__":
+    exit(main())
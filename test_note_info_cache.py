@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+笔记信息缓存测试
+验证按笔记ID缓存、磁盘压缩存储、失败不缓存与批量预取
+"""
+
+import sys
+import os
+import asyncio
+import sqlite3
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app
+from app import PersistentLRUCache
+
+NOTE_ID = "685366cc0000000011003ee8"
+
+def use_temp_cache(tmp):
+    """
+    用临时目录中的缓存替换全局笔记信息缓存，并用计数的假下载器替换真实调用
+    """
+    app.note_info_cache = PersistentLRUCache(
+        db_path=os.path.join(tmp, "note_info.sqlite3"), table="note_info",
+        ttl=60, memory_items=1, disk_items=100, compress=True,
+    )
+    calls = []
+
+    async def fake_fetch(xhs_url):
+        calls.append(xhs_url)
+        await asyncio.sleep(0.01)
+        return {} if xhs_url.endswith("bad") else {"title": "标题" * 50}
+
+    app._fetch_note_info_uncached = fake_fetch
+    return calls
+
+def test_cache_by_note_id():
+    """
+    测试同一笔记的不同链接共用缓存、并发未命中只调用一次、磁盘上为压缩数据
+    """
+    print("\n" + "="*60)
+    print("测试1: 按笔记ID缓存")
+    print("="*60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        calls = use_temp_cache(tmp)
+
+        async def run():
+            first = await asyncio.gather(*(
+                app.fetch_note_info(f"https://www.xiaohongshu.com/explore/{NOTE_ID}?xsec_token=t{i}")
+                for i in range(3)
+            ))
+            again = await app.fetch_note_info(f"https://www.xiaohongshu.com/discovery/item/{NOTE_ID}")
+            await app.fetch_note_info("https://www.xiaohongshu.com/explore/other")
+            evicted_to_disk = await app.fetch_note_info(f"https://www.xiaohongshu.com/explore/{NOTE_ID}")
+            return first, again, evicted_to_disk
+
+        first, again, from_disk = asyncio.run(run())
+        conn = sqlite3.connect(os.path.join(tmp, "note_info.sqlite3"))
+        raw = conn.execute("SELECT value FROM note_info WHERE key = ?", (NOTE_ID,)).fetchone()[0]
+        conn.close()
+
+        checks = [
+            ("并发请求只调用一次下载器", len([c for c in calls if NOTE_ID in c]) == 1),
+            ("不同链接命中同一缓存", all(r == again for r in first) and again["title"]),
+            ("磁盘层读取解压", from_disk == again and app.note_info_cache.stats["disk_hits"] == 1),
+            ("磁盘上为压缩数据", isinstance(raw, bytes) and len(raw) < len("标题" * 50)),
+        ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def test_prefetch():
+    """
+    测试批量预取：已缓存的跳过、失败不缓存、无效输入单独计数
+    """
+    print("\n" + "="*60)
+    print("测试2: 批量预取")
+    print("="*60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        calls = use_temp_cache(tmp)
+        notes = [
+            NOTE_ID,
+            f"https://www.xiaohongshu.com/explore/{NOTE_ID}",
+            "685366cc000000000000aaaa",
+            "685366cc0000000000000bad",
+            "not a link",
+        ]
+        first = asyncio.run(app.prefetch_note_info(notes))
+        calls.clear()
+        second = asyncio.run(app.prefetch_note_info(notes))
+
+        checks = [
+            ("首次预取计数", first == {"requested": 5, "cached": 0, "fetched": 3, "failed": 1, "invalid": 1}),
+            ("第二次只重试失败的笔记", second["cached"] == 3 and second["failed"] == 1 and len(calls) == 1),
+        ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def main():
+    """
+    主函数
+    """
+    results = [
+        ("按笔记ID缓存", test_cache_by_note_id()),
+        ("批量预取", test_prefetch()),
+    ]
+
+    print("\n" + "="*60)
+    print("测试报告")
+    print("="*60)
+    for test_name, passed in results:
+        print(f"{test_name}: {'✅ 通过' if passed else '❌ 失败'}")
+
+    return 0 if all(passed for _, passed in results) else 1
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+笔记页面视频地址提取测试
+验证页面状态中的笔记子树解析、undefined与转义处理以及组合扫描回退
+"""
+
+import sys
+import os
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import extract_video_url_from_page
+
+def test_extract_video_url():
+    """
+    测试不同页面结构下的视频地址提取
+    """
+    print("\n" + "="*60)
+    print("测试1: 视频地址提取")
+    print("="*60)
+
+    note_state = (
+        '<script>window.__INITIAL_STATE__={"user":{"loggedIn":undefined},'
+        '"feed":{"feeds":[{"cover":{"url":"http:\\u002F\\u002Fsns-webpic-qc.xhscdn.com\\u002Fcover.jpg"}}]},'
+        '"note":{"noteDetailMap":{"abc":{"note":{"title":"含}和{的标题","video":{"media":{"stream":'
+        '{"h264":[{"masterUrl":"http:\\u002F\\u002Fsns-video-bd.xhscdn.com\\u002Fstream\\u002F1.mp4"}]}}}}}}}}'
+        '</script>'
+    )
+    test_cases = [
+        {
+            "name": "noteDetailMap中的masterUrl",
+            "page": note_state,
+            "expected": "http://sns-video-bd.xhscdn.com/stream/1.mp4"
+        },
+        {
+            "name": "originVideoKey回退",
+            "page": '<script>window.__INITIAL_STATE__={"note":{"noteDetailMap":{"abc":{"note":'
+                    '{"video":{"consumer":{"originVideoKey":"pre_post\\u002Fkey"}}}}}}};</script>',
+            "expected": "https://sns-video-bd.xhscdn.com/pre_post/key"
+        },
+        {
+            "name": "无noteDetailMap时交给组合扫描",
+            "page": '<script>window.__INITIAL_STATE__={"user":{"loggedIn":undefined},"feed":{"feeds":'
+                    '[{"videoUrl":"http:\\u002F\\u002Fsns-video-bd.xhscdn.com\\u002Fstream\\u002F2.mp4"}]}}</script>',
+            "expected": "http://sns-video-bd.xhscdn.com/stream/2.mp4"
+        },
+        {
+            "name": "无页面状态时组合扫描",
+            "page": '<link href="https://a.com/x.css"><img src="https://a.com/logo.png">'
+                    '<div data-x=\'{"play_url": "https:\\/\\/v.xhscdn.com\\/p.mp4?a=1\\u0026b=2"}\'></div>',
+            "expected": "https://v.xhscdn.com/p.mp4?a=1&b=2"
+        },
+        {
+            "name": "裸链接回退",
+            "page": '<a href="https://a.com/image/1.jpg">x</a> <a href="https://xhsvideo.com/v/1">y</a>',
+            "expected": "https://xhsvideo.com/v/1"
+        },
+        {
+            "name": "无视频地址",
+            "page": '<html><body>{"note": {"title": "t"</body></html>',
+            "expected": None
+        },
+    ]
+
+    all_passed = True
+    for i, test_case in enumerate(test_cases, 1):
+        result = extract_video_url_from_page(test_case["page"])
+        if result == test_case["expected"]:
+            print(f"✅ 测试用例 {i} 通过：{test_case['name']}")
+        else:
+            print(f"❌ 测试用例 {i} 失败：{test_case['name']}")
+            print(f"   期望: {test_case['expected']}")
+            print(f"   实际: {result}")
+            all_passed = False
+
+    return all_passed
+
+def test_linear_time():
+    """
+    测试回溯压力页面：大量拼接的https://片段应在线性时间内处理完
+    """
+    print("\n" + "="*60)
+    print("测试2: 回溯压力页面")
+    print("="*60)
+
+    page = "<p>" + "https://cdn.example.com/a?" * 20000 + "</p>"
+    start = time.perf_counter()
+    result = extract_video_url_from_page(page)
+    elapsed = time.perf_counter() - start
+    passed = result is None and elapsed < 1.0
+    print(f"{'✅' if passed else '❌'} {len(page) // 1024}KB 页面耗时 {elapsed * 1000:.1f}ms")
+    return passed
+
+def main():
+    """
+    主函数
+    """
+    results = [
+        ("视频地址提取", test_extract_video_url()),
+        ("回溯压力页面", test_linear_time()),
+    ]
+
+    print("\n" + "="*60)
+    print("测试报告")
+    print("="*60)
+    for test_name, passed in results:
+        print(f"{test_name}: {'✅ 通过' if passed else '❌ 失败'}")
+
+    return 0 if all(passed for _, passed in results) else 1
+
+if __name__ == "__main__":
+    exit(main())
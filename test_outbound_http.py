@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+出站HTTP层测试
+使用本地HTTP服务验证连接复用统计、DNS缓存与单主机并发上限
+"""
+
+import sys
+import os
+import time
+import asyncio
+import threading
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import OutboundHttp
+
+class SlowHandler(BaseHTTPRequestHandler):
+    """
+    keep-alive 服务：每个请求停顿一小段时间，并记录同时处理的最大请求数
+    """
+    protocol_version = "HTTP/1.1"
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        with self.lock:
+            SlowHandler.active += 1
+            SlowHandler.peak = max(SlowHandler.peak, SlowHandler.active)
+        time.sleep(0.05)
+        with self.lock:
+            SlowHandler.active -= 1
+        body = b"ok"
+        try:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 客户端已取消请求
+
+def start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def test_reuse_and_dns():
+    """
+    测试顺序请求复用同一连接、域名只解析一次
+    """
+    print("\n" + "="*60)
+    print("测试1: 连接复用与DNS缓存")
+    print("="*60)
+
+    server = start_server()
+    url = f"http://localhost:{server.server_address[1]}/"
+    layer = OutboundHttp(max_per_host=4, dns_ttl=60, http2=False)
+    client = layer.client("test")
+    statuses = [client.get(url).status_code for _ in range(5)]
+
+    async def run_async():
+        aclient = layer.async_client("test-async")
+        responses = [await aclient.get(url) for _ in range(3)]
+        await layer.aclose()
+        return [r.status_code for r in responses]
+
+    async_statuses = asyncio.run(run_async())
+    layer.close()
+    server.shutdown()
+
+    snapshot = layer.snapshot()
+    host = snapshot["hosts"]["localhost"]
+    checks = [
+        ("请求全部成功", statuses == [200] * 5 and async_statuses == [200] * 3),
+        ("同步与异步客户端各只建一个连接", host["requests"] == 8 and host["connections"] == 2),
+        ("复用率统计", host["reuse_ratio"] == 0.75),
+        ("域名只解析一次", snapshot["dns"]["misses"] == 1 and snapshot["dns"]["hits"] == 1),
+        ("记录耗时", host["p50_ms"] is not None and host["in_flight"] == 0),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def test_per_host_cap():
+    """
+    测试同一主机的并发请求不超过上限
+    """
+    print("\n" + "="*60)
+    print("测试2: 单主机并发上限")
+    print("="*60)
+
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    layer = OutboundHttp(max_per_host=2, dns_ttl=60, http2=False)
+    client = layer.client("test")
+    SlowHandler.peak = 0
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = list(pool.map(lambda _: client.get(url).status_code, range(8)))
+    layer.close()
+    server.shutdown()
+
+    checks = [
+        ("请求全部成功", statuses == [200] * 8),
+        ("并发不超过上限", SlowHandler.peak == 2),
+        ("IP地址不经过DNS缓存", layer.snapshot()["dns"]["misses"] == 0),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def test_cancelled_requests_release_slots():
+    """
+    测试请求在等待响应时被取消后归还主机并发名额，后续请求不会被卡住
+    """
+    print("\n" + "="*60)
+    print("测试3: 取消请求归还名额")
+    print("="*60)
+
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    layer = OutboundHttp(max_per_host=2, dns_ttl=60, http2=False)
+
+    async def run():
+        client = layer.async_client("test-cancel")
+        for _ in range(4):
+            task = asyncio.ensure_future(client.get(url))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        response = await asyncio.wait_for(client.get(url), timeout=2)
+        host = layer.snapshot()["hosts"]["127.0.0.1"]
+        await layer.aclose()
+        return response.status_code, host
+
+    try:
+        status, host = asyncio.run(run())
+    except asyncio.TimeoutError:
+        status, host = None, {}
+    server.shutdown()
+
+    checks = [
+        ("取消后的请求仍可完成", status == 200),
+        ("没有残留的进行中请求", host.get("in_flight") == 0),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def test_slot_wait_timeout():
+    """
+    测试主机并发名额被占满时，等待名额受连接池超时限制并抛出PoolTimeout，
+    且错误类型与httpx自身的异常映射一致
+    """
+    print("\n" + "="*60)
+    print("测试4: 等待名额超时")
+    print("="*60)
+
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    layer = OutboundHttp(max_per_host=1, dns_ttl=60, http2=False)
+    timeout = httpx.Timeout(5, pool=0.2)
+
+    def wait_for_slot(client):
+        start = time.monotonic()
+        try:
+            client.get(url, timeout=timeout)
+            return None, time.monotonic() - start
+        except httpx.PoolTimeout:
+            return "PoolTimeout", time.monotonic() - start
+
+    client = layer.client("test-timeout")
+    with client.stream("GET", url):
+        sync_result, sync_waited = wait_for_slot(client)
+
+    async def run_async():
+        async_client = layer.async_client("test-timeout")
+        async with async_client.stream("GET", url):
+            start = time.monotonic()
+            try:
+                await async_client.get(url, timeout=timeout)
+                result = None
+            except httpx.PoolTimeout:
+                result = "PoolTimeout"
+        waited = time.monotonic() - start
+        await layer.aclose()
+        return result, waited
+
+    async_result, async_waited = asyncio.run(run_async())
+    after = client.get(url).status_code
+    try:
+        layer.client("test-refused").get("http://127.0.0.1:1/", timeout=2)
+        refused = None
+    except httpx.ConnectError:
+        refused = "ConnectError"
+    layer.close()
+    server.shutdown()
+
+    checks = [
+        ("同步请求等待超时", sync_result == "PoolTimeout" and sync_waited < 1),
+        ("异步请求等待超时", async_result == "PoolTimeout" and async_waited < 1),
+        ("名额释放后请求正常", after == 200),
+        ("连接失败映射为httpx.ConnectError", refused == "ConnectError"),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def main():
+    """
+    主函数
+    """
+    results = [
+        ("连接复用与DNS缓存", test_reuse_and_dns()),
+        ("单主机并发上限", test_per_host_cap()),
+        ("取消请求归还名额", test_cancelled_requests_release_slots()),
+        ("等待名额超时", test_slot_wait_timeout()),
+    ]
+
+    print("\n" + "="*60)
+    print("测试报告")
+    print("="*60)
+    for test_name, passed in results:
+        print(f"{test_name}: {'✅ 通过' if passed else '❌ 失败'}")
+
+    return 0 if all(passed for _, passed in results) else 1
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+PCM解码缓冲区测试
+用Python子进程代替ffmpeg输出f32le数据，验证预分配缓冲区扩容、内存映射缓冲区、
+标准输入喂数据、时长上限、解码失败，以及下载流经管道解码的完整路径
+"""
+
+import sys
+import os
+import stat
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+from asr_worker import run_ffmpeg_pcm, too_long_error, AudioDecodeError
+
+SAMPLES = np.linspace(-1, 1, 5 * 16000 + 123, dtype=np.float32)
+
+def emitter(samples):
+    """
+    代替ffmpeg的命令：把给定样本以f32le写到标准输出
+    """
+    return [sys.executable, "-c",
+            f"import sys, numpy as np; sys.stdout.buffer.write(np.linspace(-1, 1, {len(samples)}, dtype=np.float32).tobytes())"]
+
+# 把标准输入原样写到标准输出
+ECHO = [sys.executable, "-c", "import sys, shutil; shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer)"]
+
+def test_buffers():
+    """
+    测试预分配不足时扩容、内存映射缓冲区与标准输入喂数据
+    """
+    print("\n" + "="*60)
+    print("测试1: 解码缓冲区")
+    print("="*60)
+
+    grown = run_ffmpeg_pcm(emitter(SAMPLES), capacity=16000)
+    exact = run_ffmpeg_pcm(emitter(SAMPLES), capacity=len(SAMPLES) + 16000)
+    with tempfile.TemporaryDirectory() as tmp:
+        mapped = run_ffmpeg_pcm(emitter(SAMPLES), capacity=16000, memmap_dir=tmp)
+        mapped_ok = isinstance(mapped.base, np.memmap) or isinstance(mapped, np.memmap)
+        mapped_equal = np.array_equal(mapped, SAMPLES)
+        leftover = os.listdir(tmp)
+        del mapped
+    data = SAMPLES.tobytes()
+    piped = run_ffmpeg_pcm(ECHO, (data[i:i + 65536] for i in range(0, len(data), 65536)))
+
+    checks = [
+        ("预分配不足时扩容", np.array_equal(grown, SAMPLES)),
+        ("预分配充足时一次读完", np.array_equal(exact, SAMPLES)),
+        ("内存映射缓冲区", mapped_ok and mapped_equal),
+        ("内存映射文件不留在磁盘上", leftover == []),
+        ("标准输入喂数据", np.array_equal(piped, SAMPLES)),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def test_errors():
+    """
+    测试超出时长上限时终止解码、解码进程失败时返回错误信息
+    """
+    print("\n" + "="*60)
+    print("测试2: 时长上限与解码失败")
+    print("="*60)
+
+    try:
+        run_ffmpeg_pcm(emitter(SAMPLES), max_seconds=3)
+        too_long = None
+    except ValueError as e:
+        too_long = str(e)
+
+    failing = [sys.executable, "-c", "import sys; sys.stderr.write('moov atom not found'); sys.exit(1)"]
+    try:
+        run_ffmpeg_pcm(failing)
+        failed = None
+    except AudioDecodeError as e:
+        failed = str(e)
+
+    checks = [
+        ("超出时长上限被拒绝", too_long == "视频时长过长，请上传3秒以内的视频"),
+        ("提示中的时长与上限一致", str(too_long_error(1200)) == "视频时长过长，请上传20分钟以内的视频"),
+        ("解码失败带出错误信息", failed == "moov atom not found"),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+class PcmHandler(BaseHTTPRequestHandler):
+    """
+    以小块分段返回f32le样本的HTTP服务（不带Content-Length）
+    """
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        data = SAMPLES.tobytes()
+        self.send_response(200)
+        self.end_headers()
+        for i in range(0, len(data), 4096):
+            self.wfile.write(data[i:i + 4096])
+            self.wfile.flush()
+
+def test_stream_video_audio():
+    """
+    测试stream_video_audio把下载的分块经run_ffmpeg_pcm的标准输入喂给解码进程
+    """
+    print("\n" + "="*60)
+    print("测试3: 下载流式解码")
+    print("="*60)
+
+    import app
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PcmHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    live = f"127.0.0.1:{server.server_address[1]}"
+    # 把本地服务与一个已关闭的端口当作两个镜像：首选镜像连不上时应改用下一个
+    closed = ThreadingHTTPServer(("127.0.0.1", 0), PcmHandler)
+    dead = f"127.0.0.1:{closed.server_address[1]}"
+    closed.server_close()
+    url = f"http://{dead}/video.mp4"
+    mirrors = app.MirrorSelector([dead, live], alpha=0.5, race_delay=0.1, max_failures=2,
+                                 cooldown=60, reference_bytes=1024 * 1024)
+
+    original = app.FFMPEG_BIN, app.cdn_mirrors
+    with tempfile.TemporaryDirectory() as tmp:
+        # 代替ffmpeg的可执行文件：忽略参数，把标准输入原样写到标准输出
+        fake_ffmpeg = os.path.join(tmp, "ffmpeg")
+        with open(fake_ffmpeg, "w") as f:
+            f.write(f"#!{sys.executable}\n"
+                    "import sys, shutil\n"
+                    "shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer)\n")
+        os.chmod(fake_ffmpeg, os.stat(fake_ffmpeg).st_mode | stat.S_IEXEC)
+        app.FFMPEG_BIN, app.cdn_mirrors = fake_ffmpeg, mirrors
+        try:
+            samples, duration = app.stream_video_audio(url)
+        finally:
+            app.FFMPEG_BIN, app.cdn_mirrors = original
+            server.shutdown()
+
+    snapshot = mirrors.snapshot()
+    checks = [
+        ("分块下载的样本完整解码", np.array_equal(samples, SAMPLES)),
+        ("时长按采样率计算", abs(duration - len(SAMPLES) / 16000) < 1e-6),
+        ("连不上的镜像记为失败", snapshot["mirrors"][dead]["consecutive_failures"] == 1),
+        ("改用下一个镜像", snapshot["failovers"] == 1),
+        ("记录镜像的首字节时间与吞吐", snapshot["mirrors"][live]["ttfb_ms"] is not None
+                                     and snapshot["mirrors"][live]["throughput_mbps"] is not None),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def main():
+    """
+    主函数
+    """
+    results = [
+        ("解码缓冲区", test_buffers()),
+        ("时长上限与解码失败", test_errors()),
+        ("下载流式解码", test_stream_video_audio()),
+    ]
+
+    print("\n" + "="*60)
+    print("测试报告")
+    print("="*60)
+    for test_name, passed in results:
+        print(f"{test_name}: {'✅ 通过' if passed else '❌ 失败'}")
+
+    return 0 if all(passed for _, passed in results) else 1
+
+if __name__ == "__main__":
+    exit(main())
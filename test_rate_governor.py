@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Coze限流器测试
+验证排队已满时拒绝、429后减半，以及排队中被取消的调用不会破坏名额计数
+"""
+
+import sys
+import os
+import asyncio
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import AdaptiveRateGovernor, CozeOverloadedError
+
+def make_governor(max_queue=4):
+    return AdaptiveRateGovernor(rate=1000, burst=1000, initial_limit=1, max_limit=8,
+                                max_queue=max_queue, latency_target=5)
+
+def test_queue_and_backoff():
+    """
+    测试超出并发上限时排队、排队已满时立即拒绝、429后并发上限与速率减半
+    """
+    print("\n" + "="*60)
+    print("测试1: 排队与退避")
+    print("="*60)
+
+    governor = make_governor(max_queue=1)
+
+    async def run():
+        await governor.acquire()
+        queued = asyncio.ensure_future(governor.acquire())
+        await asyncio.sleep(0)
+        try:
+            await governor.acquire()
+            rejected = False
+        except CozeOverloadedError:
+            rejected = True
+        governor.release(latency=0.1)
+        await queued
+        governor.limit = 4
+        governor.release(throttled=True)
+        return rejected
+
+    rejected = asyncio.run(run())
+    checks = [
+        ("排队已满时拒绝", rejected and governor.stats["rejected"] == 1),
+        ("排队的调用获得名额", governor.stats["admitted"] == 2),
+        ("429后上限与速率减半", governor.limit == 2 and governor.rate == 500),
+        ("名额全部归还", governor.in_flight == 0),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def test_cancel_while_queued():
+    """
+    测试排队中的调用被取消、且在其恢复前release()已跳过它时，仍抛出CancelledError且名额正确
+    """
+    print("\n" + "="*60)
+    print("测试2: 排队中取消")
+    print("="*60)
+
+    governor = make_governor()
+
+    async def run():
+        await governor.acquire()
+        waiting = asyncio.ensure_future(governor.acquire())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        governor.release(latency=0.1)  # _wake() 弹出已取消的等待者
+        try:
+            await waiting
+            outcome = "acquired"
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+        except Exception as e:
+            outcome = type(e).__name__
+        await asyncio.wait_for(governor.acquire(), timeout=1)
+        governor.release(latency=0.1)
+        return outcome
+
+    outcome = asyncio.run(run())
+    checks = [
+        ("取消以CancelledError结束", outcome == "cancelled"),
+        ("名额与队列计数正确", governor.in_flight == 0 and not governor._waiters),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def main():
+    """
+    主函数
+    """
+    results = [
+        ("排队与退避", test_queue_and_backoff()),
+        ("排队中取消", test_cancel_while_queued()),
+    ]
+
+    print("\n" + "="*60)
+    print("测试报告")
+    print("="*60)
+    for test_name, passed in results:
+        print(f"{test_name}: {'✅ 通过' if passed else '❌ 失败'}")
+
+    return 0 if all(passed for _, passed in results) else 1
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+临时文件空间测试
+验证请求作用域清理、字节配额下的LRU淘汰、调试页面环形缓冲与启动时只清理已退出进程的残留
+"""
+
+import sys
+import os
+import tempfile
+import subprocess
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import ScratchSpace
+
+def write(space, path, size):
+    with open(path, "w") as f:
+        f.write("x" * size)
+    space.commit(path)
+
+def dead_pid():
+    """
+    一个已经退出的进程号
+    """
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+def test_scope_and_quota():
+    """
+    测试作用域内文件被固定不淘汰、超出配额时淘汰最久未用的文件、离开作用域后清理
+    """
+    print("\n" + "="*60)
+    print("测试1: 作用域与配额")
+    print("="*60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        space = ScratchSpace(tmp, quota_bytes=2500, debug_capture=False, debug_items=1)
+        old = space.allocate("old")
+        write(space, old, 800)
+        with space.scope() as scope:
+            video = scope.path("video", ".mp4")
+            write(space, video, 2000)
+            in_scope = os.path.exists(video)
+            evicted = not os.path.exists(old)
+        checks = [
+            ("作用域内文件被固定", in_scope),
+            ("超出配额淘汰最久未用文件", evicted and space.stats["evicted_files"] == 1),
+            ("离开作用域后清理", not os.path.exists(video)),
+            ("字节计数归零", space.snapshot()["bytes"] == 0),
+        ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def test_debug_ring_and_startup():
+    """
+    测试调试页面仅保留最近N份、默认不保存，以及启动时只清理已退出进程的残留，不动运行中进程的文件
+    """
+    print("\n" + "="*60)
+    print("测试2: 调试缓冲与启动清理")
+    print("="*60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        leftover = os.path.join(tmp, "xiaohongshu_debug_" + "a" * 32 + ".html")
+        foreign = os.path.join(tmp, "notes.txt")
+        dead_dir = os.path.join(tmp, str(dead_pid()))
+        sibling_dir = os.path.join(tmp, str(os.getppid()))
+        os.makedirs(dead_dir)
+        os.makedirs(sibling_dir)
+        sibling_file = os.path.join(sibling_dir, "audio_" + "b" * 32 + ".f32")
+        for path in (leftover, foreign, os.path.join(dead_dir, "x"), sibling_file):
+            with open(path, "w") as f:
+                f.write("x")
+        os.utime(leftover, (time.time() - 60, time.time() - 60))
+
+        disabled = ScratchSpace(tmp, quota_bytes=10 ** 6, debug_capture=False, debug_items=2)
+        untouched_before_start = os.path.exists(leftover) and os.path.exists(dead_dir)
+        disabled.start()
+        checks = [
+            ("导入时不清理", untouched_before_start),
+            ("启动时清理残留", not os.path.exists(leftover)),
+            ("清理已退出进程的目录", not os.path.exists(dead_dir)),
+            ("不删除运行中进程的文件", os.path.exists(sibling_file)),
+            ("不删除其他文件", os.path.exists(foreign)),
+            ("文件写入本进程目录", os.path.dirname(disabled.allocate("x")) == os.path.join(tmp, str(os.getpid()))),
+            ("默认不保存调试页面", disabled.capture_debug("page", ".html", "p") is None),
+        ]
+
+        space = ScratchSpace(tmp, quota_bytes=10 ** 6, debug_capture=True, debug_items=2)
+        paths = [space.capture_debug("page", ".html", "p" * 100) for _ in range(4)]
+        checks.append(("只保留最近2份", [os.path.exists(p) for p in paths] == [False, False, True, True]))
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def main():
+    """
+    主函数
+    """
+    results = [
+        ("作用域与配额", test_scope_and_quota()),
+        ("调试缓冲与启动清理", test_debug_ring_and_startup()),
+    ]
+
+    print("\n" + "="*60)
+    print("测试报告")
+    print("="*60)
+    for test_name, passed in results:
+        print(f"{test_name}: {'✅ 通过' if passed else '❌ 失败'}")
+
+    return 0 if all(passed for _, passed in results) else 1
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Coze SSE 解析器测试
+验证增量解码、多行data、事件类型与错误事件
+"""
+
+import sys
+import os
+import asyncio
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import SSEDecoder, collect_coze_output
+
+STREAM = (
+    "id: 0\r\n"
+    "event: Message\r\n"
+    'data: {"content": "大家好，", "node_title": "语音识别"}\r\n'
+    "\r\n"
+    ": keep-alive\n"
+    "\n"
+    "event: Message\n"
+    "data: 第一行\n"
+    "data: 第二行\n"
+    "\n"
+    "event: Done\n"
+    'data: {"output": "完整的口播文案"}'
+).encode("utf-8")
+
+
+class FakeResponse:
+    """模拟 httpx 流式响应，按固定大小切块"""
+
+    def __init__(self, body: bytes, chunk_size: int):
+        self.body = body
+        self.chunk_size = chunk_size
+
+    async def aiter_bytes(self):
+        for i in range(0, len(self.body), self.chunk_size):
+            yield self.body[i:i + self.chunk_size]
+
+
+def test_incremental_decoding():
+    """
+    测试任意切块（包括切断UTF-8字符）时解码结果一致
+    """
+    print("\n" + "="*60)
+    print("测试1: 增量解码")
+    print("="*60)
+
+    all_passed = True
+    for chunk_size in (1, 2, 7, 64, len(STREAM)):
+        decoder = SSEDecoder()
+        events = []
+        for i in range(0, len(STREAM), chunk_size):
+            events.extend(decoder.feed(STREAM[i:i + chunk_size]))
+        events.extend(decoder.flush())
+
+        summary = [(e.event, e.data) for e in events]
+        expected = [
+            ("Message", '{"content": "大家好，", "node_title": "语音识别"}'),
+            ("Message", "第一行\n第二行"),
+            ("Done", '{"output": "完整的口播文案"}'),
+        ]
+        if summary == expected and events[0].id == "0":
+            print(f"✅ 块大小 {chunk_size} 通过")
+        else:
+            print(f"❌ 块大小 {chunk_size} 失败：{summary}")
+            all_passed = False
+
+    return all_passed
+
+
+def test_collect_output():
+    """
+    测试最终输出提取、增量拼接与错误事件
+    """
+    print("\n" + "="*60)
+    print("测试2: 输出提取")
+    print("="*60)
+
+    deltas = (
+        'event: Message\ndata: {"content": "你好"}\n\n'
+        'event: Message\ndata: {"content": "世界"}\n\n'
+        'event: Done\ndata: {}\n\n'
+    ).encode("utf-8")
+    error = (
+        'event: Error\ndata: {"error_code": 4000, "error_message": "invalid input"}\n\n'
+    ).encode("utf-8")
+
+    async def run():
+        results = [
+            ("最终output优先", await collect_coze_output(FakeResponse(STREAM, 5)) == "完整的口播文案"),
+            ("增量内容拼接", await collect_coze_output(FakeResponse(deltas, 3)) == "你好世界"),
+        ]
+        try:
+            await collect_coze_output(FakeResponse(error, 16))
+            results.append(("错误事件抛出异常", False))
+        except Exception as e:
+            results.append(("错误事件抛出异常", "invalid input" in str(e)))
+        return results
+
+    all_passed = True
+    for name, passed in asyncio.run(run()):
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+
+    return all_passed
+
+
+def main():
+    """
+    主函数
+    """
+    results = [
+        ("增量解码", test_incremental_decoding()),
+        ("输出提取", test_collect_output()),
+    ]
+
+    print("\n" + "="*60)
+    print("测试报告")
+    print("="*60)
+    for test_name, passed in results:
+        print(f"{test_name}: {'✅ 通过' if passed else '❌ 失败'}")
+
+    return 0 if all(passed for _, passed in results) else 1
+
+if __name__ == "__main__":
+    exit(main())
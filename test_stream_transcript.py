@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+流式转写测试
+验证流式请求与普通请求共享同一次Coze调用、首包前失败时的重试回退，
+以及Coze不可用时链接提取与流式提取都回退到本地语音识别
+"""
+
+import sys
+import os
+import json
+import asyncio
+import tempfile
+import httpx
+from contextlib import contextmanager
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app
+from app import PersistentLRUCache
+
+URL = "https://www.xiaohongshu.com/explore/685366cc0000000011003ee8"
+
+
+async def collect(agen):
+    return [item async for item in agen]
+
+
+@contextmanager
+def patched_app(**attrs):
+    """临时替换app模块属性，并使用临时转写缓存"""
+    attrs.setdefault("COZE_API_TOKEN", app.COZE_API_TOKEN or "test-token")
+    with tempfile.TemporaryDirectory() as tmp:
+        attrs["transcript_cache"] = PersistentLRUCache(
+            os.path.join(tmp, "transcripts.sqlite3"), "transcripts",
+            ttl=60, memory_items=4, disk_items=4,
+        )
+        original = {name: getattr(app, name) for name in attrs}
+        for name, value in attrs.items():
+            setattr(app, name, value)
+        try:
+            yield
+        finally:
+            for name, value in original.items():
+                setattr(app, name, value)
+
+
+def test_shared_flight():
+    """
+    测试并发的流式与普通请求只触发一次Coze调用，且都拿到最终文案
+    """
+    print("\n" + "="*60)
+    print("测试1: 共享在途调用")
+    print("="*60)
+
+    calls = []
+
+    async def fake_attempt(xhs_url, on_delta):
+        calls.append(xhs_url)
+        for text in ("大家好，", "今天分享"):
+            on_delta(text)
+            await asyncio.sleep(0.01)
+        return "大家好，今天分享"
+
+    async def scenario():
+        leader = asyncio.ensure_future(collect(app.stream_transcript(URL)))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(collect(app.stream_transcript(URL)))
+        plain = asyncio.ensure_future(app.get_transcript(URL))
+        return await leader, await follower, await plain
+
+    with patched_app(_coze_streamed_attempt=fake_attempt):
+        leader, follower, plain = asyncio.run(scenario())
+        cached = asyncio.run(collect(app.stream_transcript(URL)))
+
+    checks = [
+        ("只调用一次Coze", len(calls) == 1),
+        ("发起者收到增量", leader == [("delta", "大家好，"), ("delta", "今天分享"),
+                                 ("final", "大家好，今天分享")]),
+        ("跟随者收到最终文案", follower[-1] == ("final", "大家好，今天分享")),
+        ("普通请求共享结果", plain == ("大家好，今天分享", False)),
+        ("结果写入缓存", cached == [("cached", "大家好，今天分享")]),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+
+def test_fallback_before_output():
+    """
+    测试首包前的临时性错误回退到带重试的extract_transcript_via_coze，
+    已输出增量后的错误则直接抛出
+    """
+    print("\n" + "="*60)
+    print("测试2: 首包前失败回退")
+    print("="*60)
+
+    request = httpx.Request("POST", "https://api.coze.cn/v1/workflow/stream_run")
+    fallback_calls = []
+
+    async def failing_attempt(xhs_url, on_delta):
+        raise httpx.ConnectError("connection refused", request=request)
+
+    async def partial_attempt(xhs_url, on_delta):
+        on_delta("大家好，")
+        raise httpx.ReadError("connection reset", request=request)
+
+    async def fake_extract(xhs_url):
+        fallback_calls.append(xhs_url)
+        return "重试得到的文案"
+
+    async def run_partial():
+        events = []
+        try:
+            async for event in app.stream_transcript(URL, use_cache=False):
+                events.append(event)
+        except httpx.ReadError:
+            return events, True
+        return events, False
+
+    with patched_app(extract_transcript_via_coze=fake_extract,
+                     _coze_streamed_attempt=failing_attempt):
+        retried = asyncio.run(collect(app.stream_transcript(URL)))
+
+        app._coze_streamed_attempt = partial_attempt
+        partial, raised = asyncio.run(run_partial())
+
+    checks = [
+        ("首包前失败走重试路径", retried == [("final", "重试得到的文案")]),
+        ("回退只调用一次", len(fallback_calls) == 1),
+        ("输出增量后失败直接抛出", raised and partial == [("delta", "大家好，")]),
+        ("不重复回退", len(fallback_calls) == 1),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+
+def test_local_asr_fallback():
+    """
+    测试开启ASR_URL_FALLBACK后，Coze不可用时改用本地Whisper转写视频
+    """
+    print("\n" + "="*60)
+    print("测试3: 本地识别回退")
+    print("="*60)
+
+    transcribed = []
+
+    async def unavailable(xhs_url, use_cache=True):
+        raise app.UpstreamUnavailableError("Coze API is temporarily unavailable")
+
+    async def fake_transcribe(video_url):
+        transcribed.append(video_url)
+        return "大家好，今天给大家分享一个收纳小技巧。" * 3, 30.0, []
+
+    def run():
+        return asyncio.run(app.run_extraction(URL, include_note_info=False))
+
+    video_url = "https://sns-video-bd.xhscdn.com/stream/abc.mp4"
+    with patched_app(get_transcript=unavailable, transcribe_video_url=fake_transcribe,
+                     parse_xiaohongshu_url=lambda url: video_url):
+        app.ASR_URL_FALLBACK = False
+        try:
+            run()
+            disabled_raises = False
+        except app.UpstreamUnavailableError:
+            disabled_raises = transcribed == []
+
+        app.ASR_URL_FALLBACK = True
+        result = run()
+    app.ASR_URL_FALLBACK = False
+
+    checks = [
+        ("未开启时仍返回不可用", disabled_raises),
+        ("开启后转写笔记视频", transcribed == [video_url]),
+        ("结果标注本地识别来源", result["data"]["video_info"]["source"] == "local_whisper"),
+        ("返回识别文案", "收纳小技巧" in result["data"]["script"]),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+
+def test_stream_asr_fallback():
+    """
+    测试/api/extract-stream与普通提取共用本地识别回退，并按音频时长校验文案
+    """
+    print("\n" + "="*60)
+    print("测试4: 流式提取的本地识别回退")
+    print("="*60)
+
+    validated = []
+    validate = app.validate_extracted_content
+
+    async def unavailable(xhs_url, use_cache=True):
+        raise app.UpstreamUnavailableError("Coze API is temporarily unavailable")
+        yield
+
+    async def fake_transcribe(video_url):
+        return "大家好，今天给大家分享一个收纳小技巧。" * 3, 30.0, []
+
+    async def no_note_info(xhs_url):
+        return {}
+
+    def recording_validate(text, audio_duration=None):
+        validated.append(audio_duration)
+        return validate(text, audio_duration)
+
+    async def run():
+        response = await app.extract_stream({"url": URL})
+        return [chunk async for chunk in response.body_iterator]
+
+    def result_event(chunks):
+        for chunk in chunks:
+            text = chunk.decode() if isinstance(chunk, bytes) else chunk
+            if text.startswith("event: result"):
+                return json.loads(text.split("data: ", 1)[1])
+        return None
+
+    with patched_app(stream_transcript=unavailable, transcribe_video_url=fake_transcribe,
+                     parse_xiaohongshu_url=lambda url: "https://sns-video-bd.xhscdn.com/stream/abc.mp4",
+                     fetch_note_info=no_note_info, validate_extracted_content=recording_validate):
+        app.ASR_URL_FALLBACK = False
+        disabled = asyncio.run(run())
+        app.ASR_URL_FALLBACK = True
+        result = result_event(asyncio.run(run()))
+    app.ASR_URL_FALLBACK = False
+
+    checks = [
+        ("未开启时返回错误事件", result_event(disabled) is None
+                                and any("event: error" in str(chunk) for chunk in disabled)),
+        ("开启后返回识别结果", result is not None and "收纳小技巧" in result["data"]["script"]),
+        ("结果标注本地识别来源", result is not None
+                                and result["data"]["video_info"]["source"] == "local_whisper"),
+        ("校验带上音频时长", validated == [30.0]),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def main():
+    """
+    主函数
+    """
+    results = [
+        ("共享在途调用", test_shared_flight()),
+        ("首包前失败回退", test_fallback_before_output()),
+        ("本地识别回退", test_local_asr_fallback()),
+        ("流式提取的本地识别回退", test_stream_asr_fallback()),
+    ]
+
+    print("\n" + "="*60)
+    print("测试报告")
+    print("="*60)
+    for test_name, passed in results:
+        print(f"{test_name}: {'✅ 通过' if passed else '❌ 失败'}")
+
+    return 0 if all(passed for _, passed in results) else 1
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+视频上传写入测试
+验证边接收边解析multipart请求体、SHA-256、文件头识别、接收中的大小上限、
+按Content-Length与实际接收字节提前拒绝，以及上传任务在建立前失败时不遗留文件
+"""
+
+import sys
+import os
+import asyncio
+import hashlib
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from starlette.requests import ClientDisconnect, Request
+
+import app
+from app import receive_video_upload, sniff_video_container, UploadSizeLimitMiddleware
+
+MP4_HEAD = b"\x00\x00\x00\x20ftypisom\x00\x00\x02\x00"
+BOUNDARY = "----xhs-upload-test"
+PIECE = 64 * 1024
+
+def multipart_body(data, filename="video.mp4", content_type="video/mp4", fields=None):
+    """
+    构造multipart/form-data请求体：可选的普通字段加一个视频文件字段
+    """
+    parts = [
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        for name, value in (fields or {}).items()
+    ]
+    parts.append(
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n".encode() + data + b"\r\n"
+    )
+    parts.append(f"--{BOUNDARY}--\r\n".encode())
+    return b"".join(parts)
+
+class FakeClient:
+    """
+    按固定大小分段发送请求体的ASGI客户端，可在第N段后模拟断开
+    """
+    def __init__(self, body, disconnect_after=None, on_receive=None):
+        self.pieces = [body[i:i + PIECE] for i in range(0, len(body), PIECE)]
+        self.disconnect_after = disconnect_after
+        self.on_receive = on_receive
+        self.sent = 0
+
+    def request(self):
+        headers = [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]
+        return Request({"type": "http", "method": "POST", "path": "/", "headers": headers}, self.receive)
+
+    async def receive(self):
+        if self.on_receive:
+            self.on_receive(self.sent)
+        if self.disconnect_after is not None and self.sent >= self.disconnect_after:
+            return {"type": "http.disconnect"}
+        piece = self.pieces[self.sent]
+        self.sent += 1
+        return {"type": "http.request", "body": piece, "more_body": self.sent < len(self.pieces)}
+
+def save(body):
+    """
+    调用receive_video_upload，返回 (结果或HTTP状态码, 已发送分段数, 写入内容或残留文件,
+    发送最后一段前磁盘上已写入的字节数)
+    """
+    written_before_end = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "video")
+
+        def on_receive(sent):
+            if sent == len(client.pieces) - 1 and os.path.exists(path + ".mp4"):
+                written_before_end.append(os.path.getsize(path + ".mp4"))
+
+        client = FakeClient(body, on_receive=on_receive)
+        try:
+            upload = asyncio.run(receive_video_upload(client.request(), lambda ext: path + ext))
+            with open(upload.path, "rb") as f:
+                written = f.read()
+            return upload, client.sent, written, sum(written_before_end)
+        except HTTPException as e:
+            return e.status_code, client.sent, os.listdir(tmp), sum(written_before_end)
+
+def test_streamed_save():
+    """
+    测试请求体边到达边写入磁盘、哈希与表单字段、文件类型与文件头识别、大小上限
+    """
+    print("\n" + "="*60)
+    print("测试1: 边接收边写入")
+    print("="*60)
+
+    data = MP4_HEAD + os.urandom(3 * 1024 * 1024)
+    body = multipart_body(data, fields={"idempotency_key": "abc"})
+    upload, _, written, written_before_end = save(body)
+    not_video, _, not_video_left, _ = save(multipart_body(b"<html>" + b"x" * 5000))
+    wrong_type, _, _, _ = save(multipart_body(data, content_type="text/plain"))
+    too_small, _, _, _ = save(multipart_body(MP4_HEAD))
+
+    limit = app.UPLOAD_MAX_BYTES
+    app.UPLOAD_MAX_BYTES = 1024 * 1024
+    try:
+        too_large, sent_before_reject, too_large_left, _ = save(body)
+    finally:
+        app.UPLOAD_MAX_BYTES = limit
+
+    checks = [
+        ("内容完整写入", written == data and upload.size == len(data)),
+        ("请求体结束前已写入磁盘", written_before_end >= len(data) - 2 * app.UPLOAD_CHUNK_KB * 1024),
+        ("同时计算SHA-256", upload.sha256 == hashlib.sha256(data).hexdigest()),
+        ("保留文件名与其他字段", upload.filename == "video.mp4" and upload.fields == {"idempotency_key": "abc"}),
+        ("识别常见容器格式", [sniff_video_container(h) for h in (
+            MP4_HEAD, b"\x1a\x45\xdf\xa3\x01", b"RIFF\x00\x00\x00\x00AVI LIST", b"FLV\x01",
+        )] == ["mp4", "mkv", "avi", "flv"]),
+        ("非视频内容被拒绝且不留文件", not_video == 400 and not_video_left == []),
+        ("非视频类型被拒绝", wrong_type == 400),
+        ("过小文件被拒绝", too_small == 400),
+        ("超过上限时接收中即拒绝", too_large == 413 and too_large_left == []
+         and sent_before_reject <= app.UPLOAD_MAX_BYTES // PIECE + 2),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def test_content_length_rejection():
+    """
+    测试声明长度超限的上传在读取请求体前即返回413，未声明长度（分块传输）的上传按实际接收字节拒绝，
+    其他路径不受影响
+    """
+    print("\n" + "="*60)
+    print("测试2: 按Content-Length与接收字节提前拒绝")
+    print("="*60)
+
+    reached = []
+
+    async def inner(scope, receive, send):
+        reached.append(scope["path"])
+        status = 200
+        try:
+            while (await receive()).get("more_body"):
+                pass
+        except HTTPException as e:  # FastAPI会把它转换为对应状态码的响应
+            status = e.status_code
+        await send({"type": "http.response.start", "status": status, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    limited = UploadSizeLimitMiddleware(inner, paths=["/api/upload-video"], max_bytes=1000)
+    client = TestClient(limited)
+    body = b"x" * (1000 + UploadSizeLimitMiddleware.OVERHEAD_BYTES + 1)
+    rejected = client.post("/api/upload-video", content=body)
+    other = client.post("/api/rewrite-script", content=body)
+    small = client.post("/api/upload-video", content=b"x" * 100)
+    chunked = client.post("/api/upload-video", content=(body[i:i + 4096] for i in range(0, len(body), 4096)))
+
+    checks = [
+        ("超限上传返回413", rejected.status_code == 413),
+        ("其他路径不受影响", other.status_code == 200),
+        ("未超限上传正常通过", small.status_code == 200 and reached[:2] == ["/api/rewrite-script", "/api/upload-video"]),
+        ("无Content-Length时按接收字节拒绝", chunked.status_code == 413),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def test_job_upload_cleanup():
+    """
+    测试提交上传任务时，客户端断开或任务写入失败都会删除已写入的部分文件
+    """
+    print("\n" + "="*60)
+    print("测试3: 上传任务失败清理")
+    print("="*60)
+
+    body = multipart_body(MP4_HEAD + b"\x00" * (app.UPLOAD_CHUNK_KB * 1024 * 2))
+
+    def submit(client):
+        try:
+            asyncio.run(app.submit_upload_video_job(client.request()))
+            return None
+        except Exception as e:
+            return e
+
+    async def failing_submit(kind, payload, idempotency_key=None):
+        raise RuntimeError("database is locked")
+
+    original = (app.CACHE_DIR, app._submit_job)
+    with tempfile.TemporaryDirectory() as tmp:
+        app.CACHE_DIR = tmp
+        try:
+            disconnected = submit(FakeClient(body, disconnect_after=len(body) // PIECE // 2))
+            left_after_disconnect = os.listdir(os.path.join(tmp, "uploads"))
+
+            app._submit_job = failing_submit
+            not_queued = submit(FakeClient(body))
+            left_after_failure = os.listdir(os.path.join(tmp, "uploads"))
+        finally:
+            app.CACHE_DIR, app._submit_job = original
+
+    checks = [
+        ("客户端断开时报错", isinstance(disconnected, ClientDisconnect)),
+        ("断开后不遗留部分文件", left_after_disconnect == []),
+        ("任务写入失败时报错", isinstance(not_queued, RuntimeError)),
+        ("任务写入失败不遗留文件", left_after_failure == []),
+    ]
+
+    all_passed = True
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+        all_passed = all_passed and passed
+    return all_passed
+
+def main():
+    """
+    主函数
+    """
+    results = [
+        ("边接收边写入", test_streamed_save()),
+        ("按Content-Length与接收字节提前拒绝", test_content_length_rejection()),
+        ("上传任务失败清理", test_job_upload_cleanup()),
+    ]
+
+    print("\n" + "="*60)
+    print("测试报告")
+    print("="*60)
+    for test_name, passed in results:
+        print(f"{test_name}: {'✅ 通过' if passed else '❌ 失败'}")
+
+    return 0 if all(passed for _, passed in results) else 1
+
+if __name__ == "__main__":
+    exit(main())